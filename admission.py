@@ -0,0 +1,149 @@
+import os
+import math
+import time
+import threading
+
+from flask import g, jsonify, request
+
+ADMISSION_LIMIT = int(os.getenv("ADMISSION_LIMIT", "16"))
+ADMISSION_MIN_LIMIT = int(os.getenv("ADMISSION_MIN_LIMIT", "2"))
+ADMISSION_MAX_LIMIT = int(os.getenv("ADMISSION_MAX_LIMIT", "64"))
+ADMISSION_QUEUE = int(os.getenv("ADMISSION_QUEUE", "16"))
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "1.0"))
+# Latencia del LLM por encima de la cual se reduce el límite de solicitudes en vuelo
+ADMISSION_TARGET_LATENCY = float(os.getenv("ADMISSION_TARGET_LATENCY", "3.0"))
+
+LATENCY_SMOOTHING = 0.2
+ADJUST_INTERVAL = 1.0
+DECREASE_FACTOR = 0.75
+
+
+class AdmissionController:
+    """Control de admisión con límite de solicitudes en vuelo y una cola de espera corta.
+
+    Si hay lugar, la solicitud entra de inmediato; si no, espera hasta `max_wait` en una
+    cola de a lo sumo `queue_size` solicitudes y, si no consigue lugar, se rechaza.
+    El límite se ajusta con AIMD según la latencia observada del LLM: baja
+    multiplicativamente si supera `target_latency` y sube de a uno cuando está saturado
+    con latencia sana. Una solicitud puede ocupar varios lugares (un lote, uno por
+    elemento); si pesa más que el límite entra solo cuando no hay nada en vuelo."""
+
+    def __init__(self, limit=ADMISSION_LIMIT, min_limit=ADMISSION_MIN_LIMIT, max_limit=ADMISSION_MAX_LIMIT,
+                 queue_size=ADMISSION_QUEUE, max_wait=ADMISSION_MAX_WAIT, target_latency=ADMISSION_TARGET_LATENCY):
+        self.limit = limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self.target_latency = target_latency
+
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._waiting = 0
+        self._peak_in_flight = 0
+        self._latency = None  # promedio móvil exponencial de la latencia del LLM
+        self._last_adjust = time.monotonic()
+        self._stats = {"admitidos": 0, "rechazados_cola_llena": 0, "rechazados_espera": 0,
+                       "espera_total_s": 0.0, "espera_max_s": 0.0, "encolados": 0}
+
+    def _fits(self, weight):
+        return self._in_flight + weight <= self.limit or (self._in_flight == 0 and weight > self.limit)
+
+    def acquire(self, weight=1):
+        """Intentar entrar ocupando `weight` lugares; devuelve el tiempo de espera en segundos o None si se rechaza"""
+        start = time.monotonic()
+        with self._condition:
+            if not self._fits(weight):
+                if self._waiting >= self.queue_size:
+                    self._stats["rechazados_cola_llena"] += 1
+                    return None
+                self._waiting += 1
+                self._stats["encolados"] += 1
+                try:
+                    admitted = self._condition.wait_for(lambda: self._fits(weight), timeout=self.max_wait)
+                finally:
+                    self._waiting -= 1
+                if not admitted:
+                    self._stats["rechazados_espera"] += 1
+                    return None
+
+            self._in_flight += weight
+            self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+            waited = time.monotonic() - start
+            self._stats["admitidos"] += 1
+            self._stats["espera_total_s"] += waited
+            self._stats["espera_max_s"] = max(self._stats["espera_max_s"], waited)
+            return waited
+
+    def release(self, weight=1):
+        with self._condition:
+            self._in_flight -= weight
+            # Con pesos distintos, el primero en la cola puede no caber y otro sí
+            self._condition.notify_all()
+
+    def observe_latency(self, latency):
+        """Registrar la latencia de una llamada al LLM y ajustar el límite si corresponde"""
+        with self._condition:
+            if self._latency is None:
+                self._latency = latency
+            else:
+                self._latency = LATENCY_SMOOTHING * latency + (1 - LATENCY_SMOOTHING) * self._latency
+
+            now = time.monotonic()
+            if now - self._last_adjust < ADJUST_INTERVAL:
+                return
+            self._last_adjust = now
+
+            if self._latency > self.target_latency:
+                self.limit = max(self.min_limit, int(self.limit * DECREASE_FACTOR))
+            elif self._peak_in_flight >= self.limit:
+                self.limit = min(self.max_limit, self.limit + 1)
+                self._condition.notify()
+            self._peak_in_flight = self._in_flight
+
+    def retry_after(self):
+        """Segundos sugeridos para reintentar, según la latencia actual del LLM"""
+        return max(1, math.ceil(self._latency or 1))
+
+    def stats(self):
+        with self._condition:
+            admitted = self._stats["admitidos"] or 1
+            return {
+                "limite": self.limit,
+                "en_vuelo": self._in_flight,
+                "en_espera": self._waiting,
+                "capacidad_cola": self.queue_size,
+                "latencia_llm_s": round(self._latency, 4) if self._latency is not None else None,
+                "rechazados": self._stats["rechazados_cola_llena"] + self._stats["rechazados_espera"],
+                **self._stats,
+                "espera_total_s": round(self._stats["espera_total_s"], 4),
+                "espera_max_s": round(self._stats["espera_max_s"], 4),
+                "espera_promedio_s": round(self._stats["espera_total_s"] / admitted, 4),
+            }
+
+    def init_app(self, app, endpoints, weights=None):
+        """Aplicar la admisión a las vistas de Flask indicadas (nombres de endpoint).
+        `weights` asigna a un endpoint una función que devuelve los lugares que ocupa la solicitud."""
+        endpoints = frozenset(endpoints)
+        weights = weights or {}
+
+        def admit():
+            if request.endpoint not in endpoints:
+                return None
+            weight = max(1, weights[request.endpoint]()) if request.endpoint in weights else 1
+            if self.acquire(weight) is None:
+                response = jsonify({"error": "Servidor saturado, intenta de nuevo más tarde"})
+                response.status_code = 503
+                response.headers["Retry-After"] = str(self.retry_after())
+                return response
+            g.admitted = weight
+            return None
+
+        def leave(exception=None):
+            weight = g.pop("admitted", 0)
+            if weight:
+                self.release(weight)
+
+        app.before_request(admit)
+        app.teardown_request(leave)
+        return self
@@ -1,8 +1,9 @@
 import os
 import sys
-import json
-import re
+import contextvars
 from datetime import datetime
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 
@@ -15,8 +16,23 @@ if sys.platform == "win32":
         pass  
 
 from dotenv import load_dotenv
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_groq import ChatGroq
+
+import pipeline
+from pipeline import (MissingAPIKey, analyze_title, classify_comment, comment_fields, local_comment_analysis,
+                      local_title_analysis, title_fields)
+from coherence import is_coherent_text
+from history_store import normalize_category
+import tenants
+from tenants import TenantRegistry
+from merkle import anchored_content
+from profiling import RequestProfiler, SORT_KEYS
+from admission import AdmissionController
+import idempotency
+from idempotency import (IDEMPOTENCY_HEADER, IDEMPOTENCY_REPLAYED_HEADER, MAX_KEY_LENGTH, FileIdempotencyStore,
+                         IdempotencyConflict, IdempotencyInProgress)
+import deadlines
+from deadlines import run_within_deadline
+from prompts import COMMENT_PROMPTS, TITLE_PROMPTS, current_endpoint
 
 # Cargar variables de entorno
 load_dotenv()
@@ -25,384 +41,84 @@ load_dotenv()
 app = Flask(__name__)
 CORS(app) 
 
-# Configurar claves API
-groq_api_key = os.getenv("GROQ_API_KEY")
-if not groq_api_key:
-    print("Error: No se encontró la clave API de Groq. Asegúrate de configurar GROQ_API_KEY en tu archivo .env")
-    sys.exit(1)
+# Plazo por solicitud (REQUEST_DEADLINE_MS o X-Deadline-Ms) que respetan todas las llamadas al LLM
+deadlines.init_app(app)
 
-model = ChatGroq(groq_api_key=groq_api_key, model="llama-3.3-70b-versatile")
-
-def load_tags():
-    """Cargar tags desde el archivo tags.txt"""
-    try:
-        with open("tags.txt", "r", encoding="utf-8") as file:
-            tags = [line.strip().lower() for line in file if line.strip()]
-        return tags
-    except FileNotFoundError:
-        print("Warning: No se encontró el archivo tags.txt")
-        return []
-    except Exception as e:
-        print(f"Error cargando tags: {str(e)}")
-        return []
+# Perfilado opcional por solicitud (encabezado X-Profile o PROFILE_SAMPLE_RATE)
+request_profiler = RequestProfiler().init_app(app)
 
-def is_coherent_text(text):
-    """Validar si el texto es coherente (más de una palabra y tiene sentido básico)"""
-    text = text.strip()
-    
-    # 1. Verificar que no esté vacío
-    if not text:
-        return False
-    
-    # 2. Verificar que tenga al menos 2 palabras
-    words = text.split()
-    if len(words) < 2:
-        return False
-    
-    # 3. Verificar que no sean solo caracteres especiales o números
-    clean_text = re.sub(r'[^\w\s]', '', text)
-    if len(clean_text.strip()) < 3:
-        return False
-    
-    # 4. Verificar que no sean solo repeticiones de la misma palabra
-    unique_words = set(word.lower() for word in words if word.isalpha())
-    if len(unique_words) < 2:
-        return False
-    
-    # 5. Detectar incoherencia semántica usando reglas híbridas
-    # Lista de patrones específicamente incoherentes
-    incoherent_patterns = [
-        "casa azul mojado", "perro volando matemáticas", "mesa correr feliz",
-        "computadora cantar verde", "silla bailar número", "árbol escribir calor",
-        "teléfono dormir azúcar", "libro nadar rojo", "ventana comer fríos",
-        "zapato volar música", "reloj bailar agua", "puerta correr números"
-    ]
-    
-    # Si es exactamente uno de estos casos, es incoherente
-    if text.lower().strip() in incoherent_patterns:
-        return False
-    
-    # Verificar patrones de incoherencia (sustantivo + verbo incongruente + adjetivo/sustantivo)
-    # Ejemplo: "casa cantar azul" (objeto físico + acción incompatible + descriptor)
-    if len(words) == 3:
-        # Objetos físicos que no pueden realizar ciertas acciones
-        objects = {'casa', 'mesa', 'silla', 'puerta', 'ventana', 'libro', 'teléfono', 'computadora'}
-        impossible_actions = {'cantar', 'bailar', 'correr', 'volar', 'nadar', 'dormir', 'comer'}
-        
-        word1, word2, word3 = [w.lower() for w in words]
-        
-        # Si primer palabra es objeto y segunda es acción imposible
-        if word1 in objects and word2 in impossible_actions:
-            return False
-    
-    # Verificar estructura mínima de oración en español
-    structure_indicators = {
-        'el', 'la', 'los', 'las', 'un', 'una', 'unos', 'unas',
-        'es', 'está', 'son', 'están', 'tiene', 'tienen', 'hay', 'fue', 'era',
-        'de', 'del', 'en', 'con', 'por', 'para', 'desde', 'hasta', 'sobre',
-        'que', 'se', 'me', 'te', 'le', 'nos', 'les', 'mi', 'tu', 'su',
-        'muy', 'más', 'menos', 'bien', 'mal', 'no', 'sí', 'y', 'o', 'pero',
-        'quiero', 'necesito', 'creo', 'pienso', 'siento', 'veo', 'escucho',
-        'necesitamos', 'queremos', 'podemos', 'debemos'
-    }
-    
-    text_words = set(word.lower() for word in words)
-    has_structure = bool(text_words.intersection(structure_indicators))
-    
-    if not has_structure:
-        return False
-    
-    return True
-
-def extract_tags_from_text(text, available_tags):
-    """Extraer tags relevantes del texto - cantidad dinámica según longitud"""
-    text_lower = text.lower()
-    tag_scores = {}  
-    # Palabras del texto
-    words_in_text = re.findall(r'\b\w+\b', text_lower)
-    
-    # Determinar cantidad máxima de tags según longitud del texto
-    if len(words_in_text) <= 4:  
-        max_tags = 1
-    elif len(words_in_text) <= 8: 
-        max_tags = 2
-    else:  
-        max_tags = 3
-    
-    for tag in available_tags:
-        score = 0
-        matches = []  
-        
-        # 1. Búsqueda exacta
-        for i, word in enumerate(words_in_text):
-            if word == tag:
-                matches.append(i)
-                score += 3  
-        
-        # 2. Búsqueda de variaciones simples
-        if not matches: 
-            for i, word in enumerate(words_in_text):
-                if word == tag + 's' or tag == word + 's':
-                    matches.append(i)
-                    score += 2  
-                    break
-                elif word == tag + 'es' or tag == word + 'es':
-                    matches.append(i)
-                    score += 2
-                    break
-        
-        # Si encontramos el tag, calcular puntuación final
-        if matches:
-            score += len(tag) * 0.1
-            first_position = min(matches)
-            position_bonus = max(0, 5 - first_position)
-            score += position_bonus
-            frequency_bonus = len(matches) * 0.5
-            score += frequency_bonus
-            tag_scores[tag] = score
-    
-    sorted_tags = sorted(tag_scores.items(), key=lambda x: x[1], reverse=True)
-    most_relevant_tags = [tag for tag, score in sorted_tags[:max_tags]]
-    
-    return most_relevant_tags
-
-def categorize_comment(comment):
-    """Categorizar el comentario usando LLM"""
-    template = """
-    Analiza el siguiente comentario y categorizalo EXACTAMENTE en una de estas cuatro categorías:
-    - "Sugerencia": Si el comentario propone mejoras, ideas, cambios o recomendaciones constructivas
-    - "Opinion": Si el comentario expresa una opinión personal neutral o positiva, experiencias sin ser ofensivo
-    - "Queja": Si el comentario contiene lenguaje ofensivo, discriminatorio, amenazas, insultos, críticas muy negativas, o sentimientos muy negativos hacia personas (ej: "el maestro es malo", "odio a...", "es terrible", etc.)
-    - "Vida universitaria": Si el comentario se refiere específicamente a experiencias, situaciones, actividades o aspectos de la vida universitaria, académica o estudiantil que no encajan en las otras categorías
-
-    Reglas importantes:
-    1. Responde SOLO con una de estas cuatro palabras: "Sugerencia", "Opinion", "Queja", o "Vida universitaria"
-    2. No agregues explicaciones adicionales
-    3. Comentarios negativos sobre personas (maestros, compañeros, etc.) van en "Queja"
-    4. Comentarios sobre clases, universidad, estudios, campus, etc. van en "Vida universitaria"
-    5. Si hay duda, prioriza en este orden: Queja > Vida universitaria > Sugerencia > Opinion
-
-    Ejemplos:
-    - "El maestro es malo" → Queja
-    - "La clase de matemáticas es difícil" → Vida universitaria
-    - "Deberían mejorar la cafetería" → Sugerencia
-    - "Me gusta estudiar" → Opinion
-
-    Comentario: "{comment}"
-    
-    Categoría:
-    """
-    
-    prompt = ChatPromptTemplate.from_template(template)
-    chain = prompt | model
-    
-    try:
-        response = ""
-        for chunk in chain.stream({"comment": comment}):
-            response += chunk.content
-        
-        # Limpiar la respuesta y validar
-        category = response.strip()
-        valid_categories = ["Sugerencia", "Opinion", "Queja", "Vida universitaria"]
-        
-        if category in valid_categories:
-            return category
-        else:
-            for valid_cat in valid_categories:
-                if valid_cat.lower() in category.lower():
-                    return valid_cat
-            return "Opinion"
-            
-    except Exception as e:
-        print(f"Error categorizando comentario: {str(e)}")
-        return "Opinion"
-
-def formalize_hate_speech(comment):
-    """Convertir comentario ofensivo a lenguaje formal y apropiado"""
-    template = """
-    El siguiente comentario contiene lenguaje ofensivo. Conviértelo a un comentario formal, respetuoso y constructivo que exprese la misma idea pero de manera apropiada para un entorno académico o profesional.
-
-    Reglas:
-    1. Eliminar todas las palabras ofensivas, vulgaridades o insultos
-    2. Mantener la esencia del mensaje pero en tono constructivo
-    3. Usar lenguaje formal y respetuoso
-    4. Si es una queja, convertirla en feedback constructivo
-    5. Máximo 300 caracteres
-    6. Responder SOLO con el texto formalizado, sin explicaciones adicionales
-
-    Comentario original: "{comment}"
-
-    Comentario formalizado:
-    """
-    
-    prompt = ChatPromptTemplate.from_template(template)
-    chain = prompt | model
-    
-    try:
-        response = ""
-        for chunk in chain.stream({"comment": comment}):
-            response += chunk.content
-        
-        formalized = response.strip()
-        
-        if formalized.startswith('"') and formalized.endswith('"'):
-            formalized = formalized[1:-1]
-        elif formalized.startswith("'") and formalized.endswith("'"):
-            formalized = formalized[1:-1]
-        
-        formalized = formalized.replace('""', '').replace("''", '')
-        
-        if len(formalized) < 10:
-            formalized = "Comentario convertido a lenguaje apropiado por contener contenido ofensivo."
-        
-        return formalized
-        
-    except Exception as e:
-        print(f"Error formalizando comentario: {str(e)}")
-        return "Comentario modificado por contener contenido inapropiado."
-
-def save_to_json(data, filename="comentarios_analizados.json"):
-    """Guardar datos en archivo JSON"""
-    try:
-        if os.path.exists(filename):
-            with open(filename, "r", encoding="utf-8") as file:
-                existing_data = json.load(file)
-        else:
-            existing_data = []
-        
-        existing_data.append(data)
-        
-        with open(filename, "w", encoding="utf-8") as file:
-            json.dump(existing_data, file, ensure_ascii=False, indent=2)
-        
-        return True
-    except Exception as e:
-        print(f"Error guardando en JSON: {str(e)}")
-        return False
-
-def load_analysis_history():
-    """Cargar historial de análisis desde JSON"""
-    try:
-        if os.path.exists("comentarios_analizados.json"):
-            with open("comentarios_analizados.json", "r", encoding="utf-8") as file:
-                return json.load(file)
-        return []
-    except Exception as e:
-        print(f"Error cargando historial: {str(e)}")
-        return []
-
-# Cargar tags disponibles
-available_tags = load_tags()
+# Modelo y prompts del pipeline compartido con los scripts; sin clave de Groq la API no arranca
+try:
+    prompt_registry = pipeline.get_prompt_registry()
+except MissingAPIKey:
+    print("Error: No se encontró la clave API de Groq. Asegúrate de configurar GROQ_API_KEY en tu archivo .env")
+    sys.exit(1)
 
-def analyze_title(title):
-    """Analizar título: verificar coherencia, detectar contenido ofensivo y dar recomendación"""
-    
-    # 1. Verificar coherencia básica del título
-    is_coherent = is_coherent_text(title)
-    
-    # 2. Detectar si es ofensivo usando IA
-    offensive_template = """
-    Analiza el siguiente título y determina si contiene contenido ofensivo, discriminatorio, vulgar o inapropiado.
-    
-    Responde EXACTAMENTE con una de estas dos palabras:
-    - "OFENSIVO": Si contiene insultos, discriminación, vulgaridades, lenguaje de odio o contenido inapropiado
-    - "APROPIADO": Si es un título normal y apropiado
-    
-    Título: "{title}"
-    
-    Clasificación:
-    """
-    
-    prompt = ChatPromptTemplate.from_template(offensive_template)
-    chain = prompt | model
-    
-    try:
-        response = ""
-        for chunk in chain.stream({"title": title}):
-            response += chunk.content
-        
-        is_offensive = "OFENSIVO" in response.strip().upper()
-        
-    except Exception as e:
-        print(f"Error detectando contenido ofensivo: {str(e)}")
-        is_offensive = False
-    
-    # 3. Generar recomendación automática basada en el análisis
-    recommendation = None
-    titulo_sugerido = None
-    
-    if not is_coherent:
-        # Si no es coherente, sugerir que lo reformule
-        recommendation = "El título necesita ser más claro y comprensible."
-        titulo_sugerido = None
-        
-    elif is_offensive:
-        # Si es ofensivo, generar automáticamente una versión apropiada
-        fix_template = """
-        El siguiente título contiene contenido ofensivo. Genera una versión alternativa que sea:
-        1. Respetuosa y apropiada
-        2. Mantenga la esencia del mensaje original
-        3. Sea clara y profesional
-        4. Máximo 50 caracteres
-        
-        Título ofensivo: "{title}"
-        
-        Responde SOLO con el título corregido, sin explicaciones adicionales.
-        
-        Título corregido:
-        """
-        
-        prompt = ChatPromptTemplate.from_template(fix_template)
-        chain = prompt | model
-        
+# Lotes de /procesar/lote y /procesartitulos/lote: máximo de elementos y cuántos se analizan a la vez
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "32"))
+batch_executor = ThreadPoolExecutor(max_workers=int(os.getenv("BATCH_WORKERS", "32")), thread_name_prefix="lote")
+
+def batch_weight(field):
+    """Lugares de admisión de un lote: uno por elemento (un cuerpo inválido ocupa uno y recibe 400)"""
+    data = request.get_json(silent=True)
+    items = data.get(field) if isinstance(data, dict) else data
+    return min(len(items), BATCH_MAX_ITEMS) if isinstance(items, list) else 1
+
+# Control de admisión de los endpoints que llaman al LLM; el límite se adapta a su latencia.
+# Un lote ocupa un lugar por elemento: si no, 32 análisis entrarían por el lugar de uno
+admission = AdmissionController().init_app(
+    app, ("recibir_y_procesar_comentario", "procesar_comentario_actual", "procesar_titulo",
+          "procesar_lote_comentarios", "procesar_lote_titulos"),
+    weights={"procesar_lote_comentarios": lambda: batch_weight("comentarios"),
+             "procesar_lote_titulos": lambda: batch_weight("titulos")})
+prompt_registry.accounting.add_listener(lambda prompt_key, endpoint, latency: admission.observe_latency(latency))
+
+# Pool para esperar el análisis con plazo; separado de pipeline.llm_executor porque sus tareas también lo usan
+deadline_executor = ThreadPoolExecutor(max_workers=int(os.getenv("LLM_WORKERS", "16")), thread_name_prefix="deadline")
+
+# Respuestas por clave de idempotencia (encabezado Idempotency-Key o "idempotency_key" de cada elemento de un lote),
+# en archivos junto al historial: las comparten todos los workers y sobreviven a un reinicio.
+# Las vencidas se purgan en un hilo aparte, fuera de las solicitudes
+idempotency_store = FileIdempotencyStore().start()
+
+# Recursos por tenant (vocabulario de tags, historiales, escritores, lotes y tendencias), cargados
+# bajo demanda y liberados por LRU; el tenant por defecto usa tags.txt y historial/ como siempre
+tenant_registry = TenantRegistry().start()
+tenant_registry.init_app(app)
+
+def complete_in_background(tenant, writer, record_id, future, to_fields, prompts):
+    """Actualizar el registro degradado (y su procedencia) cuando termine el análisis con el LLM"""
+    # El tenant queda en uso hasta aplicar la actualización, para que no se libere su escritor
+    tenant_registry.retain(tenant)
+    def done(finished):
+        fields = {}
         try:
-            response = ""
-            for chunk in chain.stream({"title": title}):
-                response += chunk.content
-            
-            titulo_sugerido = response.strip()
-            
-            # Limpiar comillas si las tiene
-            if titulo_sugerido.startswith('"') and titulo_sugerido.endswith('"'):
-                titulo_sugerido = titulo_sugerido[1:-1]
-            elif titulo_sugerido.startswith("'") and titulo_sugerido.endswith("'"):
-                titulo_sugerido = titulo_sugerido[1:-1]
-            
-            recommendation = f"Título corregido automáticamente"
-            
+            fields = {**to_fields(finished.result()), **prompt_registry.provenance(prompts), "degraded": False}
         except Exception as e:
-            print(f"Error generando título corregido: {str(e)}")
-            titulo_sugerido = "Título modificado por contener contenido inapropiado"
-            recommendation = "Título corregido automáticamente"
-    
-    else:
-        # Si es coherente y apropiado, dar validación positiva
-        recommendation = "Título apropiado y coherente"
-        titulo_sugerido = None
-    
-    return {
-        "is_coherent": is_coherent,
-        "is_offensive": is_offensive,
-        "recommendation": recommendation,
-        "titulo_sugerido": titulo_sugerido,  # Nueva propiedad
-        "status": "apropiado" if (is_coherent and not is_offensive) else "requiere_revision"
-    }
+            print(f"Error completando el análisis {record_id} en segundo plano: {str(e)}")
+        try:
+            writer.update(record_id, {**fields, "pendiente_llm": False, "completado": datetime.now().isoformat()})
+        finally:
+            tenant_registry.release(tenant)
+    future.add_done_callback(done)
 
 
 # RUTAS DE LA API
 
+@app.before_request
+def assign_prompt_endpoint():
+    """Atribuir los tokens de las llamadas al LLM al endpoint de la solicitud"""
+    current_endpoint.set(request.endpoint)
+
 @app.route("/")
 def home():
     return jsonify({"message": "Servidor activo"}), 200
 
 
-# Variable global para almacenar el comentario actual
-comentario_actual = None
-
 @app.route('/comentario', methods=['POST'])
 def obtener_comentario():
-    """Endpoint para recibir un comentario y establecerlo como comentario actual"""
-    global comentario_actual
+    """Endpoint para recibir un comentario y establecerlo como comentario actual (uno por tenant)"""
+    tenant = tenants.current()
     
     try:
         data = request.get_json() if request.is_json else {}
@@ -421,6 +137,8 @@ def obtener_comentario():
             else:
                 comentario_actual = str(data)
         
+        tenant.current_comment = comentario_actual
+        
         return jsonify({
             "success": True,
             "data": {
@@ -438,7 +156,7 @@ def obtener_comentario():
 @app.route('/comentario/actual', methods=['GET'])
 def obtener_comentario_actual():
     """Endpoint para obtener el comentario actual guardado"""
-    global comentario_actual
+    comentario_actual = tenants.current().current_comment
     
     if comentario_actual is None:
         return jsonify({
@@ -455,7 +173,8 @@ def obtener_comentario_actual():
 @app.route('/comentario', methods=['GET'])
 def procesar_comentario_actual():
     """Endpoint para procesar automáticamente el comentario actual con IA"""
-    global comentario_actual
+    tenant = tenants.current()
+    comentario_actual = tenant.current_comment
     
     try:
         # Verificar que hay un comentario actual
@@ -475,34 +194,39 @@ def procesar_comentario_actual():
                 "comentario_recibido": comentario_actual
             }), 400
         
-        # 2. Categorizar el comentario
-        categoria = categorize_comment(comentario_actual)
+        # 2. Categorizar el comentario y, si es una queja (hate speech), formalizarlo
+        result, pending = run_within_deadline(deadline_executor, classify_comment, comentario_actual)
+        degraded = pending is not None
+        categoria, comentario_formalizado = local_comment_analysis(comentario_actual) if degraded else result
         
         # 3. Extraer tags
-        tags = extract_tags_from_text(comentario_actual, available_tags)
+        tag_index = tenant.tag_vocabulary.current()
+        tags = tag_index.extract(comentario_actual)
         
-        # 4. Si es una queja (hate speech), formalizarlo
-        comentario_final = comentario_actual
-        comentario_formalizado = None
-        
-        if categoria == "Queja":
-            comentario_formalizado = formalize_hate_speech(comentario_actual)
-        
-        # Crear el análisis completo
+        # 4. Crear el análisis completo
         analysis_data = {
-            "id": len(load_analysis_history()) + 1,
+            "id": tenant.comments_writer.allocate_id(),
             "timestamp": datetime.now().isoformat(),
             "comentario_original": comentario_actual,
             "comentario_formalizado": comentario_formalizado,  # Solo si es Queja
             "categoria": categoria,
             "tags": tags,
-            "is_coherent": is_coherent
+            "tags_version": tag_index.version,
+            "is_coherent": is_coherent,
+            "degraded": degraded,  # Resultado local: el LLM no respondió dentro del plazo
+            "pendiente_llm": deadlines.completes_in_background(pending),
+            # Versiones de los prompts y modelo (None si el resultado es local), para reetiquetar después
+            **(prompt_registry.provenance(COMMENT_PROMPTS) if not degraded else {"prompt_version": None, "modelo": None})
         }
         
         # Guardar el análisis
-        if save_to_json(analysis_data):
+        if tenant.comments_writer.submit(analysis_data):
+            if analysis_data["pendiente_llm"]:
+                complete_in_background(tenant, tenant.comments_writer, analysis_data["id"], pending,
+                                       comment_fields, COMMENT_PROMPTS)
+            
             # Limpiar el comentario actual después de procesarlo
-            comentario_actual = None
+            tenant.current_comment = None
             
             return jsonify({
                 "success": True,
@@ -521,15 +245,157 @@ def procesar_comentario_actual():
 
 
 
+def run_idempotent(tenant, scope, key, text, analyze):
+    """(cuerpo, estado, reutilizada): con clave, un reintento recibe la respuesta ya calculada sin repetir el análisis"""
+    if key is None:
+        body, status = analyze()
+        return body, status, False
+    if not idempotency.valid_key(key):
+        return {"error": f"La clave de idempotencia debe tener entre 1 y {MAX_KEY_LENGTH} caracteres imprimibles"}, 400, False
+    try:
+        return idempotency_store.run((tenant.name, scope, key), idempotency.fingerprint(text), analyze)
+    except IdempotencyConflict as e:
+        return {"error": str(e)}, 422, False
+    except IdempotencyInProgress as e:
+        return {"error": str(e)}, 409, False
+
+def idempotent_response(body, status, replayed):
+    response = jsonify(body)
+    response.status_code = status
+    if replayed:
+        response.headers[IDEMPOTENCY_REPLAYED_HEADER] = "true"
+    return response
+
+def analyze_comment_request(tenant, comentario, comentario_recibido=None):
+    """Analizar un comentario como /procesar y guardarlo: devuelve (cuerpo, estado)"""
+    # 1. Validar coherencia del texto
+    is_coherent = is_coherent_text(comentario)
+
+    if not is_coherent:
+        # Limpiar comentario actual si no es coherente
+        tenant.current_comment = None
+        return {
+            "error": "El comentario no es coherente o no tiene suficiente contenido válido",
+            "comentario_recibido": comentario_recibido if comentario_recibido is not None else comentario
+        }, 400
+
+    # 2. Categorizar el comentario y, si es una queja (hate speech), formalizarlo
+    result, pending = run_within_deadline(deadline_executor, classify_comment, comentario)
+    degraded = pending is not None
+    categoria, comentario_formalizado = local_comment_analysis(comentario) if degraded else result
+
+    # 3. Extraer tags
+    tag_index = tenant.tag_vocabulary.current()
+    tags = tag_index.extract(comentario)
+
+    # 4. Crear el análisis completo
+    analysis_data = {
+        "id": tenant.comments_writer.allocate_id(),
+        "timestamp": datetime.now().isoformat(),
+        "comentario_original": comentario,
+        "comentario_formalizado": comentario_formalizado,  # Solo si es Queja
+        "categoria": categoria,
+        "tags": tags,
+        "tags_version": tag_index.version,
+        "is_coherent": is_coherent,
+        "degraded": degraded,  # Resultado local: el LLM no respondió dentro del plazo
+        "pendiente_llm": deadlines.completes_in_background(pending),
+        # Versiones de los prompts y modelo (None si el resultado es local), para reetiquetar después
+        **(prompt_registry.provenance(COMMENT_PROMPTS) if not degraded else {"prompt_version": None, "modelo": None})
+    }
+
+    # 5. Guardar el análisis y limpiar el comentario actual
+    saved = tenant.comments_writer.submit(analysis_data)
+    tenant.current_comment = None
+    if not saved:
+        return {"error": "Error al guardar el análisis"}, 500
+
+    if analysis_data["pendiente_llm"]:
+        complete_in_background(tenant, tenant.comments_writer, analysis_data["id"], pending,
+                               comment_fields, COMMENT_PROMPTS)
+
+    return {
+        "success": True,
+        "data": analysis_data,
+        "message": "Comentario recibido, procesado y analizado exitosamente en una sola operación"
+    }, 200
+
+def analyze_title_request(tenant, titulo, titulo_recibido=None):
+    """Analizar un título como /procesartitulos y guardarlo: devuelve (cuerpo, estado)"""
+    # Analizar el título usando la función específica, dentro del plazo de la solicitud
+    analysis_result, pending = run_within_deadline(deadline_executor, analyze_title, titulo)
+    degraded = pending is not None
+    if degraded:
+        analysis_result = local_title_analysis(titulo)
+
+    # Crear respuesta completa
+    response_data = {
+        "id": tenant.titles_writer.allocate_id(),
+        "timestamp": datetime.now().isoformat(),
+        "titulo_original": titulo,
+        "es_coherente": analysis_result["is_coherent"],
+        "es_ofensivo": analysis_result["is_offensive"],
+        "recomendacion": analysis_result["recommendation"],
+        "titulo_sugerido": analysis_result["titulo_sugerido"],  # Nuevo campo
+        "estado": analysis_result["status"],
+        "degraded": degraded,
+        "pendiente_llm": deadlines.completes_in_background(pending),
+        **(prompt_registry.provenance(TITLE_PROMPTS) if not degraded else {"prompt_version": None, "modelo": None})
+    }
+
+    # Guardar el análisis en el historial (escritura en segundo plano)
+    if tenant.titles_writer.submit(response_data) and response_data["pendiente_llm"]:
+        complete_in_background(tenant, tenant.titles_writer, response_data["id"], pending, title_fields, TITLE_PROMPTS)
+
+    return {
+        "success": True,
+        "data": response_data,
+        "message": "Título analizado exitosamente"
+    }, 200
+
+def batch_items(data, field, text_fields):
+    """Elementos de un lote: (texto, clave de idempotencia) desde una lista de textos u objetos"""
+    items = data.get(field) if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        raise ValueError(f"Se requiere una lista no vacía en el campo '{field}'")
+    if len(items) > BATCH_MAX_ITEMS:
+        raise ValueError(f"El lote admite como máximo {BATCH_MAX_ITEMS} elementos")
+
+    parsed = []
+    for item in items:
+        if isinstance(item, dict):
+            text = next((item[name] for name in text_fields if isinstance(item.get(name), str)), None)
+            key = item.get("idempotency_key")
+            parsed.append((text, str(key) if key is not None else None))
+        else:
+            parsed.append((item if isinstance(item, str) else None, None))
+    return parsed
+
+def run_batch(tenant, scope, items, analyze):
+    """Analizar los elementos de un lote en paralelo; cada resultado lleva el cuerpo y el estado de su análisis"""
+    def run_item(text, key):
+        if not text or not text.strip():
+            return {"error": "Se requiere un texto válido", "status": 400, "reutilizado": False}
+        try:
+            body, status, replayed = run_idempotent(tenant, scope, key, text.strip(),
+                                                    lambda: analyze(tenant, text.strip(), text))
+        except Exception as e:
+            body, status, replayed = {"error": f"Error interno del servidor: {str(e)}"}, 500, False
+        return {**body, "status": status, "reutilizado": replayed}
+
+    # Cada elemento conserva el contexto de la solicitud (plazo y endpoint para la contabilidad de tokens)
+    futures = [batch_executor.submit(contextvars.copy_context().run, run_item, text, key) for text, key in items]
+    return [future.result() for future in futures]
+
 @app.route('/procesar', methods=['POST'])
 def recibir_y_procesar_comentario():
     """Endpoint que recibe un comentario y lo procesa automáticamente con IA en una sola llamada"""
-    global comentario_actual
-    
+    tenant = tenants.current()
+
     try:
         # 1. RECIBIR EL COMENTARIO (igual que el POST /comentario)
         data = request.get_json() if request.is_json else {}
-        
+
         # Extraer el comentario de data
         if 'comentario' in data:
             comentario_recibido = data['comentario']
@@ -543,80 +409,55 @@ def recibir_y_procesar_comentario():
                 comentario_recibido = list(data.values())[0]
             else:
                 comentario_recibido = str(data)
-        
+
         if not comentario_recibido or comentario_recibido.strip() == "":
             return jsonify({
                 "error": "Se requiere un comentario válido"
             }), 400
-        
-        # Establecer como comentario actual temporalmente
-        comentario_actual = comentario_recibido.strip()
-        
-        # 2. PROCESAR EL COMENTARIO (igual que el GET /comentario)
-        
-        # 2.1. Validar coherencia del texto
-        is_coherent = is_coherent_text(comentario_actual)
-        
-        if not is_coherent:
-            # Limpiar comentario actual si no es coherente
-            comentario_actual = None
-            return jsonify({
-                "error": "El comentario no es coherente o no tiene suficiente contenido válido",
-                "comentario_recibido": comentario_recibido
-            }), 400
-        
-        # 2.2. Categorizar el comentario
-        categoria = categorize_comment(comentario_actual)
-        
-        # 2.3. Extraer tags
-        tags = extract_tags_from_text(comentario_actual, available_tags)
-        
-        # 2.4. Si es una queja (hate speech), formalizarlo
-        comentario_formalizado = None
-        
-        if categoria == "Queja":
-            comentario_formalizado = formalize_hate_speech(comentario_actual)
-        
-        # 2.5. Crear el análisis completo
-        analysis_data = {
-            "id": len(load_analysis_history()) + 1,
-            "timestamp": datetime.now().isoformat(),
-            "comentario_original": comentario_actual,
-            "comentario_formalizado": comentario_formalizado,  # Solo si es Queja
-            "categoria": categoria,
-            "tags": tags,
-            "is_coherent": is_coherent
-        }
-        
-        # 2.6. Guardar el análisis
-        if save_to_json(analysis_data):
-            # Limpiar el comentario actual después de procesarlo
-            comentario_actual = None
-            
-            return jsonify({
-                "success": True,
-                "data": analysis_data,
-                "message": "Comentario recibido, procesado y analizado exitosamente en una sola operación"
-            })
-        else:
-            comentario_actual = None
-            return jsonify({
-                "error": "Error al guardar el análisis"
-            }), 500
-            
+
+        # Procesar sobre una variable local: las solicitudes concurrentes no se pisan entre sí
+        comentario = comentario_recibido.strip()
+
+        # 2. PROCESAR EL COMENTARIO (igual que el GET /comentario); un reintento con la misma
+        # Idempotency-Key recibe la respuesta original sin repetir el análisis
+        body, status, replayed = run_idempotent(
+            tenant, "comentarios", request.headers.get(IDEMPOTENCY_HEADER), comentario,
+            lambda: analyze_comment_request(tenant, comentario, comentario_recibido))
+        return idempotent_response(body, status, replayed)
+
     except Exception as e:
-        comentario_actual = None
+        tenant.current_comment = None
         return jsonify({
             "error": f"Error interno del servidor: {str(e)}"
         }), 500
 
+@app.route('/procesar/lote', methods=['POST'])
+def procesar_lote_comentarios():
+    """Endpoint que analiza varios comentarios en una sola solicitud ({"comentarios": [...]})"""
+    tenant = tenants.current()
+
+    try:
+        items = batch_items(request.get_json(silent=True), "comentarios", ("comentario", "text"))
+    except ValueError as e:
+        return jsonify({
+            "error": str(e)
+        }), 400
+
+    results = run_batch(tenant, "comentarios", items, analyze_comment_request)
+    return jsonify({
+        "success": True,
+        "data": results,
+        "message": f"Lote de {len(results)} comentarios procesado"
+    })
+
 @app.route('/procesartitulos', methods=['POST'])
 def procesar_titulo():
     """Endpoint para analizar títulos: verificar coherencia, detectar contenido ofensivo y dar recomendación"""
-    
+    tenant = tenants.current()
+
     try:
         data = request.get_json() if request.is_json else {}
-        
+
         # Extraer el título de data
         if 'titulo' in data:
             titulo = data['titulo']
@@ -634,43 +475,254 @@ def procesar_titulo():
                 return jsonify({
                     "error": "Se requiere un campo 'titulo' o 'title' en el JSON"
                 }), 400
-        
+
         if not titulo or titulo.strip() == "":
             return jsonify({
                 "error": "El título no puede estar vacío"
             }), 400
-        
+
         titulo = titulo.strip()
-        
-        # Analizar el título usando la función específica
-        analysis_result = analyze_title(titulo)
-        
-        # Crear respuesta completa
-        response_data = {
-            "id": len(load_analysis_history()) + 1,
-            "timestamp": datetime.now().isoformat(),
-            "titulo_original": titulo,
-            "es_coherente": analysis_result["is_coherent"],
-            "es_ofensivo": analysis_result["is_offensive"],
-            "recomendacion": analysis_result["recommendation"],
-            "titulo_sugerido": analysis_result["titulo_sugerido"],  # Nuevo campo
-            "estado": analysis_result["status"]
-        }
-        
-        # Guardar el análisis en el historial
-        save_to_json(response_data, "titulos_analizados.json")
-        
-        return jsonify({
-            "success": True,
-            "data": response_data,
-            "message": "Título analizado exitosamente"
-        })
-        
+
+        # Un reintento con la misma Idempotency-Key recibe la respuesta original
+        body, status, replayed = run_idempotent(
+            tenant, "titulos", request.headers.get(IDEMPOTENCY_HEADER), titulo,
+            lambda: analyze_title_request(tenant, titulo))
+        return idempotent_response(body, status, replayed)
+
     except Exception as e:
         return jsonify({
             "error": f"Error interno del servidor: {str(e)}"
         }), 500
 
+@app.route('/procesartitulos/lote', methods=['POST'])
+def procesar_lote_titulos():
+    """Endpoint que analiza varios títulos en una sola solicitud ({"titulos": [...]})"""
+    tenant = tenants.current()
+
+    try:
+        items = batch_items(request.get_json(silent=True), "titulos", ("titulo", "title"))
+    except ValueError as e:
+        return jsonify({
+            "error": str(e)
+        }), 400
+
+    results = run_batch(tenant, "titulos", items, analyze_title_request)
+    return jsonify({
+        "success": True,
+        "data": results,
+        "message": f"Lote de {len(results)} títulos procesado"
+    })
+
+@app.route('/analisis/<int:analysis_id>', methods=['GET'])
+def obtener_analisis(analysis_id):
+    """Endpoint para consultar un análisis por id, aunque todavía no se haya escrito en disco"""
+    tenant = tenants.current()
+    analysis = tenant.comments_writer.get(analysis_id)
+    
+    if analysis is None:
+        return jsonify({
+            "error": "No se encontró el análisis solicitado"
+        }), 404
+    
+    return jsonify({
+        "success": True,
+        "data": analysis
+    })
+
+@app.route('/titulos/<int:analysis_id>', methods=['GET'])
+def obtener_analisis_titulo(analysis_id):
+    """Endpoint para consultar el análisis de un título por id"""
+    tenant = tenants.current()
+    analysis = tenant.titles_writer.get(analysis_id)
+    
+    if analysis is None:
+        return jsonify({
+            "error": "No se encontró el análisis solicitado"
+        }), 404
+    
+    return jsonify({
+        "success": True,
+        "data": analysis
+    })
+
+@app.route('/analisis/<int:analysis_id>/prueba', methods=['GET'])
+def prueba_inclusion(analysis_id):
+    """Endpoint con la prueba de inclusión de Merkle de un análisis, la raíz de su lote y el contenido anclado"""
+    tenant = tenants.current()
+    proof = tenant.merkle_batcher.proof(analysis_id)
+    analysis = tenant.comments_writer.get(analysis_id)
+    
+    if proof is None:
+        if analysis is None:
+            return jsonify({
+                "error": "No se encontró el análisis solicitado"
+            }), 404
+        # Todavía no se confirma en disco o su lote sigue abierto
+        return jsonify({
+            "success": False,
+            "message": "El análisis aún no pertenece a un lote sellado"
+        }), 202
+    
+    return jsonify({
+        "success": True,
+        "data": {**proof, "contenido": anchored_content(analysis) if analysis is not None else None}
+    })
+
+@app.route('/lotes', methods=['GET'])
+def listar_lotes():
+    """Endpoint con los lotes sellados más recientes y sus raíces"""
+    return jsonify({
+        "success": True,
+        "data": tenants.current().merkle_batcher.recent_batches()
+    })
+
+@app.route('/lotes/<int:batch_id>', methods=['GET'])
+def obtener_lote(batch_id):
+    """Endpoint con la raíz de un lote sellado y los hashes de sus hojas"""
+    tenant = tenants.current()
+    batch = tenant.merkle_batcher.get_batch(batch_id)
+    
+    if batch is None:
+        return jsonify({
+            "error": "No se encontró el lote solicitado"
+        }), 404
+    
+    return jsonify({
+        "success": True,
+        "data": batch
+    })
+
+@app.route('/historial', methods=['GET'])
+def exportar_historial():
+    """Endpoint para exportar los análisis de un rango de fechas (?desde=...&hasta=..., formato ISO)"""
+    desde = request.args.get('desde')
+    hasta = request.args.get('hasta')
+    
+    return jsonify({
+        "success": True,
+        "data": tenants.current().comments_history.read_range(desde, hasta)
+    })
+
+@app.route('/estadisticas', methods=['GET'])
+def estadisticas_historial():
+    """Endpoint con conteos por categoría y tags más comunes en un rango de fechas"""
+    tenant = tenants.current()
+    history = tenant.comments_history.read_range(request.args.get('desde'), request.args.get('hasta'))
+    
+    categorias = Counter(normalize_category(item["categoria"]) for item in history)
+    tags = Counter(tag for item in history for tag in item.get("tags", []))
+    
+    return jsonify({
+        "success": True,
+        "data": {
+            "total": len(history),
+            "categorias": dict(categorias),
+            "tags_mas_comunes": tags.most_common(10)
+        }
+    })
+
+@app.route('/tendencias', methods=['GET'])
+def tendencias_tags():
+    """Endpoint con los tags en tendencia (?horas=24&categoria=Queja&n=10) y los más comunes de la ventana"""
+    try:
+        horas = int(request.args.get('horas', 24))
+        n = int(request.args.get('n', 10))
+    except ValueError:
+        return jsonify({
+            "error": "Los parámetros 'horas' y 'n' deben ser números enteros"
+        }), 400
+    categoria = request.args.get('categoria')
+    tenant = tenants.current()
+    # Lo que guardaron otros workers, el panel o los scripts (a lo sumo cada TRENDING_SYNC_SECONDS)
+    tenant.trending_tags.sync(tenant.comments_history)
+    
+    return jsonify({
+        "success": True,
+        "data": {
+            "tendencias": tenant.trending_tags.trending(horas, categoria, n),
+            "mas_comunes": tenant.trending_tags.top(category=categoria, n=n),
+            "resumen": tenant.trending_tags.stats()
+        }
+    })
+
+@app.route('/admin/escritura', methods=['GET'])
+def estado_escritura():
+    """Endpoint con la profundidad de cola y estadísticas de los escritores del historial del tenant"""
+    tenant = tenants.current()
+    return jsonify({
+        "success": True,
+        "data": {
+            "comentarios": {**tenant.comments_writer.stats(), "historial": tenant.comments_history.stats()},
+            "titulos": {**tenant.titles_writer.stats(), "historial": tenant.titles_history.stats()}
+        }
+    })
+
+@app.route('/admin/tenants', methods=['GET'])
+def estado_tenants():
+    """Endpoint con los tenants cargados, su uso y las liberaciones por LRU o inactividad"""
+    return jsonify({
+        "success": True,
+        "data": tenant_registry.stats()
+    })
+
+@app.route('/admin/prompts', methods=['GET'])
+def metricas_prompts():
+    """Endpoint con las versiones de los prompts y el consumo de tokens y latencia por prompt y endpoint"""
+    return jsonify({
+        "success": True,
+        "data": {
+            "prompts": prompt_registry.versions(),
+            "consumo": prompt_registry.accounting.snapshot()
+        }
+    })
+
+@app.route('/admin/admision', methods=['GET'])
+def estado_admision():
+    """Endpoint con el límite actual, la cola de espera y los rechazos del control de admisión"""
+    return jsonify({
+        "success": True,
+        "data": admission.stats()
+    })
+
+@app.route('/admin/idempotencia', methods=['GET'])
+def estado_idempotencia():
+    """Endpoint con las claves de idempotencia guardadas, las respuestas reutilizadas y los conflictos"""
+    return jsonify({
+        "success": True,
+        "data": idempotency_store.stats()
+    })
+
+@app.route('/admin/perfiles', methods=['GET'])
+def listar_perfiles():
+    """Endpoint con los perfiles más recientes (anillo acotado)"""
+    return jsonify({
+        "success": True,
+        "data": request_profiler.recent()
+    })
+
+@app.route('/admin/perfiles/<profile_id>', methods=['GET'])
+def obtener_perfil(profile_id):
+    """Endpoint con las funciones más costosas de un perfil; ?formato=texto devuelve el reporte de pstats"""
+    profile = request_profiler.get(profile_id)
+    
+    if profile is None:
+        return jsonify({
+            "error": "No se encontró el perfil solicitado"
+        }), 404
+    
+    if request.args.get('formato') == 'texto':
+        orden = request.args.get('orden', 'cumulative')
+        if orden not in SORT_KEYS:
+            return jsonify({
+                "error": f"Orden no válido; usa uno de: {', '.join(sorted(SORT_KEYS))}"
+            }), 400
+        return request_profiler.report(profile_id, sort=orden), 200, {"Content-Type": "text/plain; charset=utf-8"}
+    
+    return jsonify({
+        "success": True,
+        "data": profile
+    })
+
 # Manejo de errores globales
 @app.errorhandler(404)
 def not_found(error):
@@ -0,0 +1,423 @@
+"""Cliente de la API de validación (/procesar y /procesartitulos) para la DApp y los scripts.
+
+- Una sesión de `requests` con pool de conexiones keep-alive, compartida por todos los hilos.
+- Las llamadas concurrentes se agrupan en micro-lotes (/procesar/lote y /procesartitulos/lote):
+  un lote sale al juntar `max_batch` elementos o cuando pasan `linger` segundos desde el
+  primero. Si el servidor no tiene esos endpoints se usan los individuales.
+- Cada texto lleva una clave de idempotencia que se conserva en los reintentos, así el servidor
+  devuelve el análisis original en lugar de repetirlo.
+- Reintentos con espera exponencial y jitter solo ante errores transitorios (conexión, 409, 429,
+  5xx), respetando Retry-After y el plazo de cada llamada. El plazo restante se envía en
+  X-Deadline-Ms para que el servidor responda con el análisis local antes de agotarlo.
+- Interfaz síncrona (`ValidationClient`) y asyncio (`AsyncValidationClient`).
+
+Uso:
+    from api_client import ValidationClient
+
+    with ValidationClient("http://localhost:5000", tenant="ingenieria") as client:
+        analisis = client.process_comment("La biblioteca debería abrir los sábados", timeout=10)
+        futuros = [client.submit_comment(texto) for texto in textos]  # se envían en lotes
+        resultados = [futuro.result() for futuro in futuros]
+
+    async with AsyncValidationClient("http://localhost:5000") as client:
+        resultados = await client.process_comments(textos, timeout=30)
+"""
+import time
+import uuid
+import random
+import asyncio
+import threading
+from collections import namedtuple
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Los mismos encabezados que interpreta el servidor (tenants, deadlines e idempotency)
+TENANT_HEADER = "X-Tenant"
+DEADLINE_HEADER = "X-Deadline-Ms"
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+
+DEFAULT_TIMEOUT = 30.0
+DEFAULT_MAX_BATCH = 16
+DEFAULT_LINGER = 0.005
+DEFAULT_MAX_CONNECTIONS = 8
+DEFAULT_RETRIES = 3
+BACKOFF_BASE = 0.2
+BACKOFF_MAX = 5.0
+# Parte del plazo que se reserva para que la respuesta del servidor llegue a tiempo
+DEADLINE_MARGIN = 0.5
+# Tolerancia al esperar un future: el hilo que envía ya corta la solicitud al vencer el plazo
+WAIT_GRACE = 1.0
+
+RETRYABLE_STATUSES = frozenset({409, 429, 500, 502, 503, 504})
+
+# single/batch: rutas; field: campo del texto; batch_field: lista de elementos del lote
+Endpoint = namedtuple("Endpoint", ["single", "batch", "field", "batch_field"])
+COMMENTS = Endpoint("/procesar", "/procesar/lote", "comentario", "comentarios")
+TITLES = Endpoint("/procesartitulos", "/procesartitulos/lote", "titulo", "titulos")
+
+
+class APIError(Exception):
+    """Respuesta de error de la API; `status` es el código HTTP (None si no hubo respuesta) y `body` el JSON"""
+
+    def __init__(self, message, status=None, body=None):
+        super().__init__(message)
+        self.status = status
+        self.body = body or {}
+
+
+class RequestTimeout(APIError, TimeoutError):
+    """Se agotó el plazo de la llamada (incluidos los reintentos)"""
+
+
+class _Item:
+    __slots__ = ("text", "key", "future", "deadline", "attempt", "last_error")
+
+    def __init__(self, text, key, deadline):
+        self.text = text
+        self.key = key
+        self.future = Future()
+        self.deadline = deadline
+        self.attempt = 0
+        self.last_error = None
+
+    def remaining(self):
+        return self.deadline - time.monotonic()
+
+
+def _resolve(future, result=None, error=None):
+    """Completar el future salvo que ya se haya cancelado (p. ej. por asyncio.wait_for)"""
+    try:
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    except InvalidStateError:
+        pass
+
+
+def _retry_after(response):
+    try:
+        return float(response.headers.get("Retry-After", 0))
+    except ValueError:
+        return 0.0
+
+
+def _json(response):
+    try:
+        body = response.json()
+    except ValueError:
+        return {"error": response.text[:200]}
+    return body if isinstance(body, dict) else {"data": body}
+
+
+class _Batcher:
+    """Cola de elementos de un endpoint; un hilo junta los que llegan dentro de `linger` y envía el lote"""
+
+    def __init__(self, client, endpoint):
+        self.client = client
+        self.endpoint = endpoint
+        self.pending = []
+        self.closed = False
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def add(self, item):
+        with self._condition:
+            if self.closed:
+                raise RuntimeError("El cliente está cerrado")
+            self.pending.append(item)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f"api-client-lotes{self.endpoint.single}",
+                                                daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def _run(self):
+        client = self.client
+        while True:
+            with self._condition:
+                while not self.pending and not self.closed:
+                    self._condition.wait()
+                if not self.pending:
+                    return
+                # Esperar a que se junten más elementos, sin pasar de `linger` desde el primero
+                flush_at = time.monotonic() + client.linger
+                while len(self.pending) < client.max_batch and not self.closed:
+                    left = flush_at - time.monotonic()
+                    if left <= 0:
+                        break
+                    self._condition.wait(left)
+                batch, self.pending = self.pending[:client.max_batch], self.pending[client.max_batch:]
+            client._executor.submit(client._send, self.endpoint, batch)
+
+    def close(self):
+        """Enviar lo pendiente y detener el hilo"""
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+
+
+class ValidationClient:
+    """Cliente síncrono; es seguro usarlo desde varios hilos, que es como se forman los micro-lotes"""
+
+    def __init__(self, base_url, tenant=None, timeout=DEFAULT_TIMEOUT, max_batch=DEFAULT_MAX_BATCH,
+                 linger=DEFAULT_LINGER, max_connections=DEFAULT_MAX_CONNECTIONS, retries=DEFAULT_RETRIES,
+                 batching=True, session=None):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.max_batch = max(1, max_batch)
+        self.linger = linger
+        self.retries = retries
+        self.batching = batching and self.max_batch > 1
+
+        self.session = session or requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if tenant:
+            self.session.headers[TENANT_HEADER] = tenant
+
+        self._executor = ThreadPoolExecutor(max_workers=max_connections, thread_name_prefix="api-client")
+        self._batchers = {endpoint: _Batcher(self, endpoint) for endpoint in (COMMENTS, TITLES)}
+        # None = sin probar; False si el servidor no tiene el endpoint de lotes
+        self._batch_supported = {COMMENTS: None, TITLES: None}
+        self._closed = False
+        self._stats_lock = threading.Lock()
+        self._stats = {"solicitudes": 0, "lotes": 0, "elementos": 0, "reintentos": 0, "reutilizados": 0}
+
+    # Interfaz pública
+
+    def submit_comment(self, text, idempotency_key=None, timeout=None):
+        """Encolar un comentario; devuelve un Future con el `data` de /procesar"""
+        return self._submit(COMMENTS, text, idempotency_key, timeout)
+
+    def submit_title(self, title, idempotency_key=None, timeout=None):
+        """Encolar un título; devuelve un Future con el `data` de /procesartitulos"""
+        return self._submit(TITLES, title, idempotency_key, timeout)
+
+    def process_comment(self, text, idempotency_key=None, timeout=None):
+        return self._wait(self.submit_comment(text, idempotency_key, timeout), timeout)
+
+    def process_title(self, title, idempotency_key=None, timeout=None):
+        return self._wait(self.submit_title(title, idempotency_key, timeout), timeout)
+
+    def process_comments(self, texts, timeout=None, return_exceptions=False):
+        """Analizar varios comentarios; con `return_exceptions` los errores se devuelven en su posición"""
+        return self._gather([self.submit_comment(text, timeout=timeout) for text in texts], timeout, return_exceptions)
+
+    def process_titles(self, titles, timeout=None, return_exceptions=False):
+        return self._gather([self.submit_title(title, timeout=timeout) for title in titles], timeout, return_exceptions)
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        for batcher in self._batchers.values():
+            batcher.close()
+        self._executor.shutdown(wait=True)
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # Envío
+
+    def _submit(self, endpoint, text, idempotency_key, timeout):
+        if self._closed:
+            raise RuntimeError("El cliente está cerrado")
+        item = _Item(text, idempotency_key or uuid.uuid4().hex, time.monotonic() + (timeout or self.timeout))
+        self._enqueue(endpoint, item)
+        return item.future
+
+    def _enqueue(self, endpoint, item):
+        try:
+            if self.batching and self._batch_supported[endpoint] is not False:
+                self._batchers[endpoint].add(item)
+            else:
+                self._executor.submit(self._send, endpoint, [item])
+        except RuntimeError as e:
+            _resolve(item.future, error=APIError(str(e)))
+
+    def _wait(self, future, timeout):
+        try:
+            return future.result((timeout or self.timeout) + WAIT_GRACE)
+        except FutureTimeoutError:
+            future.cancel()
+            raise RequestTimeout("Se agotó el plazo de la llamada") from None
+
+    def _gather(self, futures, timeout, return_exceptions):
+        results = []
+        for future in futures:
+            try:
+                results.append(self._wait(future, timeout))
+            except APIError as e:
+                if not return_exceptions:
+                    raise
+                results.append(e)
+        return results
+
+    def _headers(self, remaining):
+        # El servidor interpreta 0 como "sin plazo": siempre se envía al menos 1 ms
+        return {DEADLINE_HEADER: str(max(1, int((remaining - DEADLINE_MARGIN) * 1000)))}
+
+    def _count(self, **increments):
+        with self._stats_lock:
+            for name, value in increments.items():
+                self._stats[name] += value
+
+    def _send(self, endpoint, items):
+        """Enviar los elementos (un lote o uno solo) y resolver o reintentar cada uno"""
+        live = []
+        for item in items:
+            if item.future.cancelled():
+                continue
+            if item.remaining() <= 0:
+                detail = f": {item.last_error['error']}" if item.last_error and item.last_error.get("error") else ""
+                _resolve(item.future, error=RequestTimeout(f"Se agotó el plazo de la llamada{detail}",
+                                                           body=item.last_error))
+                continue
+            live.append(item)
+        if not live:
+            return
+
+        if len(live) > 1 and self._batch_supported[endpoint] is False:
+            self._fan_out(endpoint, live)
+            return
+
+        remaining = min(item.remaining() for item in live)
+        try:
+            if len(live) > 1:
+                outcomes = self._post_batch(endpoint, live, remaining)
+                if outcomes is None:
+                    self._fan_out(endpoint, live)
+                    return
+            else:
+                outcomes = [self._post_single(endpoint, live[0], remaining)]
+        except requests.RequestException as e:
+            outcomes = [(None, {"error": f"Error de conexión: {str(e)}"}, 0.0)] * len(live)
+        except Exception as e:
+            # Una respuesta inesperada no debe dejar futures sin resolver
+            for item in live:
+                _resolve(item.future, error=APIError(f"Respuesta inválida del servidor: {str(e)}"))
+            return
+
+        for item, (status, body, retry_after) in zip(live, outcomes):
+            self._settle(endpoint, item, status, body, retry_after)
+
+    def _fan_out(self, endpoint, items):
+        """Servidor sin endpoint de lotes: enviar cada elemento en su propia solicitud"""
+        for item in items:
+            try:
+                self._executor.submit(self._send, endpoint, [item])
+            except RuntimeError:
+                # El pool ya se está cerrando: enviar desde este hilo
+                self._send(endpoint, [item])
+
+    def _post_single(self, endpoint, item, remaining):
+        headers = {**self._headers(remaining), IDEMPOTENCY_HEADER: item.key}
+        response = self.session.post(self.base_url + endpoint.single, json={endpoint.field: item.text},
+                                     headers=headers, timeout=remaining)
+        self._count(solicitudes=1, elementos=1)
+        body = _json(response)
+        if response.headers.get("Idempotent-Replayed") == "true":
+            body["reutilizado"] = True
+        return response.status_code, body, _retry_after(response)
+
+    def _post_batch(self, endpoint, items, remaining):
+        payload = {endpoint.batch_field: [{endpoint.field: item.text, "idempotency_key": item.key} for item in items]}
+        response = self.session.post(self.base_url + endpoint.batch, json=payload,
+                                     headers=self._headers(remaining), timeout=remaining)
+        self._count(solicitudes=1, lotes=1, elementos=len(items))
+        if response.status_code in (404, 405):
+            self._batch_supported[endpoint] = False
+            return None
+        self._batch_supported[endpoint] = True
+        body = _json(response)
+        if response.status_code != 200:
+            # Falló el lote completo (p. ej. 503 por saturación): cada elemento sigue su propia política
+            return [(response.status_code, body, _retry_after(response))] * len(items)
+        results = body.get("data")
+        if (not isinstance(results, list) or len(results) != len(items)
+                or not all(isinstance(result, dict) for result in results)):
+            # 200 sin un resultado por elemento: no se reintenta, el servidor ya pudo guardar los análisis
+            error = APIError("Respuesta de lote inválida del servidor", response.status_code, body)
+            for item in items:
+                _resolve(item.future, error=error)
+            return []
+        return [(result.pop("status", 200), result, 0.0) for result in results]
+
+    def _settle(self, endpoint, item, status, body, retry_after):
+        if body.get("reutilizado"):
+            self._count(reutilizados=1)
+        if status == 200:
+            _resolve(item.future, result=body.get("data"))
+            return
+        message = body.get("error") or f"Error HTTP {status}"
+        if status is not None and status not in RETRYABLE_STATUSES:
+            _resolve(item.future, error=APIError(message, status, body))
+            return
+
+        # Error transitorio: reintentar con la misma clave de idempotencia si queda plazo
+        item.attempt += 1
+        item.last_error = body
+        delay = max(retry_after, random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** item.attempt)))
+        if item.attempt > self.retries or delay >= item.remaining() or self._closed:
+            error_type = RequestTimeout if delay >= item.remaining() else APIError
+            _resolve(item.future, error=error_type(message, status, body))
+            return
+        self._count(reintentos=1)
+        timer = threading.Timer(delay, self._enqueue, (endpoint, item))
+        timer.daemon = True
+        timer.start()
+
+
+class AsyncValidationClient:
+    """Interfaz asyncio sobre el mismo pool y los mismos micro-lotes del cliente síncrono"""
+
+    def __init__(self, base_url, **options):
+        self.client = ValidationClient(base_url, **options)
+
+    async def process_comment(self, text, idempotency_key=None, timeout=None):
+        return await self._wait(self.client.submit_comment(text, idempotency_key, timeout), timeout)
+
+    async def process_title(self, title, idempotency_key=None, timeout=None):
+        return await self._wait(self.client.submit_title(title, idempotency_key, timeout), timeout)
+
+    async def process_comments(self, texts, timeout=None, return_exceptions=False):
+        return await asyncio.gather(*(self.process_comment(text, timeout=timeout) for text in texts),
+                                    return_exceptions=return_exceptions)
+
+    async def process_titles(self, titles, timeout=None, return_exceptions=False):
+        return await asyncio.gather(*(self.process_title(title, timeout=timeout) for title in titles),
+                                    return_exceptions=return_exceptions)
+
+    async def _wait(self, future, timeout):
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), (timeout or self.client.timeout) + WAIT_GRACE)
+        except asyncio.TimeoutError:
+            raise RequestTimeout("Se agotó el plazo de la llamada") from None
+
+    def stats(self):
+        return self.client.stats()
+
+    async def close(self):
+        await asyncio.get_running_loop().run_in_executor(None, self.client.close)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
@@ -0,0 +1,341 @@
+"""Formato de archivo columnar compacto para el historial de análisis.
+
+Estructura del archivo (.hca):
+    magic "HCA1" | u32 longitud del encabezado | encabezado JSON | columnas alineadas a 8 bytes
+
+Columnas:
+    ids          array('q')  identificador de cada análisis
+    timestamps   array('d')  segundos epoch (NaN si el registro no tiene fecha)
+    categorias   array('B')  código en el diccionario de categorías
+    tag_offsets  array('I')  n + 1 posiciones dentro de tag_codes
+    tag_codes    array('H')  código en el diccionario de tags
+    text_offsets array('Q')  2n + 1 posiciones dentro de textos (original y formalizado)
+    textos       bytes       región de texto UTF-8
+
+Los registros se ordenan por timestamp para permitir consultas por rango con bisect.
+El lector usa mmap, así que solo se cargan en memoria las páginas que se recorren.
+
+Uso:
+    python archive.py convertir comentarios_analizados.json historial.hca
+    python archive.py convertir historial/comentarios 2025-2.hca --desde 2025-07-01 --hasta 2025-12-31
+    (una fecha sin hora en --hasta incluye todo ese día)
+    python archive.py resumen historial.hca
+"""
+import os
+import sys
+import json
+import math
+import mmap
+import struct
+import argparse
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from datetime import datetime
+
+from history_store import SegmentedHistory, normalize_category
+
+MAGIC = b"HCA1"
+FORMAT_VERSION = 1
+ALIGNMENT = 8
+
+COLUMNS = (
+    ("ids", "q"),
+    ("timestamps", "d"),
+    ("categorias", "B"),
+    ("tag_offsets", "I"),
+    ("tag_codes", "H"),
+    ("text_offsets", "Q"),
+)
+
+
+def normalize_record(item):
+    """Normalizar los esquemas heredados del historial a un solo formato (id None si no tiene)"""
+    if "comentario_final" in item:
+        # Esquema del analizador de Streamlit con formalización
+        original = item.get("comentario_original") or item.get("comentario_final") or ""
+        formalizado = item.get("comentario_final") if item.get("fue_formalizado") else None
+    elif "comentario_original" in item:
+        # Esquema de la API
+        original = item.get("comentario_original") or ""
+        formalizado = item.get("comentario_formalizado")
+    else:
+        # Esquema original del analizador
+        original = item.get("comentario") or ""
+        formalizado = None
+
+    categoria = item.get("categoria") or "Opinion"
+    timestamp = item.get("timestamp")
+
+    return {
+        "id": item.get("id") or None,
+        "timestamp": timestamp,
+        "comentario_original": original,
+        "comentario_formalizado": formalizado or None,
+        "categoria": normalize_category(categoria),
+        "tags": list(item.get("tags") or []),
+    }
+
+
+def _to_epoch(timestamp):
+    if not timestamp:
+        return math.nan
+    try:
+        return datetime.fromisoformat(timestamp).timestamp()
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def _sort_key(record):
+    # Los registros sin fecha quedan al final
+    epoch = record["_epoch"]
+    return (math.isnan(epoch), 0.0 if math.isnan(epoch) else epoch)
+
+
+def _code(dictionary, value, limit, kind):
+    """Código de `value` en el diccionario; falla antes de exceder lo que cabe en su columna"""
+    code = dictionary.get(value)
+    if code is None:
+        if len(dictionary) >= limit:
+            raise ValueError(f"Demasiadas {kind} para el formato columnar (máximo {limit})")
+        code = dictionary[value] = len(dictionary)
+    return code
+
+
+def write_archive(records, path):
+    """Escribir registros normalizados en formato columnar"""
+    for record in records:
+        record["_epoch"] = _to_epoch(record["timestamp"])
+    records = sorted(records, key=_sort_key)
+
+    categories = {}
+    tags = {}
+    columns = {name: array(typecode) for name, typecode in COLUMNS}
+    columns["tag_offsets"].append(0)
+    columns["text_offsets"].append(0)
+    text_blob = bytearray()
+
+    for record in records:
+        columns["ids"].append(int(record["id"]))
+        columns["timestamps"].append(record["_epoch"])
+        columns["categorias"].append(_code(categories, record["categoria"], 256, "categorías"))
+        for tag in record["tags"]:
+            columns["tag_codes"].append(_code(tags, tag, 65536, "tags"))
+        columns["tag_offsets"].append(len(columns["tag_codes"]))
+        for text in (record["comentario_original"], record["comentario_formalizado"] or ""):
+            text_blob += text.encode("utf-8")
+            columns["text_offsets"].append(len(text_blob))
+
+    # Calcular posiciones de cada columna con alineación
+    layout = {}
+    offset = 0
+    payloads = [(name, columns[name].tobytes(), typecode) for name, typecode in COLUMNS]
+    payloads.append(("textos", bytes(text_blob), "B"))
+    for name, payload, typecode in payloads:
+        offset = _align(offset)
+        layout[name] = {"offset": offset, "length": len(payload), "typecode": typecode}
+        offset += len(payload)
+
+    header = json.dumps({
+        "version": FORMAT_VERSION,
+        "byteorder": sys.byteorder,
+        "count": len(records),
+        "categorias": list(categories),
+        "tags": list(tags),
+        "columnas": layout,
+    }, ensure_ascii=False).encode("utf-8")
+    data_start = _align(len(MAGIC) + 4 + len(header))
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(MAGIC)
+        file.write(struct.pack("<I", len(header)))
+        file.write(header)
+        for name, payload, _ in payloads:
+            file.seek(data_start + layout[name]["offset"])
+            file.write(payload)
+        file.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+    return len(records)
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def convert(sources, path, start=None, end=None):
+    """Convertir historiales JSON (cualquier esquema) o directorios segmentados a un archivo columnar.
+    `start`/`end` (ISO) limitan el rango de tiempo exportado de los historiales segmentados."""
+    records = []
+    for source in sources:
+        if os.path.isdir(source):
+            items = SegmentedHistory(source).read_range(start, end)
+        else:
+            with open(source, "r", encoding="utf-8") as file:
+                items = json.load(file)
+        records.extend(normalize_record(item) for item in items)
+    # Los registros sin id (JSON heredados) se numeran después del mayor id de toda la entrada,
+    # así no chocan entre archivos ni con los ids existentes
+    next_id = max((record["id"] for record in records if record["id"] is not None), default=0) + 1
+    for record in records:
+        if record["id"] is None:
+            record["id"] = next_id
+            next_id += 1
+    return write_archive(records, path)
+
+
+class ArchiveReader:
+    """Lector de archivos columnares con mmap; las columnas son memoryviews sin copia"""
+
+    def __init__(self, path):
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._views = {}
+
+        if self._mmap[:4] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} no es un archivo de historial columnar")
+        header_length = struct.unpack("<I", self._mmap[4:8])[0]
+        header = json.loads(self._mmap[8:8 + header_length].decode("utf-8"))
+        if header["byteorder"] != sys.byteorder:
+            self.close()
+            raise ValueError("El archivo fue escrito con un orden de bytes distinto")
+
+        self.header = header
+        self.categories = header["categorias"]
+        self.tags = header["tags"]
+        data_start = _align(8 + header_length)
+
+        view = memoryview(self._mmap)
+        for name, column in header["columnas"].items():
+            start = data_start + column["offset"]
+            raw = view[start:start + column["length"]]
+            self._views[name] = raw if name == "textos" else raw.cast(column["typecode"])
+        view.release()
+
+        self.ids = self._views["ids"]
+        self.timestamps = self._views["timestamps"]
+        self.category_codes = self._views["categorias"]
+
+    def __len__(self):
+        return self.header["count"]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.ids = self.timestamps = self.category_codes = None
+        for view in getattr(self, "_views", {}).values():
+            view.release()
+        self._views = {}
+        try:
+            self._mmap.close()
+        except BufferError:
+            # Aún hay memoryviews externas vivas; el mmap se libera junto con ellas
+            pass
+        self._file.close()
+
+    def category_counts(self):
+        """Conteo por categoría sin decodificar registros"""
+        raw = self._views["categorias"].tobytes()
+        return {category: raw.count(code) for code, category in enumerate(self.categories)}
+
+    def tag_counts(self):
+        """Conteo de tags directamente sobre los códigos"""
+        counts = Counter(self._views["tag_codes"])
+        return Counter({self.tags[code]: count for code, count in counts.items()})
+
+    def record_tags(self, index):
+        offsets = self._views["tag_offsets"]
+        codes = self._views["tag_codes"][offsets[index]:offsets[index + 1]]
+        return [self.tags[code] for code in codes]
+
+    def _text(self, slot):
+        offsets = self._views["text_offsets"]
+        return bytes(self._views["textos"][offsets[slot]:offsets[slot + 1]]).decode("utf-8")
+
+    def text(self, index):
+        return self._text(2 * index)
+
+    def formalized(self, index):
+        return self._text(2 * index + 1) or None
+
+    def record(self, index):
+        epoch = self.timestamps[index]
+        return {
+            "id": self.ids[index],
+            "timestamp": None if math.isnan(epoch) else datetime.fromtimestamp(epoch).isoformat(),
+            "comentario_original": self.text(index),
+            "comentario_formalizado": self.formalized(index),
+            "categoria": self.categories[self.category_codes[index]],
+            "tags": self.record_tags(index),
+        }
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.record(index)
+
+    def time_range(self, start=None, end=None):
+        """Índices de los registros con start <= timestamp <= end (datetime)"""
+        timestamps = self.timestamps
+        # Los registros sin fecha (NaN) están al final y no participan en la búsqueda
+        dated = bisect_left(_NanGuard(timestamps), math.inf)
+        low = 0 if start is None else bisect_left(timestamps, start.timestamp(), 0, dated)
+        high = dated if end is None else bisect_right(timestamps, end.timestamp(), 0, dated)
+        return range(low, high)
+
+
+class _NanGuard:
+    """Vista de timestamps donde NaN se compara como infinito (para ubicar el final de los fechados)"""
+
+    def __init__(self, timestamps):
+        self._timestamps = timestamps
+
+    def __len__(self):
+        return len(self._timestamps)
+
+    def __getitem__(self, index):
+        value = self._timestamps[index]
+        return math.inf if math.isnan(value) else value
+
+
+def print_summary(path):
+    with ArchiveReader(path) as reader:
+        print(f"Registros: {len(reader)}")
+        print("Categorías:")
+        for category, count in reader.category_counts().items():
+            print(f"  {category}: {count}")
+        print("Tags más comunes:")
+        for tag, count in reader.tag_counts().most_common(10):
+            print(f"  {tag}: {count}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archivo columnar del historial de análisis")
+    subparsers = parser.add_subparsers(dest="comando", required=True)
+
+    convert_parser = subparsers.add_parser("convertir", help="Convertir historiales JSON a formato columnar")
+    convert_parser.add_argument("entradas", nargs="+", help="Archivos JSON o directorios de historial segmentado")
+    convert_parser.add_argument("salida", help="Archivo .hca de salida")
+    convert_parser.add_argument("--desde", help="Fecha ISO inicial (solo historiales segmentados)")
+    convert_parser.add_argument("--hasta", help="Fecha ISO final, incluida; sin hora abarca todo el día "
+                                                "(solo historiales segmentados)")
+
+    summary_parser = subparsers.add_parser("resumen", help="Mostrar estadísticas de un archivo columnar")
+    summary_parser.add_argument("archivo", help="Archivo .hca")
+
+    args = parser.parse_args()
+
+    if args.comando == "convertir":
+        count = convert(args.entradas, args.salida, args.desde, args.hasta)
+        print(f"{count} registros escritos en {args.salida}")
+    else:
+        print_summary(args.archivo)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
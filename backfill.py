@@ -0,0 +1,259 @@
+"""Reprocesar archivos históricos de comentarios (CSV/JSONL) con el mismo pipeline de /procesar.
+
+El archivo se lee en streaming por lotes. La coherencia y los tags se calculan en un
+pool de procesos, la categorización con el LLM pasa por un cliente con concurrencia
+acotada y cada lote se guarda con una sola escritura en el historial. Después de cada
+lote se actualiza un checkpoint para reanudar desde ahí si el proceso se interrumpe.
+
+Uso:
+    python backfill.py comentarios_2024.csv --columna comentario --procesos 4 --concurrencia 8
+"""
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import threading
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from coherence import validator
+from tagging import TagIndex, load_tags
+from history_store import COMMENTS_HISTORY_FILE, DEFAULT_HISTORY_DIR, SegmentedHistory
+from prompts import COMMENT_PROMPTS, DEFAULT_CATEGORY, current_endpoint
+
+TEXT_FIELDS = ("comentario", "text", "comentario_original", "comentario_final", "texto")
+TIMESTAMP_FIELDS = ("timestamp", "fecha")
+
+# Índice de tags y validador de cada proceso del pool, recibidos una sola vez por el initializer
+_worker_tag_index = None
+_worker_validator = None
+
+
+def _init_worker(tags_file, worker_validator):
+    global _worker_tag_index, _worker_validator
+    _worker_tag_index = TagIndex(load_tags(tags_file))
+    _worker_validator = worker_validator
+
+
+def local_stage(text):
+    """Etapa local (sin LLM): coherencia y extracción de tags"""
+    if not _worker_validator.validate(text):
+        return False, [], _worker_tag_index.version
+    return True, _worker_tag_index.extract(text), _worker_tag_index.version
+
+
+def pick_field(row, candidates, explicit=None):
+    if explicit:
+        return row.get(explicit)
+    for field in candidates:
+        if row.get(field):
+            return row[field]
+    return None
+
+
+def iter_records(file, is_csv, text_field=None):
+    """Recorrer un archivo abierto (CSV o JSONL): produce (posición, texto, timestamp) por registro"""
+    rows = csv.DictReader(file) if is_csv else (json.loads(line) for line in file if line.strip())
+    for position, row in enumerate(rows):
+        if isinstance(row, str):
+            text, timestamp = row, None
+        else:
+            text = pick_field(row, TEXT_FIELDS, text_field)
+            timestamp = pick_field(row, TIMESTAMP_FIELDS)
+        yield position, (text or "").strip(), timestamp
+
+
+def read_records(path, text_field=None):
+    """Leer el archivo en streaming: produce (posición, texto, timestamp) por registro"""
+    with open(path, "r", encoding="utf-8", newline="") as file:
+        yield from iter_records(file, path.lower().endswith(".csv"), text_field)
+
+
+def batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class BoundedLLMClient:
+    """Cliente del LLM con un número acotado de llamadas en vuelo.
+
+    Los errores del LLM (p. ej. un 429 de Groq) se reintentan `retries` veces y después se
+    propagan: quien llama guarda el análisis sin procedencia para que el reetiquetado lo repita,
+    en lugar de guardarlo como "Opinion" vigente."""
+
+    def __init__(self, max_concurrency, retries=2, retry_delay=1.0):
+        # Importación diferida: solo el proceso principal necesita el modelo
+        import pipeline
+        self._pipeline = pipeline
+        self.provenance = pipeline.get_prompt_registry().provenance(COMMENT_PROMPTS)
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="backfill-llm")
+        self._slots = threading.BoundedSemaphore(max_concurrency * 2)
+
+    def _classify(self, text):
+        current_endpoint.set("backfill")
+        self._pipeline.propagate_llm_errors.set(True)
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    return self._pipeline.classify_comment(text)
+                except self._pipeline.MissingAPIKey:
+                    raise
+                except Exception as e:
+                    if attempt == self.retries:
+                        raise
+                    print(f"Error del LLM, reintentando: {str(e)}")
+                    time.sleep(self.retry_delay * 2 ** attempt)
+        finally:
+            self._slots.release()
+
+    def submit(self, text):
+        # Bloquea al productor si ya hay demasiadas llamadas pendientes
+        self._slots.acquire()
+        return self._executor.submit(self._classify, text)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+def load_checkpoint(path):
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as file:
+            return json.load(file)
+    return None
+
+
+def save_checkpoint(path, checkpoint):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(checkpoint, file, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def last_written_position(history, source):
+    """Última posición del archivo ya guardada (protege contra caídas entre escritura y checkpoint)"""
+    positions = [
+        item["origen"]["posicion"] for item in history
+        if isinstance(item.get("origen"), dict) and item["origen"].get("archivo") == source
+    ]
+    return max(positions) if positions else -1
+
+
+def run(args):
+    source = os.path.basename(args.entrada)
+    checkpoint_path = args.checkpoint or f"{args.entrada}.checkpoint.json"
+    checkpoint = load_checkpoint(checkpoint_path) or {"archivo": source, "posicion": -1, "guardados": 0,
+                                                      "incoherentes": 0, "errores": 0}
+
+    store = SegmentedHistory(args.historial, legacy_file=COMMENTS_HISTORY_FILE)
+    resume_after = max(checkpoint["posicion"], last_written_position(store.read_range(), source))
+
+    if resume_after >= 0:
+        print(f"Reanudando {source} después de la posición {resume_after}")
+
+    try:
+        llm = BoundedLLMClient(args.concurrencia, retries=args.reintentos)
+    except RuntimeError as e:
+        # p. ej. falta GROQ_API_KEY
+        print(f"Error: {str(e)}")
+        return 1
+    processed = 0
+    start = time.perf_counter()
+
+    # El modelo de n-gramas se carga aquí una vez y viaja con el validador, en lugar de entrenarse en cada proceso
+    validator.language_model
+
+    try:
+        with ProcessPoolExecutor(max_workers=args.procesos, initializer=_init_worker,
+                                 initargs=(args.tags, validator)) as pool:
+            pending = (record for record in read_records(args.entrada, args.columna) if record[0] > resume_after)
+
+            for batch in batched(pending, args.lote):
+                texts = [text for _, text, _ in batch]
+                local_results = list(pool.map(local_stage, texts, chunksize=max(1, len(texts) // (args.procesos * 4))))
+
+                futures = [llm.submit(text) if coherent else None
+                           for text, (coherent, _, _) in zip(texts, local_results)]
+
+                records = []
+                for (position, text, timestamp), (coherent, tags, tags_version), future in zip(batch, local_results, futures):
+                    if not coherent:
+                        checkpoint["incoherentes"] += 1
+                        continue
+                    try:
+                        categoria, comentario_formalizado = future.result()
+                        provenance = llm.provenance
+                    except Exception as e:
+                        # Sin procedencia: el reetiquetado lo reprocesa
+                        print(f"Error categorizando la posición {position}: {str(e)}")
+                        categoria, comentario_formalizado, provenance = DEFAULT_CATEGORY, None, {}
+                        checkpoint["errores"] = checkpoint.get("errores", 0) + 1
+                    records.append({
+                        "timestamp": timestamp or datetime.now().isoformat(),
+                        "comentario_original": text,
+                        "comentario_formalizado": comentario_formalizado,  # Solo si es Queja
+                        "categoria": categoria,
+                        "tags": tags,
+                        "tags_version": tags_version,
+                        "is_coherent": True,
+                        **provenance,
+                        "origen": {"archivo": source, "posicion": position}
+                    })
+
+                # Los ids se asignan al escribir, bajo el bloqueo del historial
+                try:
+                    if records:
+                        store.append_many(records, assign_ids=True)
+                except Exception as e:
+                    print(f"Error al guardar el lote; el checkpoint no avanza: {str(e)}")
+                    return 1
+
+                checkpoint["posicion"] = batch[-1][0]
+                checkpoint["guardados"] += len(records)
+                save_checkpoint(checkpoint_path, checkpoint)
+
+                processed += len(batch)
+                elapsed = time.perf_counter() - start
+                print(f"{processed} registros ({processed / elapsed:.1f} registros/s) - "
+                      f"guardados: {checkpoint['guardados']}, incoherentes: {checkpoint['incoherentes']}, "
+                      f"errores del LLM: {checkpoint.get('errores', 0)}")
+    finally:
+        llm.close()
+
+    print(f"Backfill completo: {checkpoint['guardados']} análisis guardados desde {source}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reprocesar comentarios históricos con el pipeline de /procesar")
+    parser.add_argument("entrada", help="Archivo CSV o JSONL con los comentarios")
+    parser.add_argument("--columna", help="Columna o clave con el texto (por defecto se detecta)")
+    parser.add_argument("--historial", default=os.path.join(DEFAULT_HISTORY_DIR, "comentarios"),
+                        help="Directorio del historial segmentado destino")
+    parser.add_argument("--tags", default="tags.txt", help="Archivo de vocabulario de tags")
+    parser.add_argument("--checkpoint", help="Archivo de checkpoint (por defecto <entrada>.checkpoint.json)")
+    parser.add_argument("--procesos", type=int, default=os.cpu_count() or 1, help="Procesos para la etapa local")
+    parser.add_argument("--concurrencia", type=int, default=8, help="Llamadas simultáneas al LLM")
+    parser.add_argument("--reintentos", type=int, default=2,
+                        help="Reintentos por comentario si falla el LLM (después se guarda sin procedencia)")
+    parser.add_argument("--lote", type=int, default=200, help="Registros por lote y por escritura")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.entrada):
+        print(f"Error: no existe el archivo {args.entrada}")
+        return 1
+
+    return run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,184 @@
+"""Benchmark del cliente `api_client` contra la API con un modelo simulado.
+
+Por defecto levanta `api.app` en el servidor de desarrollo de Werkzeug (en un directorio
+temporal, para no tocar el historial) y envía los mismos comentarios desde varios hilos:
+  - `requests.post` por llamada: una conexión nueva por solicitud y reintento sin clave;
+  - `ValidationClient` sin lotes: sesión con pool y claves de idempotencia;
+  - `ValidationClient` con micro-lotes: además agrupa las llamadas concurrentes.
+Con `--perdidas` una fracción de las respuestas exitosas se reemplaza por un 502 después de
+procesar el comentario (respuesta perdida): los reintentos sin clave guardan el análisis dos
+veces, los del cliente reciben el original.
+
+El servidor de desarrollo cierra cada conexión, así que la reutilización de conexiones solo
+se ve contra un servidor con keep-alive, p. ej. `gunicorn -k gthread`, con `--url` (ahí no se
+simulan pérdidas ni se cuentan conexiones ni análisis guardados).
+
+Uso:
+    python benchmarks/bench_api_client.py --n 400 --hilos 32 --perdidas 0.1
+    python benchmarks/bench_api_client.py --url http://localhost:5000 --n 200
+"""
+import argparse
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import requests  # noqa: E402
+
+from api_client import ValidationClient  # noqa: E402
+
+COMMENTS = [
+    "La biblioteca debería abrir los sábados por la mañana",
+    "El profesor de cálculo explica con mucha claridad",
+    "Los baños del segundo piso siempre están sucios",
+    "Me encanta el ambiente del campus durante el festival",
+    "Sería bueno tener más bebederos en los edificios",
+    "La cafetería tiene precios muy altos para lo que ofrece",
+]
+
+
+class LocalServer:
+    """API en un directorio temporal con el modelo simulado; cuenta solicitudes y conexiones (puertos remotos)"""
+
+    def __init__(self, loss_rate, seed):
+        from werkzeug.serving import make_server
+        from bench_label_stream import REPLIES, SimulatedStreamingModel
+
+        workdir = tempfile.mkdtemp(prefix="bench_api_client_")
+        shutil.copy(os.path.join(REPO_DIR, "tags.txt"), workdir)
+        os.chdir(workdir)
+        os.environ.setdefault("GROQ_API_KEY", "simulado")
+
+        import api
+        import pipeline
+        from flask import request
+        from prompts import PromptRegistry
+        model = SimulatedStreamingModel(replies=REPLIES["conciso"], first_token=0.05, per_token=0.002)
+        api.prompt_registry = pipeline.set_prompt_registry(
+            PromptRegistry(model, accounting=api.prompt_registry.accounting))
+        self.api = api
+
+        self.requests = 0
+        self.ports = set()
+        self._lock = threading.Lock()
+        rng = random.Random(seed)
+
+        @api.app.before_request
+        def count_request():
+            with self._lock:
+                self.requests += 1
+                self.ports.add(request.environ.get("REMOTE_PORT"))
+
+        @api.app.after_request
+        def lose_response(response):
+            with self._lock:
+                lost = (response.status_code == 200 and request.path.startswith("/procesar")
+                        and rng.random() < loss_rate)
+            if lost:
+                response.set_data(b'{"error": "respuesta perdida"}')
+                response.status_code = 502
+            return response
+
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+        self.server = make_server("127.0.0.1", 0, api.app, threaded=True)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def next_id(self):
+        """Próximo id de análisis del tenant por defecto (la diferencia cuenta los análisis guardados)"""
+        tenant = self.api.tenant_registry.acquire("default")
+        try:
+            return tenant.comments_writer.allocate_id()
+        finally:
+            self.api.tenant_registry.release(tenant)
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.ports = set()
+        return self.next_id()
+
+    def counts(self, first_id):
+        return self.requests, len(self.ports), self.next_id() - first_id - 1
+
+
+class NaiveClient:
+    """Como los scripts actuales: requests.post por llamada y reintento sin clave de idempotencia"""
+
+    def __init__(self, url, retries=3):
+        self.url = url
+        self.retries = retries
+
+    def process_comment(self, text):
+        for attempt in range(self.retries + 1):
+            try:
+                response = requests.post(f"{self.url}/procesar", json={"comentario": text}, timeout=30)
+                if response.status_code < 500:
+                    return response.json()
+            except requests.RequestException:
+                pass
+            time.sleep(0.05 * 2 ** attempt)
+        raise RuntimeError("Sin respuesta después de los reintentos")
+
+
+def measure(name, client, server, texts, threads):
+    first_id = server.reset() if server else None
+    errors = 0
+    latencies = []
+
+    def call(text):
+        start = time.perf_counter()
+        client.process_comment(text)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for future in [executor.submit(call, text) for text in texts]:
+            try:
+                future.result()
+            except Exception:
+                errors += 1
+    elapsed = time.perf_counter() - start
+    requests_sent, connections, stored = server.counts(first_id) if server else ("-", "-", "-")
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] if latencies else 0.0
+    print(f"{name:<32} {elapsed:7.2f} s {len(texts) / elapsed:8.1f}/s {p50 * 1000:8.0f} {requests_sent:>11} "
+          f"{connections:>10} {stored:>10} {errors:7d}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del cliente de la API con pool, lotes e idempotencia")
+    parser.add_argument("--n", type=int, default=400, help="Comentarios por configuración")
+    parser.add_argument("--hilos", type=int, default=32, help="Hilos que envían comentarios a la vez")
+    parser.add_argument("--perdidas", type=float, default=0.1, help="Fracción de respuestas exitosas perdidas")
+    parser.add_argument("--url", help="API ya en ejecución (por defecto se levanta una local con modelo simulado)")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    server = None if args.url else LocalServer(args.perdidas, args.seed)
+    url = args.url.rstrip("/") if args.url else server.url
+    texts = [f"{COMMENTS[i % len(COMMENTS)]} (encuesta {i})" for i in range(args.n)]
+
+    losses = f", {args.perdidas:.0%} de respuestas perdidas" if server else ""
+    print(f"{args.n} comentarios, {args.hilos} hilos{losses}")
+    print(f"{'configuración':<32} {'tiempo':>9} {'ritmo':>10} {'p50 ms':>8} {'solicitudes':>11} {'conexiones':>10} "
+          f"{'guardados':>10} {'errores':>7}")
+    measure("requests.post por llamada", NaiveClient(url), server, texts, args.hilos)
+    with ValidationClient(url, batching=False, max_connections=args.hilos) as client:
+        measure("ValidationClient sin lotes", client, server, texts, args.hilos)
+    with ValidationClient(url) as client:
+        measure("ValidationClient con micro-lotes", client, server, texts, args.hilos)
+        print(f"Micro-lotes: {client.stats()}")
+
+
+if __name__ == "__main__":
+    main()
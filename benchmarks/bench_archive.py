@@ -0,0 +1,110 @@
+"""Benchmark de memoria y tiempo de escaneo: historial JSON vs archivo columnar.
+
+Genera un historial sintético con los esquemas heredados mezclados, lo convierte al
+formato columnar y compara el cálculo de conteos por categoría y por tag con
+`json.load` contra `ArchiveReader`.
+
+Uso:
+    python benchmarks/bench_archive.py --n 1000000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from archive import ArchiveReader, convert  # noqa: E402
+from history_store import normalize_category  # noqa: E402
+from tagging import load_tags  # noqa: E402
+
+COMMENTS = [
+    "Se necesita mejor wifi en el parqueo",
+    "El maestro de matemáticas es muy bueno",
+    "Deberían mejorar la comida de la cafetería",
+    "Los equipos del laboratorio de química necesitan urgentemente una actualización.",
+    "Acabo de regresar de mi intercambio en España y quería compartir mi experiencia.",
+]
+CATEGORIES = ["Sugerencia", "Opinion", "Queja", "HateSpeech", "Vida universitaria"]
+
+
+def build_history(n, seed=7):
+    rng = random.Random(seed)
+    tags = load_tags(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tags.txt"))
+    start = datetime(2024, 1, 1)
+    history = []
+    for i in range(n):
+        text = rng.choice(COMMENTS)
+        base = {
+            "timestamp": (start + timedelta(seconds=i * 30)).isoformat(),
+            "categoria": rng.choice(CATEGORIES),
+            "tags": rng.sample(tags, rng.randint(0, 3)),
+        }
+        schema = rng.random()
+        if schema < 0.3:
+            base["comentario"] = text
+        elif schema < 0.5:
+            base.update(comentario_original=text, comentario_final=text, fue_formalizado=False)
+        else:
+            base.update(id=i + 1, comentario_original=text, comentario_formalizado=None, is_coherent=True)
+        history.append(base)
+    return history
+
+
+def measure(label, func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<22} {elapsed:8.3f} s  pico de memoria {peak / 1e6:10.1f} MB")
+    return result
+
+
+def scan_json(path):
+    with open(path, "r", encoding="utf-8") as file:
+        history = json.load(file)
+    categories = Counter(normalize_category(item["categoria"]) for item in history)
+    tags = Counter(tag for item in history for tag in item["tags"])
+    return dict(categories), tags
+
+
+def scan_archive(path):
+    with ArchiveReader(path) as reader:
+        return reader.category_counts(), reader.tag_counts()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del archivo columnar de historial")
+    parser.add_argument("--n", type=int, default=200000, help="Cantidad de registros sintéticos")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        json_path = os.path.join(workdir, "historial.json")
+        archive_path = os.path.join(workdir, "historial.hca")
+
+        with open(json_path, "w", encoding="utf-8") as file:
+            json.dump(build_history(args.n), file, ensure_ascii=False, indent=2)
+        convert([json_path], archive_path)
+
+        print(f"JSON:     {os.path.getsize(json_path) / 1e6:10.1f} MB")
+        print(f"Columnar: {os.path.getsize(archive_path) / 1e6:10.1f} MB")
+
+        expected = measure("json.load + Counter", lambda: scan_json(json_path))
+        result = measure("ArchiveReader (mmap)", lambda: scan_archive(archive_path))
+
+        if expected[0] != {k: v for k, v in result[0].items() if v} or expected[1] != result[1]:
+            print("ERROR: los conteos no coinciden")
+            sys.exit(1)
+        print("Conteos idénticos")
+
+
+if __name__ == "__main__":
+    main()
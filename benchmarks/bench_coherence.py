@@ -0,0 +1,166 @@
+"""Benchmark de throughput del validador de coherencia.
+
+Compara la implementación original (que reconstruye sus tablas en cada llamada)
+contra `CoherenceValidator.validate`, `validate_many` y `validate_many` con pool
+de procesos, verificando que las reglas produzcan exactamente los mismos veredictos.
+Además mide el validador con el modelo de n-gramas y cuántos textos rechaza de más.
+
+Uso:
+    python benchmarks/bench_coherence.py --n 200000 --processes 4
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from coherence import INCOHERENT_PATTERNS, CoherenceValidator, validator  # noqa: E402
+
+
+def legacy_is_coherent_text(text):
+    """Implementación original de is_coherent_text, usada como referencia de veredictos"""
+    text = text.strip()
+    
+    # 1. Verificar que no esté vacío
+    if not text:
+        return False
+    
+    # 2. Verificar que tenga al menos 2 palabras
+    words = text.split()
+    if len(words) < 2:
+        return False
+    
+    # 3. Verificar que no sean solo caracteres especiales o números
+    clean_text = re.sub(r'[^\w\s]', '', text)
+    if len(clean_text.strip()) < 3:
+        return False
+    
+    # 4. Verificar que no sean solo repeticiones de la misma palabra
+    unique_words = set(word.lower() for word in words if word.isalpha())
+    if len(unique_words) < 2:
+        return False
+    
+    # 5. Detectar incoherencia semántica usando reglas híbridas
+    # Lista de patrones específicamente incoherentes
+    incoherent_patterns = [
+        "casa azul mojado", "perro volando matemáticas", "mesa correr feliz",
+        "computadora cantar verde", "silla bailar número", "árbol escribir calor",
+        "teléfono dormir azúcar", "libro nadar rojo", "ventana comer fríos",
+        "zapato volar música", "reloj bailar agua", "puerta correr números"
+    ]
+    
+    # Si es exactamente uno de estos casos, es incoherente
+    if text.lower().strip() in incoherent_patterns:
+        return False
+    
+    # Verificar patrones de incoherencia (sustantivo + verbo incongruente + adjetivo/sustantivo)
+    # Ejemplo: "casa cantar azul" (objeto físico + acción incompatible + descriptor)
+    if len(words) == 3:
+        # Objetos físicos que no pueden realizar ciertas acciones
+        objects = {'casa', 'mesa', 'silla', 'puerta', 'ventana', 'libro', 'teléfono', 'computadora'}
+        impossible_actions = {'cantar', 'bailar', 'correr', 'volar', 'nadar', 'dormir', 'comer'}
+        
+        word1, word2, word3 = [w.lower() for w in words]
+        
+        # Si primer palabra es objeto y segunda es acción imposible
+        if word1 in objects and word2 in impossible_actions:
+            return False
+    
+    # Verificar estructura mínima de oración en español
+    structure_indicators = {
+        'el', 'la', 'los', 'las', 'un', 'una', 'unos', 'unas',
+        'es', 'está', 'son', 'están', 'tiene', 'tienen', 'hay', 'fue', 'era',
+        'de', 'del', 'en', 'con', 'por', 'para', 'desde', 'hasta', 'sobre',
+        'que', 'se', 'me', 'te', 'le', 'nos', 'les', 'mi', 'tu', 'su',
+        'muy', 'más', 'menos', 'bien', 'mal', 'no', 'sí', 'y', 'o', 'pero',
+        'quiero', 'necesito', 'creo', 'pienso', 'siento', 'veo', 'escucho',
+        'necesitamos', 'queremos', 'podemos', 'debemos'
+    }
+    
+    text_words = set(word.lower() for word in words)
+    has_structure = bool(text_words.intersection(structure_indicators))
+    
+    if not has_structure:
+        return False
+    
+    return True
+
+
+def build_corpus(n, seed=42):
+    """Construir un corpus mixto: historial real, patrones incoherentes y ruido"""
+    base = []
+    history_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                "comentarios_analizados.json")
+    if os.path.exists(history_path):
+        with open(history_path, "r", encoding="utf-8") as file:
+            for item in json.load(file):
+                text = item.get("comentario") or item.get("comentario_original")
+                if text:
+                    base.append(text)
+
+    base.extend(INCOHERENT_PATTERNS)
+    base.extend([
+        "", "hola", "!!! ???", "jaja jaja jaja", "casa cantar azul", "mesa volar rápido",
+        "asdf qwer zxcv", "El wifi de la biblioteca no funciona", "Necesitamos más parqueos",
+        "123 456 789", "la la la", "MUY BUENO EL CURSO", "profesor excelente clases",
+    ])
+
+    rng = random.Random(seed)
+    letters = "abcdefghijklmnopqrstuvwxyzáéíóúñ"
+    corpus = []
+    for _ in range(n):
+        if rng.random() < 0.2:
+            words = ["".join(rng.choice(letters) for _ in range(rng.randint(1, 8)))
+                     for _ in range(rng.randint(1, 6))]
+            corpus.append(" ".join(words))
+        else:
+            corpus.append(rng.choice(base))
+    return corpus, set(base)
+
+
+def timed(label, func, n):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<32} {elapsed:8.3f} s  {n / elapsed:12,.0f} textos/s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del validador de coherencia")
+    parser.add_argument("--n", type=int, default=100000, help="Cantidad de textos a validar")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1,
+                        help="Procesos para validate_many con pool")
+    args = parser.parse_args()
+
+    corpus, base = build_corpus(args.n)
+    rules = CoherenceValidator(language_model=None)
+
+    expected = timed("original (por llamada)", lambda: [legacy_is_coherent_text(t) for t in corpus], args.n)
+    single = timed("reglas: validate", lambda: [rules.validate(t) for t in corpus], args.n)
+    batch = timed("reglas: validate_many", lambda: rules.validate_many(corpus), args.n)
+    pooled = timed(f"validate_many ({args.processes} procesos)",
+                   lambda: validator.validate_many(corpus, processes=args.processes), args.n)
+    with_model = timed("reglas + n-gramas: validate", lambda: [validator.validate(t) for t in corpus], args.n)
+
+    for name, verdicts in (("validate", single), ("validate_many", batch)):
+        mismatches = sum(1 for a, b in zip(expected, verdicts) if a != b)
+        if mismatches or len(verdicts) != len(expected):
+            print(f"ERROR: {name} difiere de la implementación original en {mismatches} textos")
+            sys.exit(1)
+    if pooled != with_model:
+        print("ERROR: validate_many con pool difiere de validate")
+        sys.exit(1)
+
+    print(f"Veredictos idénticos en {len(expected)} textos ({sum(expected)} coherentes)")
+    extra = [text for text, rule, model in zip(corpus, expected, with_model) if rule and not model]
+    print(f"El modelo de n-gramas rechaza además {len(extra)} textos "
+          f"({sum(text in base for text in extra)} del historial real y los casos fijos)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Benchmark de calidad y rendimiento del nivel difuso de tags.
+
+Calidad: genera comentarios sintéticos que mencionan un tag con una variación (sin
+acentos, singular/plural, un error de escritura) y mide el recall del tag esperado con
+y sin el nivel difuso; además mide falsos positivos en frases sin ningún tag.
+Rendimiento: textos por segundo con `extract` texto por texto y con `extract_many`, con
+índices nuevos (sin términos recordados) y con un índice que ya vio los mismos textos.
+
+Uso:
+    python benchmarks/bench_fuzzy_tags.py --n 5000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fuzzy_tags  # noqa: E402
+from heuristics import strip_accents  # noqa: E402
+from tagging import TagIndex, load_tags  # noqa: E402
+
+TEMPLATES = [
+    "Quisiera comentar sobre {tag} porque últimamente ha empeorado",
+    "En general {tag} me parece bien pero podría mejorar",
+    "Nadie nos informó nada de {tag} en todo el semestre",
+    "Estoy muy contento con {tag} este año",
+]
+# Frases sin tags para medir falsos positivos
+DISTRACTORS = [
+    "Hoy llegué tarde porque llovió muchísimo en la mañana",
+    "Me parece que la gente debería ser más amable con los demás",
+    "No entiendo por qué todo tiene que ser tan complicado siempre",
+    "Ayer estuve pensando en lo rápido que pasa el tiempo",
+    "Gracias a todos por la paciencia durante estas semanas difíciles",
+    "Ojalá que la próxima vez nos avisen con más anticipación",
+]
+
+
+def typo(word, rng):
+    """Un error de escritura: borrar, duplicar o cambiar una letra interior"""
+    if len(word) < 6:
+        return word
+    position = rng.randrange(1, len(word) - 1)
+    kind = rng.choice(("borrar", "duplicar", "cambiar"))
+    if kind == "borrar":
+        return word[:position] + word[position + 1:]
+    if kind == "duplicar":
+        return word[:position] + word[position] + word[position:]
+    return word[:position] + rng.choice("aeiourstnl") + word[position + 1:]
+
+
+def variation(tag, rng):
+    kind = rng.choice(("acentos", "numero", "error"))
+    if kind == "acentos":
+        return strip_accents(tag), kind
+    if kind == "numero":
+        words = tag.split()
+        words[0] = words[0][:-1] if words[0].endswith("s") else words[0] + "s"
+        return " ".join(words), kind
+    return " ".join(typo(word, rng) for word in tag.split()), kind
+
+
+def build_cases(tags, n, seed=11):
+    rng = random.Random(seed)
+    cases = []
+    for _ in range(n):
+        tag = rng.choice(tags)
+        text, kind = variation(tag, rng)
+        cases.append((rng.choice(TEMPLATES).format(tag=text), tag, kind))
+    return cases
+
+
+def recall(index, cases):
+    hits = {}
+    for text, tag, kind in cases:
+        found = tag in index.extract(text)
+        total, good = hits.get(kind, (0, 0))
+        hits[kind] = (total + 1, good + int(found))
+    overall = sum(good for _, good in hits.values()) / len(cases)
+    return overall, {kind: good / total for kind, (total, good) in sorted(hits.items())}
+
+
+def throughput(label, func, texts):
+    start = time.perf_counter()
+    func(texts)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<40} {len(texts) / elapsed:10.0f} textos/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del nivel difuso de tags")
+    parser.add_argument("--n", type=int, default=5000, help="Cantidad de comentarios sintéticos")
+    args = parser.parse_args()
+
+    if not fuzzy_tags.available():
+        print("NumPy no está instalado (o FUZZY_TAGS=0): no hay nivel difuso que medir")
+        sys.exit(1)
+
+    tags = load_tags(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tags.txt"))
+    exact_index = TagIndex(tags, fuzzy=False)
+    fuzzy_index = TagIndex(tags)
+    cases = build_cases(tags, args.n)
+
+    print("Recall del tag esperado")
+    for label, index in (("solo exactas", exact_index), ("con nivel difuso", fuzzy_index)):
+        overall, by_kind = recall(index, cases)
+        detail = "  ".join(f"{kind}: {value:.1%}" for kind, value in by_kind.items())
+        print(f"  {label:<18} {overall:6.1%}   {detail}")
+
+    false_positives = sum(bool(fuzzy_index.extract(text)) for text in DISTRACTORS)
+    exact_false_positives = sum(bool(exact_index.extract(text)) for text in DISTRACTORS)
+    print(f"Frases sin tags con algún tag: solo exactas {exact_false_positives}/{len(DISTRACTORS)}, "
+          f"con nivel difuso {false_positives}/{len(DISTRACTORS)}")
+
+    texts = [text for text, _, _ in cases]
+    fuzzy_tags.ngram_buckets.cache_clear()
+    fuzzy_tags.term_vector.cache_clear()
+    print("Rendimiento")
+    throughput("extract (solo exactas)", lambda batch: [exact_index.extract(text) for text in batch], texts)
+    # Índices nuevos: cada medición empieza sin coincidencias recordadas por término
+    per_text_index = TagIndex(tags)
+    throughput("extract (difuso, texto por texto)", lambda batch: [per_text_index.extract(text) for text in batch], texts)
+    batch_index = TagIndex(tags)
+    throughput("extract_many (difuso, un lote)", batch_index.extract_many, texts)
+    throughput("extract_many (difuso, términos vistos)", batch_index.extract_many, texts)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Benchmark del corte temprano de los prompts de clasificación y de los topes de tokens.
+
+Usa un modelo simulado que transmite su respuesta token por token con una latencia fija
+(primer token + tiempo por token, parecido a un proveedor real) y que respeta `max_tokens`.
+Compara, para respuestas concisas y para respuestas verbosas (la etiqueta seguida de una
+explicación), la latencia y los tokens generados por prompt:
+  - sin topes ni corte: el stream se lee completo, como antes;
+  - con topes y corte temprano: la configuración de `prompts.PROMPTS`.
+
+Uso:
+    python benchmarks/bench_label_stream.py --n 10 --latencia-token 0.004
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.language_models import BaseChatModel  # noqa: E402
+from langchain_core.messages import AIMessage, AIMessageChunk  # noqa: E402
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult  # noqa: E402
+
+from prompts import PROMPTS, PromptRegistry  # noqa: E402
+
+EXPLANATION = ("El comentario expresa una crítica directa hacia el personal docente con un tono negativo "
+               "y palabras que pueden considerarse ofensivas dentro de un entorno académico, por lo que "
+               "corresponde a esta categoría según las reglas indicadas en las instrucciones anteriores.")
+FORMALIZED = ("Considero que la metodología del profesor podría mejorar: las explicaciones son poco claras "
+              "y sería útil contar con más ejemplos prácticos y retroalimentación oportuna en las evaluaciones "
+              "para facilitar el aprendizaje de todo el grupo.")
+TITLE_FIX = "Propuesta para mejorar la atención en la biblioteca"
+
+# Respuestas por prompt (se reconoce por un fragmento de su plantilla)
+REPLIES = {
+    "conciso": {
+        "Categoría:": "Queja",
+        "Clasificación:": "OFENSIVO",
+        "Comentario formalizado:": FORMALIZED,
+        "Título corregido:": TITLE_FIX,
+    },
+    "verboso": {
+        "Categoría:": f"Queja\n\n{EXPLANATION}",
+        "Clasificación:": f"OFENSIVO\n\nExplicación: {EXPLANATION}",
+        "Comentario formalizado:": f"{FORMALIZED}\n\nNota: {EXPLANATION} {EXPLANATION}",
+        "Título corregido:": f"{TITLE_FIX}\n\nEste título conserva la idea original. {EXPLANATION}",
+    },
+}
+
+VARIABLES = {
+    "categorizar_comentario": {"comment": "El profesor es pésimo y no explica nada"},
+    "formalizar_comentario": {"comment": "El profesor es pésimo y no explica nada"},
+    "detectar_titulo_ofensivo": {"title": "La biblioteca es una porquería"},
+    "corregir_titulo": {"title": "La biblioteca es una porquería"},
+}
+
+TOKEN_RE = re.compile(r"\S{1,4}\s*|\s+")
+
+
+class SimulatedStreamingModel(BaseChatModel):
+    """Modelo simulado: primer token tras `first_token` segundos y luego uno cada `per_token` segundos"""
+
+    replies: dict
+    first_token: float = 0.1
+    per_token: float = 0.004
+
+    @property
+    def _llm_type(self):
+        return "simulado"
+
+    def _reply(self, messages):
+        text = messages[-1].content
+        for fragment, reply in self.replies.items():
+            if fragment in text:
+                return reply
+        return ""
+
+    def _stream(self, messages, stop=None, run_manager=None, max_tokens=None, **kwargs):
+        tokens = TOKEN_RE.findall(self._reply(messages))
+        if max_tokens:
+            tokens = tokens[:max_tokens]
+        time.sleep(self.first_token)
+        for token in tokens:
+            time.sleep(self.per_token)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        text = "".join(chunk.message.content for chunk in self._stream(messages, stop, run_manager, **kwargs))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+
+def measure(registry, n):
+    rows = {}
+    for name, variables in VARIABLES.items():
+        latencies = []
+        for _ in range(n):
+            start = time.perf_counter()
+            registry.run(name, variables, endpoint="benchmark")
+            latencies.append(time.perf_counter() - start)
+        rows[name] = sum(latencies) / n
+    usage = registry.accounting.snapshot()["por_prompt"]
+    return {name: (latency, usage[registry.version(name)]["completion_tokens"] / n,
+                   usage[registry.version(name)]["cortes_tempranos"])
+            for name, latency in rows.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del corte temprano y los topes de tokens")
+    parser.add_argument("--n", type=int, default=10, help="Llamadas por prompt y configuración")
+    parser.add_argument("--latencia-token", type=float, default=0.004, help="Segundos por token generado")
+    parser.add_argument("--primer-token", type=float, default=0.1, help="Segundos hasta el primer token")
+    args = parser.parse_args()
+
+    uncapped = {name: spec._replace(max_tokens=None, labels=()) for name, spec in PROMPTS.items()}
+    for style, replies in REPLIES.items():
+        model = SimulatedStreamingModel(replies=replies, first_token=args.primer_token, per_token=args.latencia_token)
+        before = measure(PromptRegistry(model, prompts=uncapped), args.n)
+        after = measure(PromptRegistry(model), args.n)
+        print(f"Respuestas {style}")
+        print(f"  {'prompt':<26} {'antes ms':>9} {'después ms':>11} {'ahorro':>7} {'tokens antes':>13} "
+              f"{'tokens después':>15} {'cortes':>7}")
+        for name in VARIABLES:
+            latency_before, tokens_before, _ = before[name]
+            latency_after, tokens_after, cuts = after[name]
+            saved = 1 - latency_after / latency_before
+            print(f"  {name:<26} {latency_before * 1000:9.0f} {latency_after * 1000:11.0f} {saved:7.0%} "
+                  f"{tokens_before:13.1f} {tokens_after:15.1f} {cuts:>4}/{args.n}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+from ngram_lm import NGRAM_MAX_PERPLEXITY, default_model
+
+# Tablas de consulta compartidas: se construyen una sola vez al importar el módulo
+
+# Lista de patrones específicamente incoherentes
+INCOHERENT_PATTERNS = frozenset({
+    "casa azul mojado", "perro volando matemáticas", "mesa correr feliz",
+    "computadora cantar verde", "silla bailar número", "árbol escribir calor",
+    "teléfono dormir azúcar", "libro nadar rojo", "ventana comer fríos",
+    "zapato volar música", "reloj bailar agua", "puerta correr números"
+})
+
+# Objetos físicos que no pueden realizar ciertas acciones
+OBJECTS = frozenset({'casa', 'mesa', 'silla', 'puerta', 'ventana', 'libro', 'teléfono', 'computadora'})
+IMPOSSIBLE_ACTIONS = frozenset({'cantar', 'bailar', 'correr', 'volar', 'nadar', 'dormir', 'comer'})
+
+# Indicadores de estructura mínima de oración en español
+STRUCTURE_INDICATORS = frozenset({
+    # Artículos
+    'el', 'la', 'los', 'las', 'un', 'una', 'unos', 'unas',
+    # Verbos auxiliares y comunes
+    'es', 'está', 'son', 'están', 'tiene', 'tienen', 'hay', 'fue', 'era',
+    # Preposiciones
+    'de', 'del', 'en', 'con', 'por', 'para', 'desde', 'hasta', 'sobre',
+    # Pronombres y conectores
+    'que', 'se', 'me', 'te', 'le', 'nos', 'les', 'mi', 'tu', 'su',
+    # Adverbios y conjunciones
+    'muy', 'más', 'menos', 'bien', 'mal', 'no', 'sí', 'y', 'o', 'pero',
+    # Verbos de opinión/estado
+    'quiero', 'necesito', 'creo', 'pienso', 'siento', 'veo', 'escucho',
+    'necesitamos', 'queremos', 'podemos', 'debemos'
+})
+
+NON_WORD_RE = re.compile(r'[^\w\s]')
+
+# Por debajo de esta cantidad de textos no compensa arrancar procesos
+MIN_TEXTS_FOR_POOL = 2000
+
+# Rechazo por perplejidad del modelo de n-gramas de caracteres (tecleo al azar)
+NGRAM_COHERENCE = os.getenv("NGRAM_COHERENCE", "1") == "1"
+
+
+class CoherenceValidator:
+    """Validador de coherencia con tablas congeladas y expresiones precompiladas"""
+
+    def __init__(self, incoherent_patterns=INCOHERENT_PATTERNS, objects=OBJECTS,
+                 impossible_actions=IMPOSSIBLE_ACTIONS, structure_indicators=STRUCTURE_INDICATORS,
+                 language_model=None, max_perplexity=NGRAM_MAX_PERPLEXITY, load_language_model=None):
+        self.incoherent_patterns = frozenset(incoherent_patterns)
+        self.objects = frozenset(objects)
+        self.impossible_actions = frozenset(impossible_actions)
+        self.structure_indicators = frozenset(structure_indicators)
+        self._language_model = language_model
+        # Si no se pasa el modelo, `load_language_model()` lo carga en el primer uso (no al importar)
+        self._load_language_model = load_language_model
+        self.max_perplexity = max_perplexity
+
+    @property
+    def language_model(self):
+        if self._language_model is None and self._load_language_model is not None:
+            self._language_model = self._load_language_model()
+        return self._language_model
+
+    def validate(self, text):
+        """Validar si el texto es coherente (más de una palabra y tiene sentido básico)"""
+        text = text.strip()
+
+        # 1. Verificar que no esté vacío
+        if not text:
+            return False
+
+        # 2. Verificar que tenga al menos 2 palabras (se tokeniza una sola vez)
+        words = text.split()
+        if len(words) < 2:
+            return False
+
+        # 3. Verificar que no sean solo caracteres especiales o números
+        clean_text = NON_WORD_RE.sub('', text)
+        if len(clean_text.strip()) < 3:
+            return False
+
+        # 4. Verificar que no sean solo repeticiones de la misma palabra
+        lowered = [word.lower() for word in words]
+        unique_words = {low for word, low in zip(words, lowered) if word.isalpha()}
+        if len(unique_words) < 2:
+            return False
+
+        # 5. Detectar incoherencia semántica usando reglas híbridas
+        # Los patrones incoherentes y la regla objeto + acción tienen exactamente 3 palabras
+        if len(words) == 3:
+            if text.lower().strip() in self.incoherent_patterns:
+                return False
+
+            # Si primer palabra es objeto y segunda es acción imposible
+            if lowered[0] in self.objects and lowered[1] in self.impossible_actions:
+                return False
+
+        # Verificar estructura mínima de oración en español
+        if self.structure_indicators.isdisjoint(lowered):
+            return False
+
+        # 6. Rechazar secuencias de caracteres improbables en español (p. ej. "asdkj de qwpeoir")
+        language_model = self.language_model
+        if language_model is not None and language_model.is_gibberish(text, self.max_perplexity):
+            return False
+
+        return True
+
+    __call__ = validate
+
+    def validate_many(self, texts, processes=None, chunksize=500):
+        """Validar un lote de textos; con `processes` usa un pool de procesos para lotes grandes"""
+        texts = list(texts)
+
+        if not processes or processes <= 1 or len(texts) < MIN_TEXTS_FOR_POOL:
+            return [self.validate(text) for text in texts]
+
+        # Cada proceso recibe este validador (no el del módulo) una sola vez, con el modelo ya cargado aquí
+        # para que no lo entrene cada proceso
+        self.language_model
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_pool_validator,
+                                 initargs=(self,)) as executor:
+            return list(executor.map(_validate_in_pool, texts, chunksize=chunksize))
+
+
+# Validador compartido; el modelo de n-gramas se carga (o entrena) en la primera validación, no al importar
+validator = CoherenceValidator(load_language_model=default_model if NGRAM_COHERENCE else None)
+
+# Validador de cada proceso del pool de `validate_many`
+_pool_validator = None
+
+
+def _init_pool_validator(pool_validator):
+    global _pool_validator
+    _pool_validator = pool_validator
+
+
+def _validate_in_pool(text):
+    """Punto de entrada serializable para los procesos del pool"""
+    return _pool_validator.validate(text)
+
+
+def is_coherent_text(text):
+    """Validar si el texto es coherente (más de una palabra y tiene sentido básico)"""
+    return validator.validate(text)
@@ -1,9 +1,13 @@
 import os
 import sys
 import asyncio
+import io
+import csv
 import json
-import re
-from datetime import datetime
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 
 # Configuración para Windows y PyTorch
 if sys.platform == "win32":
@@ -21,320 +25,128 @@ if sys.platform == "win32":
         pass  # Torch no está instalado
 
 import streamlit as st    
-from dotenv import load_dotenv
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_groq import ChatGroq
 
-load_dotenv()
+from pipeline import MissingAPIKey, create_model
+from coherence import is_coherent_text, validator
+from backfill import iter_records
+from tagging import TagVocabulary
+from prompts import PromptRegistry, DEFAULT_CATEGORY, COMMENT_PROMPTS, parse_category, clean_formalized
+from history_store import COMMENTS_HISTORY_FILE, DEFAULT_HISTORY_DIR, SegmentedHistory, normalize_category
+from trending import TrendingTags
+from long_text import LONG_TEXT_THRESHOLD, LONG_TEXT_CHUNK_CHARS, classify_long_comment
 
-# Configurar claves API
-groq_api_key = os.getenv("GROQ_API_KEY")
-if not groq_api_key:
-    st.error("No se encontró la clave API de Groq. Asegúrate de configurar GROQ_API_KEY en tu archivo .env")
+st.set_page_config(page_title="Analizador de Comentarios", layout="wide")
 
-model = ChatGroq(groq_api_key=groq_api_key, model="llama-3.3-70b-versatile")
+# Periodos disponibles para las estadísticas (días hacia atrás; None = todo el historial)
+HISTORY_PERIODS = {"Últimos 7 días": 7, "Últimos 30 días": 30, "Todo": None}
 
-st.set_page_config(page_title="Analizador de Comentarios", layout="wide")
+# La API escribe en el mismo historial desde otro proceso: las lecturas en caché expiran solas
+HISTORY_CACHE_TTL = 30
 
-@st.cache_data
-def load_tags():
-    """Cargar tags desde el archivo tags.txt"""
-    try:
-        with open("tags.txt", "r", encoding="utf-8") as file:
-            tags = [line.strip().lower() for line in file if line.strip()]
-        return tags
-    except FileNotFoundError:
-        st.error("No se encontró el archivo tags.txt")
-        return []
-    except Exception as e:
-        st.error(f"Error cargando tags: {str(e)}")
-        return []
+@st.cache_resource
+def get_model():
+    """Cliente del LLM creado una sola vez por servidor (no en cada rerun).
+    Sin GROQ_API_KEY lanza MissingAPIKey, que no queda en caché: al configurar la clave funciona sin reiniciar"""
+    return create_model()
 
-def is_coherent_text(text):
-    """Validar si el texto es coherente (más de una palabra y tiene sentido básico)"""
-    text = text.strip()
-    
-    # 1. Verificar que no esté vacío
-    if not text:
-        return False
-    
-    # 2. Verificar que tenga al menos 2 palabras
-    words = text.split()
-    if len(words) < 2:
-        return False
-    
-    # 3. Verificar que no sean solo caracteres especiales o números
-    clean_text = re.sub(r'[^\w\s]', '', text)
-    if len(clean_text.strip()) < 3:
-        return False
-    
-    # 4. Verificar que no sean solo repeticiones de la misma palabra
-    unique_words = set(word.lower() for word in words if word.isalpha())
-    if len(unique_words) < 2:
-        return False
-    
-    # 5. Detectar incoherencia semántica usando reglas híbridas
-    
-    # Lista de patrones específicamente incoherentes
-    incoherent_patterns = [
-        "casa azul mojado", "perro volando matemáticas", "mesa correr feliz",
-        "computadora cantar verde", "silla bailar número", "árbol escribir calor",
-        "teléfono dormir azúcar", "libro nadar rojo", "ventana comer fríos",
-        "zapato volar música", "reloj bailar agua", "puerta correr números"
-    ]
-    
-    # Si es exactamente uno de estos casos, es incoherente
-    if text.lower().strip() in incoherent_patterns:
-        return False
-    
-    # Verificar patrones de incoherencia (sustantivo + verbo incongruente + adjetivo/sustantivo)
-    # Ejemplo: "casa cantar azul" (objeto físico + acción incompatible + descriptor)
-    if len(words) == 3:
-        # Objetos físicos que no pueden realizar ciertas acciones
-        objects = {'casa', 'mesa', 'silla', 'puerta', 'ventana', 'libro', 'teléfono', 'computadora'}
-        impossible_actions = {'cantar', 'bailar', 'correr', 'volar', 'nadar', 'dormir', 'comer'}
-        
-        word1, word2, word3 = [w.lower() for w in words]
-        
-        # Si primer palabra es objeto y segunda es acción imposible
-        if word1 in objects and word2 in impossible_actions:
-            return False
-    
-    # Verificar estructura mínima de oración en español
-    structure_indicators = {
-        # Artículos
-        'el', 'la', 'los', 'las', 'un', 'una', 'unos', 'unas',
-        # Verbos auxiliares y comunes
-        'es', 'está', 'son', 'están', 'tiene', 'tienen', 'hay', 'fue', 'era',
-        # Preposiciones
-        'de', 'del', 'en', 'con', 'por', 'para', 'desde', 'hasta', 'sobre',
-        # Pronombres y conectores
-        'que', 'se', 'me', 'te', 'le', 'nos', 'les', 'mi', 'tu', 'su',
-        # Adverbios y conjunciones
-        'muy', 'más', 'menos', 'bien', 'mal', 'no', 'sí', 'y', 'o', 'pero',
-        # Verbos de opinión/estado
-        'quiero', 'necesito', 'creo', 'pienso', 'siento', 'veo', 'escucho',
-        'necesitamos', 'queremos', 'podemos', 'debemos'
-    }
-    
-    text_words = set(word.lower() for word in words)
-    has_structure = bool(text_words.intersection(structure_indicators))
-    
-    # Si no tiene indicadores estructurales, probablemente es incoherente
-    if not has_structure:
-        return False
-    
-    return True
+@st.cache_resource
+def get_tag_vocabulary():
+    """Vocabulario de tags compartido entre sesiones; se recarga solo cuando cambia tags.txt"""
+    return TagVocabulary("tags.txt").start()
 
-def extract_tags_from_text(text, available_tags):
-    """Extraer tags relevantes del texto - cantidad dinámica según longitud"""
-    text_lower = text.lower()
-    tag_scores = {}  # tag -> puntuación de relevancia
-    
-    # Palabras del texto
-    words_in_text = re.findall(r'\b\w+\b', text_lower)
-    
-    # Determinar cantidad máxima de tags según longitud del texto
-    if len(words_in_text) <= 4:  # Texto muy corto (4 palabras o menos)
-        max_tags = 1
-    elif len(words_in_text) <= 8:  # Texto mediano (5-8 palabras)
-        max_tags = 2
-    else:  # Texto largo (9+ palabras)
-        max_tags = 3
-    
-    for tag in available_tags:
-        score = 0
-        matches = []  # Posiciones donde se encuentra el tag
-        
-        # 1. Búsqueda exacta
-        for i, word in enumerate(words_in_text):
-            if word == tag:
-                matches.append(i)
-                score += 3  # Puntuación alta para coincidencia exacta
-        
-        # 2. Búsqueda de variaciones simples
-        if not matches:  # Solo si no hubo coincidencia exacta
-            for i, word in enumerate(words_in_text):
-                # Plurales simples: maestro -> maestros
-                if word == tag + 's' or tag == word + 's':
-                    matches.append(i)
-                    score += 2  # Puntuación media para variaciones
-                    break
-                # Plurales con 'es': clase -> clases
-                elif word == tag + 'es' or tag == word + 'es':
-                    matches.append(i)
-                    score += 2
-                    break
-        
-        # Si encontramos el tag, calcular puntuación final
-        if matches:
-            # Bonus por longitud del tag (tags más específicos son más relevantes)
-            score += len(tag) * 0.1
-            
-            # Bonus por posición temprana en el texto
-            first_position = min(matches)
-            position_bonus = max(0, 5 - first_position)  # Más puntos si aparece al principio
-            score += position_bonus
-            
-            # Bonus por frecuencia
-            frequency_bonus = len(matches) * 0.5
-            score += frequency_bonus
-            
-            tag_scores[tag] = score
-    
-    # Ordenar por relevancia (mayor puntuación primero) y tomar según longitud del texto
-    sorted_tags = sorted(tag_scores.items(), key=lambda x: x[1], reverse=True)
-    most_relevant_tags = [tag for tag, score in sorted_tags[:max_tags]]
-    
-    return most_relevant_tags
+@st.cache_resource
+def get_prompt_registry():
+    """Cadenas de prompts construidas una sola vez por servidor"""
+    return PromptRegistry(get_model())
+
+@st.cache_resource
+def get_llm_executor():
+    """Pool compartido para categorizar fragmentos de comentarios largos en paralelo"""
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="llm")
 
 def categorize_comment(comment):
     """Categorizar el comentario usando LLM"""
-    template = """
-    Analiza el siguiente comentario y categorízalo EXACTAMENTE en una de estas cuatro categorías:
-    - "Sugerencia": Si el comentario propone mejoras, ideas, cambios o recomendaciones constructivas
-    - "Opinion": Si el comentario expresa una opinión personal neutral o positiva, experiencias sin ser ofensivo
-    - "HateSpeech": Si el comentario contiene lenguaje ofensivo, discriminatorio, amenazas, insultos, críticas muy negativas, o sentimientos muy negativos hacia personas (ej: "el maestro es malo", "odio a...", "es terrible", etc.)
-    - "Vida universitaria": Si el comentario se refiere específicamente a experiencias, situaciones, actividades o aspectos de la vida universitaria, académica o estudiantil que no encajan en las otras categorías
-
-    Reglas importantes:
-    1. Responde SOLO con una de estas cuatro palabras: "Sugerencia", "Opinion", "HateSpeech", o "Vida universitaria"
-    2. No agregues explicaciones adicionales
-    3. Comentarios negativos sobre personas (maestros, compañeros, etc.) van en "HateSpeech"
-    4. Comentarios sobre clases, universidad, estudios, campus, etc. van en "Vida universitaria"
-    5. Si hay duda, prioriza en este orden: HateSpeech > Vida universitaria > Sugerencia > Opinion
-
-    Ejemplos:
-    - "El maestro es malo" → HateSpeech
-    - "La clase de matemáticas es difícil" → Vida universitaria
-    - "Deberían mejorar la cafetería" → Sugerencia
-    - "Me gusta estudiar" → Opinion
-
-    Comentario: "{comment}"
-    
-    Categoría:
-    """
-    
-    prompt = ChatPromptTemplate.from_template(template)
-    chain = prompt | model
-    
     try:
-        response = ""
-        for chunk in chain.stream({"comment": comment}):
-            response += chunk.content
-        
-        # Limpiar la respuesta y validar
-        category = response.strip()
-        valid_categories = ["Sugerencia", "Opinion", "HateSpeech", "Vida universitaria"]
-        
-        if category in valid_categories:
-            return category
-        else:
-            # Si la respuesta no es válida, intentar extraer una categoría válida
-            for valid_cat in valid_categories:
-                if valid_cat.lower() in category.lower():
-                    return valid_cat
-            # Si no se encuentra ninguna, retornar Opinion por defecto
-            return "Opinion"
+        response = get_prompt_registry().run("categorizar_comentario", {"comment": comment}, endpoint="streamlit")
+        return parse_category(response)
             
     except Exception as e:
         st.error(f"Error categorizando comentario: {str(e)}")
-        return "Opinion"  # Categoría por defecto en caso de error
+        return DEFAULT_CATEGORY  # Categoría por defecto en caso de error
 
 def formalize_hate_speech(comment):
     """Convertir comentario ofensivo a lenguaje formal y apropiado"""
-    template = """
-    El siguiente comentario contiene lenguaje ofensivo. Conviértelo a un comentario formal, respetuoso y constructivo que exprese la misma idea pero de manera apropiada para un entorno académico o profesional.
-
-    Reglas:
-    1. Eliminar todas las palabras ofensivas, vulgaridades o insultos
-    2. Mantener la esencia del mensaje pero en tono constructivo
-    3. Usar lenguaje formal y respetuoso
-    4. Si es una queja, convertirla en feedback constructivo
-    5. Máximo 2-3 líneas
-    6. Responder SOLO con el texto formalizado, sin explicaciones adicionales
-
-    Comentario original: "{comment}"
-
-    Comentario formalizado:
-    """
-    
-    prompt = ChatPromptTemplate.from_template(template)
-    chain = prompt | model
-    
     try:
-        response = ""
-        for chunk in chain.stream({"comment": comment}):
-            response += chunk.content
-        
-        # Limpiar la respuesta
-        formalized = response.strip()
-        
-        # Quitar comillas si las hay
-        if formalized.startswith('"') and formalized.endswith('"'):
-            formalized = formalized[1:-1]
-        elif formalized.startswith("'") and formalized.endswith("'"):
-            formalized = formalized[1:-1]
-        
-        # Quitar cualquier comilla doble o simple sobrante
-        formalized = formalized.replace('""', '').replace("''", '')
-        
-        # Si la respuesta está vacía o muy corta, usar una versión genérica
-        if len(formalized) < 10:
-            formalized = "Comentario convertido a lenguaje apropiado por contener contenido ofensivo."
-        
-        return formalized
+        response = get_prompt_registry().run("formalizar_comentario", {"comment": comment}, endpoint="streamlit")
+        return clean_formalized(response)
         
     except Exception as e:
         st.error(f"Error formalizando comentario: {str(e)}")
         return "Comentario modificado por contener contenido inapropiado."
 
-def save_to_json(data, filename="comentarios_analizados.json"):
-    """Guardar datos en archivo JSON"""
+@st.cache_resource
+def get_history_store():
+    """Historial segmentado compartido con la API"""
+    return SegmentedHistory(os.path.join(DEFAULT_HISTORY_DIR, "comentarios"), legacy_file=COMMENTS_HISTORY_FILE)
+
+@st.cache_resource
+def get_trending_tags():
+    """Tags en tendencia compartidos entre sesiones; se alimentan de los registros nuevos del historial"""
+    return TrendingTags().sync(get_history_store())
+
+def invalidate_history_cache():
+    """Descartar las lecturas del historial en caché después de escribir"""
+    load_analysis_history.clear()
+    load_statistics.clear()
+    load_recent_history.clear()
+
+def save_analysis(data):
+    """Guardar el análisis en el historial (el id se asigna al escribir)"""
     try:
-        # Cargar datos existentes si el archivo existe
-        if os.path.exists(filename):
-            with open(filename, "r", encoding="utf-8") as file:
-                existing_data = json.load(file)
-        else:
-            existing_data = []
-        
-        # Agregar nuevo análisis
-        existing_data.append(data)
-        
-        # Guardar datos actualizados
-        with open(filename, "w", encoding="utf-8") as file:
-            json.dump(existing_data, file, ensure_ascii=False, indent=2)
-        
+        get_history_store().append_many([data], assign_ids=True)
+        invalidate_history_cache()
         return True
     except Exception as e:
-        st.error(f"Error guardando en JSON: {str(e)}")
+        st.error(f"Error guardando el análisis: {str(e)}")
         return False
 
-def load_analysis_history():
-    """Cargar historial de análisis desde JSON"""
+@st.cache_data(ttl=HISTORY_CACHE_TTL, show_spinner=False)
+def load_analysis_history(days=None):
+    """Cargar el historial de los últimos `days` días (todo si es None); solo lee los segmentos del rango"""
     try:
-        if os.path.exists("comentarios_analizados.json"):
-            with open("comentarios_analizados.json", "r", encoding="utf-8") as file:
-                return json.load(file)
-        return []
+        desde = (datetime.now() - timedelta(days=days)).isoformat() if days else None
+        return get_history_store().read_range(desde)
     except Exception as e:
         st.error(f"Error cargando historial: {str(e)}")
         return []
 
-def display_statistics(history):
-    """Mostrar estadísticas del análisis"""
-    if not history:
-        return
+@st.cache_data(ttl=HISTORY_CACHE_TTL, show_spinner=False)
+def load_statistics(days=None):
+    """Conteos por categoría y tags más comunes del periodo"""
+    history = load_analysis_history(days)
     
     # Contar categorías
-    categories = [item["categoria"] for item in history]
-    category_counts = {
-        "Sugerencia": categories.count("Sugerencia"),
-        "Opinion": categories.count("Opinion"),
-        "HateSpeech": categories.count("HateSpeech"),
-        "Vida universitaria": categories.count("Vida universitaria")
+    # Los registros antiguos con "HateSpeech" cuentan como "Queja"
+    categories = Counter(normalize_category(item["categoria"]) for item in history)
+    tag_counts = Counter(tag for item in history for tag in item.get("tags", []))
+    return {
+        "total": len(history),
+        "categorias": {category: categories[category]
+                       for category in ("Sugerencia", "Opinion", "Queja", "Vida universitaria")},
+        "tags_mas_comunes": tag_counts.most_common(10)
     }
+
+@st.cache_data(ttl=HISTORY_CACHE_TTL, show_spinner=False)
+def load_recent_history(count=5):
+    """Últimos análisis (solo se leen los segmentos más nuevos)"""
+    return get_history_store().tail(count)
+
+def display_statistics(statistics):
+    """Mostrar estadísticas del análisis"""
+    if not statistics["total"]:
+        return
+    
+    category_counts = statistics["categorias"]
     
     # Mostrar estadísticas
     col1, col2, col3, col4 = st.columns(4)
@@ -344,61 +156,85 @@ def display_statistics(history):
     with col2:
         st.metric("Opiniones", category_counts["Opinion"])
     with col3:
-        st.metric("Hate Speech", category_counts["HateSpeech"])
+        st.metric("Quejas", category_counts["Queja"])
     with col4:
         st.metric("Vida Universitaria", category_counts["Vida universitaria"])
     
     # Tags más comunes
-    all_tags = []
-    for item in history:
-        all_tags.extend(item["tags"])
-    
-    if all_tags:
-        from collections import Counter
-        tag_counts = Counter(all_tags)
+    if statistics["tags_mas_comunes"]:
         st.subheader("Tags más comunes:")
-        for tag, count in tag_counts.most_common(10):
+        for tag, count in statistics["tags_mas_comunes"]:
             st.write(f"• {tag}: {count} veces")
 
-def main():
-    st.title("🎓 Analizador de Comentarios Universitarios")
-    st.markdown("### Detecta automáticamente si un comentario es una Sugerencia, Opinión, Hate Speech o sobre Vida Universitaria")
+@st.fragment
+def sidebar_statistics():
+    """Estadísticas, descargas y limpieza del historial; cambiar el periodo solo re-ejecuta este panel"""
+    st.header("📊 Configuración")
     
-    # Cargar tags disponibles
-    available_tags = load_tags()
-    if not available_tags:
-        st.warning("No se pudieron cargar los tags. El análisis continuará sin detección de tags.")
+    # Mostrar estadísticas del periodo seleccionado
+    periodo = st.selectbox("Periodo", list(HISTORY_PERIODS), index=len(HISTORY_PERIODS) - 1)
+    statistics = load_statistics(HISTORY_PERIODS[periodo])
+    st.subheader(f"Análisis realizados: {statistics['total']}")
     
-    # Sidebar para configuración
-    with st.sidebar:
-        st.header("📊 Configuración")
-        
-        # Mostrar estadísticas
-        history = load_analysis_history()
-        st.subheader(f"Análisis realizados: {len(history)}")
-        
+    display_statistics(statistics)
+    
+    # Opción para descargar historial
+    if st.button("📥 Descargar Historial JSON"):
+        history = load_analysis_history(HISTORY_PERIODS[periodo])
         if history:
-            display_statistics(history)
-        
-        # Opción para descargar historial
-        if st.button("📥 Descargar Historial JSON"):
-            if history:
-                json_str = json.dumps(history, ensure_ascii=False, indent=2)
-                st.download_button(
-                    label="Descargar comentarios_analizados.json",
-                    data=json_str,
-                    file_name="comentarios_analizados.json",
-                    mime="application/json"
-                )
-        
-        # Opción para limpiar historial
-        if st.button("🗑️ Limpiar Historial"):
-            if os.path.exists("comentarios_analizados.json"):
-                os.remove("comentarios_analizados.json")
-                st.success("Historial limpiado")
-                st.rerun()
+            json_str = json.dumps(history, ensure_ascii=False, indent=2)
+            st.download_button(
+                label="Descargar comentarios_analizados.json",
+                data=json_str,
+                file_name="comentarios_analizados.json",
+                mime="application/json"
+            )
+    
+    # Consumo de tokens y latencia por prompt
+    with st.expander("💰 Consumo de tokens por prompt"):
+        st.json(get_prompt_registry().accounting.snapshot()["por_prompt"])
+    
+    # Opción para limpiar historial
+    if st.button("🗑️ Limpiar Historial"):
+        get_history_store().clear()
+        invalidate_history_cache()
+        st.success("Historial limpiado")
+        st.rerun()
+
+def display_analysis_result(analysis_data):
+    """Mostrar el resultado del último análisis guardado"""
+    st.divider()
+    st.subheader("📋 Resultados del Análisis:")
+    
+    # Mostrar categoría con color
+    category_colors = {
+        "Sugerencia": "🟢",
+        "Opinion": "🔵", 
+        "Queja": "🔴",
+        "Vida universitaria": "🟡"
+    }
+    
+    final_category = analysis_data["categoria"]
+    st.markdown(f"**Categoría:** {category_colors.get(final_category, '⚪')} **{final_category}**")
+    
+    # Mostrar tags
+    if analysis_data["tags"]:
+        st.markdown(f"**Tags encontrados:** {', '.join(analysis_data['tags'])}")
+    else:
+        st.markdown("**Tags encontrados:** Ninguno")
+    
+    # Mostrar JSON generado
+    with st.expander("Ver JSON generado"):
+        st.json(analysis_data)
+
+@st.fragment
+def analysis_form():
+    """Formulario de análisis; escribir y analizar solo re-ejecuta este fragmento"""
+    # Tomar el índice de tags vigente una sola vez por ejecución
+    tag_index = get_tag_vocabulary().current()
+    if not tag_index:
+        st.warning("No se pudieron cargar los tags. El análisis continuará sin detección de tags.")
     
-    # Input principal
     st.subheader("💬 Ingresa un comentario para analizar:")
     
     # Inicializar session state para el comentario y el estado de formalización
@@ -435,83 +271,265 @@ def main():
     with col1:
         analyze_button = st.button("🔍 Analizar Comentario", type="primary")
     
+    if analyze_button:
+        st.session_state.last_analysis = None
+    
     if analyze_button and comment_input.strip():
         # Validar que el texto sea coherente
         if not is_coherent_text(comment_input):
             st.error("⚠️ Se tiene que escribir algo coherente")
         else:
             with st.spinner("Analizando comentario..."):
-                # 1. Categorizar comentario original
-                original_category = categorize_comment(comment_input)
+                # 1. Categorizar comentario original (los largos se procesan por fragmentos en paralelo)
+                formalized_comment = None
+                if len(comment_input) > LONG_TEXT_THRESHOLD:
+                    original_category, formalized_comment = classify_long_comment(
+                        comment_input, categorize_comment, formalize_hate_speech,
+                        get_llm_executor().submit, LONG_TEXT_CHUNK_CHARS
+                    )
+                else:
+                    original_category = categorize_comment(comment_input)
                 
-                # 2. Si es HateSpeech y NO ha sido formalizado aún, formalizarlo
-                if original_category == "HateSpeech" and not st.session_state.is_formalized_comment:
-                    final_comment = formalize_hate_speech(comment_input)
+                # 2. Si es Queja y NO ha sido formalizado aún, formalizarlo
+                if original_category == "Queja" and not st.session_state.is_formalized_comment:
+                    final_comment = formalized_comment or formalize_hate_speech(comment_input)
                     # Actualizar el texto en el session state para que se refleje en el input
                     st.session_state.comment_text = final_comment
+                    st.session_state.original_comment = comment_input
                     st.session_state.show_formalized_message = True
                     st.session_state.is_formalized_comment = True
-                    st.rerun()  # Recargar para mostrar el texto actualizado
+                    st.rerun(scope="fragment")  # Recargar el formulario para mostrar el texto actualizado
                 
-                # 3. Si llegamos aquí, procesar normalmente (incluso si es HateSpeech formalizado)
-                final_comment = comment_input
+                # 3. Si llegamos aquí, procesar normalmente (incluso si es una Queja formalizada)
+                original_comment = comment_input
+                formalized = None
                 final_category = original_category
                 
-                # Si es un comentario que fue formalizado, mantener la categoría como HateSpeech
+                # Si es un comentario que fue formalizado, mantener la categoría como Queja
                 if st.session_state.is_formalized_comment and st.session_state.show_formalized_message:
-                    final_category = "HateSpeech"
+                    final_category = "Queja"
+                    original_comment = st.session_state.get("original_comment") or comment_input
+                    formalized = comment_input
                     st.session_state.is_formalized_comment = False  # Reset para la próxima vez
             
             # 4. Extraer tags del comentario final
-            extracted_tags = extract_tags_from_text(final_comment, available_tags)
+            extracted_tags = tag_index.extract(formalized or original_comment)
             
-            # 5. Crear estructura de datos
+            # 5. Crear estructura de datos (el mismo esquema de la API y de la carga masiva)
             analysis_data = {
                 "timestamp": datetime.now().isoformat(),
-                "comentario": final_comment,
+                "comentario_original": original_comment,
+                "comentario_formalizado": formalized,  # Solo si es Queja
                 "categoria": final_category,
-                "tags": extracted_tags
+                "tags": extracted_tags,
+                "tags_version": tag_index.version,
+                "is_coherent": True,
+                **get_prompt_registry().provenance(COMMENT_PROMPTS)
             }
             
-            # 6. Guardar en JSON
-            if save_to_json(analysis_data):
-                st.success("✅ Análisis guardado exitosamente")
-            
-            # 7. Mostrar resultados
-            st.divider()
-            st.subheader("📋 Resultados del Análisis:")
-            
-            # Mostrar categoría con color
-            category_colors = {
-                "Sugerencia": "🟢",
-                "Opinion": "🔵", 
-                "HateSpeech": "🔴",
-                "Vida universitaria": "🟡"
-            }
-            
-            st.markdown(f"**Categoría:** {category_colors.get(final_category, '⚪')} **{final_category}**")
-            
-            # Mostrar tags
-            if extracted_tags:
-                st.markdown(f"**Tags encontrados:** {', '.join(extracted_tags)}")
-            else:
-                st.markdown("**Tags encontrados:** Ninguno")
-            
-            # Mostrar JSON generado
-            with st.expander("Ver JSON generado"):
-                st.json(analysis_data)
+            # 6. Guardar en el historial y refrescar estadísticas e historial con un rerun completo
+            if save_analysis(analysis_data):
+                st.session_state.last_analysis = analysis_data
+                st.rerun()
     
     elif analyze_button:
         st.warning("⚠️ Se tiene que escribir algo coherente")
     
-    # Mostrar historial reciente
-    if history:
+    # 7. Mostrar resultados del último análisis guardado
+    if st.session_state.get("last_analysis"):
+        st.success("✅ Análisis guardado exitosamente")
+        display_analysis_result(st.session_state.last_analysis)
+
+def run_inline(func, *args):
+    """Ejecutar en el hilo actual y devolver un Future ya resuelto (mismo contrato que `executor.submit`)"""
+    future = Future()
+    try:
+        future.set_result(func(*args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+def classify_bulk_comment(registry, text):
+    """Categorizar (y formalizar si es Queja) un comentario de la carga masiva; corre en hilos del pool"""
+    def categorize(chunk):
+        return parse_category(registry.run("categorizar_comentario", {"comment": chunk}, endpoint="streamlit_lote"))
+
+    def formalize(chunk):
+        return clean_formalized(registry.run("formalizar_comentario", {"comment": chunk}, endpoint="streamlit_lote"))
+
+    if len(text) > LONG_TEXT_THRESHOLD:
+        # Los fragmentos corren en el mismo hilo del pool de la carga: el paralelismo ya está entre filas
+        # y así las llamadas en vuelo no pasan de la concurrencia elegida
+        return classify_long_comment(text, categorize, formalize, run_inline, LONG_TEXT_CHUNK_CHARS)
+    categoria = categorize(text)
+    return categoria, formalize(text) if categoria == "Queja" else None
+
+def export_bulk_results(results, as_csv):
+    """Serializar los resultados de la carga masiva en el mismo formato del archivo subido"""
+    if not as_csv:
+        return "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in results)
+    output = io.StringIO()
+    fields = ["posicion", "id", "comentario_original", "is_coherent", "categoria", "comentario_formalizado", "tags"]
+    writer = csv.DictWriter(output, fieldnames=fields, extrasaction="ignore")
+    writer.writeheader()
+    for row in results:
+        writer.writerow({**row, "tags": "; ".join(row["tags"])})
+    return output.getvalue()
+
+def process_bulk_upload(uploaded_file, text_field, concurrency):
+    """Coherencia y tags para todas las filas, categorización en un pool acotado y una sola escritura"""
+    tag_index = get_tag_vocabulary().current()
+    registry = get_prompt_registry()
+    is_csv = uploaded_file.name.lower().endswith(".csv")
+    file = io.StringIO(uploaded_file.getvalue().decode("utf-8-sig"), newline="")
+    rows = [row for row in iter_records(file, is_csv, text_field or None) if row[1]]
+    
+    # Etapa local (sin LLM) para todas las filas; los tags se extraen en lote
+    coherent = validator.validate_many([text for _, text, _ in rows])
+    tags = iter(tag_index.extract_many([text for (_, text, _), is_coherent in zip(rows, coherent) if is_coherent]))
+    results = [{
+        "posicion": position,
+        "timestamp": timestamp or datetime.now().isoformat(),
+        "comentario_original": text,
+        "comentario_formalizado": None,
+        "categoria": None,
+        "tags": next(tags) if is_coherent else [],
+        "tags_version": tag_index.version,
+        "is_coherent": is_coherent,
+        "prompt_version": None,
+        "modelo": None,
+    } for (position, text, timestamp), is_coherent in zip(rows, coherent)]
+    
+    pending = [row for row in results if row["is_coherent"]]
+    progress = st.progress(0.0, text=f"0/{len(pending)} comentarios categorizados")
+    errors = 0
+    start = time.perf_counter()
+    
+    # Pool acotado: a lo sumo `concurrency` llamadas al LLM en vuelo, incluidos los fragmentos de los largos
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="lote") as executor:
+        futures = {executor.submit(classify_bulk_comment, registry, row["comentario_original"]): row
+                   for row in pending}
+        for done, future in enumerate(as_completed(futures), start=1):
+            row = futures[future]
+            try:
+                row["categoria"], row["comentario_formalizado"] = future.result()
+                row.update(registry.provenance(COMMENT_PROMPTS))
+            except Exception:
+                # Sin procedencia: el reetiquetado lo reprocesa
+                row["categoria"] = DEFAULT_CATEGORY
+                errors += 1
+            elapsed = time.perf_counter() - start
+            progress.progress(done / len(pending),
+                              text=f"{done}/{len(pending)} comentarios categorizados "
+                                   f"({done / elapsed:.1f} comentarios/s)")
+    
+    # Una sola escritura para todo el lote; los ids se asignan al escribir
+    source = uploaded_file.name
+    records = [{**{key: value for key, value in row.items() if key != "posicion"},
+                "origen": {"archivo": source, "posicion": row["posicion"]}} for row in pending]
+    if records:
+        get_history_store().append_many(records, assign_ids=True)
+        invalidate_history_cache()
+        for row, record in zip(pending, records):
+            row["id"] = record["id"]
+    
+    return {
+        "archivo": source,
+        "csv": is_csv,
+        "resultados": results,
+        "errores": errors,
+        "duracion_s": round(time.perf_counter() - start, 2),
+    }
+
+@st.fragment
+def bulk_upload():
+    """Carga masiva de comentarios desde un archivo CSV o JSONL"""
+    st.subheader("📂 Analizar un archivo de comentarios")
+    
+    uploaded_file = st.file_uploader("Archivo CSV o JSONL", type=["csv", "jsonl"])
+    col1, col2 = st.columns(2)
+    with col1:
+        text_field = st.text_input("Columna del comentario", placeholder="Se detecta automáticamente")
+    with col2:
+        concurrency = st.slider("Llamadas simultáneas al LLM", min_value=1, max_value=16, value=8)
+    
+    if uploaded_file and st.button("⚙️ Procesar archivo", type="primary"):
+        try:
+            st.session_state.bulk_results = process_bulk_upload(uploaded_file, text_field.strip(), concurrency)
+        except (ValueError, UnicodeDecodeError) as e:
+            st.error(f"No se pudo leer el archivo: {str(e)}")
+    
+    summary = st.session_state.get("bulk_results")
+    if not summary:
+        return
+    
+    results = summary["resultados"]
+    coherent = [row for row in results if row["is_coherent"]]
+    st.success(f"✅ {len(coherent)} análisis guardados desde {summary['archivo']} en {summary['duracion_s']} s")
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Filas", len(results))
+    with col2:
+        st.metric("Incoherentes", len(results) - len(coherent))
+    with col3:
+        st.metric("Errores del LLM", summary["errores"])
+    
+    st.bar_chart({"cantidad": Counter(row["categoria"] for row in coherent)})
+    
+    extension = "csv" if summary["csv"] else "jsonl"
+    st.download_button(
+        label=f"📥 Descargar resultados ({extension.upper()})",
+        data=export_bulk_results(results, summary["csv"]),
+        file_name=f"{os.path.splitext(summary['archivo'])[0]}_analizado.{extension}",
+        mime="text/csv" if summary["csv"] else "application/jsonl"
+    )
+
+@st.fragment
+def trending_panel():
+    """Tags en tendencia del periodo reciente frente al resto de la semana"""
+    st.subheader("📈 Tags en tendencia")
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        horas = st.selectbox("Periodo reciente", [6, 24, 72], index=1, format_func=lambda h: f"Últimas {h} horas")
+    with col2:
+        categoria = st.selectbox("Categoría", ["Todas", "Sugerencia", "Opinion", "Queja", "Vida universitaria"])
+    
+    # Solo se leen los registros nuevos desde la última consulta
+    trending_tags = get_trending_tags().sync(get_history_store())
+    categoria = None if categoria == "Todas" else categoria
+    
+    tendencias = trending_tags.trending(horas, categoria)
+    if tendencias:
+        st.dataframe(
+            [{"Tag": row["tag"], "Reciente": row["reciente"], "Esperado": row["esperado"], "Puntaje": row["puntaje"]}
+             for row in tendencias],
+            hide_index=True
+        )
+    else:
+        st.info("No hay tags con un aumento notable en este periodo.")
+    
+    mas_comunes = trending_tags.top(category=categoria)
+    if mas_comunes:
+        st.markdown("**Más comunes de la semana:** " +
+                    ", ".join(f"{row['tag']} ({row['conteo']})" for row in mas_comunes))
+
+@st.fragment
+def recent_history_panel():
+    """Historial reciente; se refresca al guardar un análisis o con su propio botón"""
+    recent_history = load_recent_history(5)
+    if recent_history:
         st.divider()
         st.subheader("📚 Historial Reciente (últimos 5 análisis)")
+        if st.button("🔄 Actualizar historial"):
+            load_recent_history.clear()
+            st.rerun(scope="fragment")
         
-        for item in reversed(history[-5:]):  # Mostrar los últimos 5
-            # Manejar tanto estructura antigua como nueva
-            comentario_display = item.get('comentario', item.get('comentario_final', 'Sin comentario'))
+        for item in reversed(recent_history):  # Mostrar los últimos 5
+            # Manejar tanto estructura antigua como nueva (analizador y API)
+            comentario_display = (item.get('comentario') or item.get('comentario_final')
+                                  or item.get('comentario_original') or 'Sin comentario')
             comentario_preview = comentario_display[:50] + "..." if len(comentario_display) > 50 else comentario_display
             
             with st.expander(f"{item['categoria']} - {comentario_preview}"):
@@ -519,10 +537,30 @@ def main():
                 st.write(f"**Categoría:** {item['categoria']}")
                 st.write(f"**Tags:** {', '.join(item['tags']) if item['tags'] else 'Ninguno'}")
                 st.write(f"**Fecha:** {item['timestamp']}")
-                
-                st.write(f"**Categoría:** {item['categoria']}")
-                st.write(f"**Tags:** {', '.join(item['tags']) if item['tags'] else 'Ninguno'}")
-                st.write(f"**Fecha:** {item['timestamp']}")
+
+def main():
+    st.title("🎓 Analizador de Comentarios Universitarios")
+    st.markdown("### Detecta automáticamente si un comentario es una Sugerencia, Opinión, Queja o sobre Vida Universitaria")
+    
+    try:
+        get_model()
+    except MissingAPIKey as e:
+        st.error(str(e))
+        st.stop()
+    
+    # Sidebar para configuración
+    with st.sidebar:
+        sidebar_statistics()
+    
+    # Cada panel es un fragmento: una interacción solo re-ejecuta su propio panel
+    tab_single, tab_bulk, tab_trending = st.tabs(["💬 Comentario", "📂 Carga masiva", "📈 Tendencias"])
+    with tab_single:
+        analysis_form()
+    with tab_bulk:
+        bulk_upload()
+    with tab_trending:
+        trending_panel()
+    recent_history_panel()
 
 if __name__ == "__main__":
     main()
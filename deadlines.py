@@ -0,0 +1,99 @@
+import os
+import time
+import threading
+import contextvars
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from flask import request
+
+# Plazo por solicitud en milisegundos (0 = sin plazo); el cliente puede pedir uno menor con X-Deadline-Ms
+REQUEST_DEADLINE_MS = int(os.getenv("REQUEST_DEADLINE_MS", "10000"))
+DEADLINE_HEADER = "X-Deadline-Ms"
+# Al agotarse el plazo, terminar el análisis con el LLM en segundo plano y actualizar el registro
+COMPLETE_IN_BACKGROUND = os.getenv("DEADLINE_COMPLETE_IN_BACKGROUND", "1") == "1"
+# Plazo de las tareas que terminan en segundo plano; es el timeout de sus llamadas al LLM, así
+# una llamada atascada termina y libera el hilo en lugar de retener el pool indefinidamente
+BACKGROUND_DEADLINE_MS = int(os.getenv("DEADLINE_BACKGROUND_MS", "120000"))
+# Máximo de tareas que pueden seguir en segundo plano a la vez (cada una retiene su tenant y un
+# lugar en el pool); pasado el límite, la tarea termina con el plazo de la solicitud
+BACKGROUND_MAX = int(os.getenv("DEADLINE_BACKGROUND_MAX", "64"))
+_background_slots = threading.BoundedSemaphore(max(1, BACKGROUND_MAX))
+
+# Instante (time.monotonic) en que vence la solicitud actual; None = sin plazo
+current_deadline = contextvars.ContextVar("current_deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """Se agotó el plazo de la solicitud antes de terminar una llamada al LLM"""
+
+
+def set_deadline(milliseconds):
+    current_deadline.set(time.monotonic() + milliseconds / 1000 if milliseconds > 0 else None)
+
+
+def remaining():
+    """Segundos que le quedan a la solicitud actual (None si no tiene plazo)"""
+    deadline = current_deadline.get()
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic())
+
+
+def check_deadline():
+    if remaining() == 0:
+        raise DeadlineExceeded("Se agotó el plazo de la solicitud")
+
+
+def run_within_deadline(executor, func, *args, complete_in_background=COMPLETE_IN_BACKGROUND):
+    """Ejecutar `func` respetando el plazo de la solicitud.
+
+    Devuelve (resultado, None) si termina a tiempo o (None, future) si se agota el plazo.
+    Con `complete_in_background` la tarea sigue con el plazo de segundo plano y el future
+    permite actualizar el registro después (`completes_in_background`); si no, o si ya hay
+    BACKGROUND_MAX tareas que pueden seguir en segundo plano, termina con DeadlineExceeded al
+    vencer el plazo de la solicitud. En ambos casos el plazo es el timeout HTTP de cada llamada
+    al LLM (PromptRegistry.stream), así que la tarea no retiene los hilos más allá de él."""
+    budget = remaining()
+    if budget is None:
+        return func(*args), None
+
+    context = contextvars.copy_context()
+    in_background = complete_in_background and _background_slots.acquire(blocking=False)
+    if in_background:
+        context.run(set_deadline, BACKGROUND_DEADLINE_MS)
+    future = executor.submit(context.run, func, *args)
+    future.in_background = in_background
+    if in_background:
+        future.add_done_callback(lambda finished: _background_slots.release())
+    try:
+        return future.result(timeout=budget), None
+    except (FutureTimeoutError, DeadlineExceeded):
+        if not in_background:
+            # Si todavía no empezó, no ocupa el pool para un resultado que nadie espera
+            future.cancel()
+        return None, future
+
+
+def completes_in_background(pending):
+    """Si la tarea que agotó el plazo sigue en segundo plano (su resultado llegará en el future)"""
+    return pending is not None and getattr(pending, "in_background", False)
+
+
+def init_app(app):
+    """Asignar el plazo de cada solicitud desde el encabezado o la configuración"""
+
+    def assign_deadline():
+        milliseconds = REQUEST_DEADLINE_MS
+        header = request.headers.get(DEADLINE_HEADER)
+        if header:
+            try:
+                # El cliente puede acortar el plazo, no quitarlo ni pasar del configurado
+                milliseconds = max(1, int(header))
+                if REQUEST_DEADLINE_MS > 0:
+                    milliseconds = min(milliseconds, REQUEST_DEADLINE_MS)
+            except ValueError:
+                pass
+        set_deadline(milliseconds)
+
+    app.before_request(assign_deadline)
+    return app
@@ -0,0 +1,394 @@
+"""Evaluar sin conexión variantes del pipeline de clasificación: calidad, llamadas al LLM y latencia.
+
+Reproduce un historial etiquetado (el historial segmentado, el JSON anterior, o un archivo
+JSON/JSONL/CSV) a través de variantes del pipeline formadas por etapas que se prueban en
+orden hasta que una decide:
+
+    riesgo>=T   Queja (u OFENSIVO en títulos) si el puntaje ofensivo local es al menos T
+    riesgo<T    APROPIADO si el puntaje ofensivo local es menor que T (solo títulos)
+    palabras    categoría por palabras clave si alguna coincide (solo comentarios)
+    cache[:N]   respuesta anterior del LLM para el mismo texto (LRU de N entradas; sin N, ilimitada)
+    llm         categorize_comment / detect_offensive_title (etapa final)
+    local       categoría o detección local, como en las respuestas degradadas (etapa final)
+
+Por ejemplo `riesgo>=0.9+palabras+cache+llm`. Para cada variante se reporta precisión y
+recall por categoría, exactitud, tasa de llamadas al LLM y latencia p50/p99 simulada.
+La referencia es por defecto la respuesta que el LLM dio en su momento (`categoria` o
+`es_ofensivo`), así que se mide cuánto se aleja cada variante de usar siempre el LLM; con
+`--etiqueta` se compara contra otra columna (p. ej. una revisión manual).
+
+Con `--llm grabado` (por defecto) la etapa `llm` devuelve la respuesta guardada y su
+latencia se simula con una distribución lognormal (`--llm-p50`, `--llm-p99`); con
+`--llm vivo` se llama al modelo de pipeline.py una vez por texto y se usa la latencia medida.
+Las etapas locales y la caché se miden al ejecutarse. Solo se cuenta la llamada de
+clasificación: la formalización de quejas y la corrección de títulos no cambian entre variantes.
+
+Uso:
+    python evaluate.py
+    python evaluate.py --tipo titulos --barrido 0.3,0.5,0.7,0.9
+    python evaluate.py etiquetados.csv --etiqueta etiqueta_manual --variante "riesgo>=0.9+cache+llm"
+    python evaluate.py --llm vivo --limite 200 --json evaluacion.json
+"""
+import os
+import re
+import sys
+import csv
+import json
+import math
+import time
+import random
+import argparse
+from collections import OrderedDict, namedtuple
+
+from backfill import TEXT_FIELDS, TIMESTAMP_FIELDS, pick_field
+from coherence import validator
+from heuristics import OFFENSIVE_THRESHOLD, keyword_category, offensive_risk_score
+from history_store import (COMMENTS_HISTORY_FILE, DEFAULT_HISTORY_DIR, TITLES_HISTORY_FILE, SegmentedHistory,
+                           load_analysis_history, normalize_category)
+from prompts import TITLE_LABELS, VALID_CATEGORIES, current_endpoint
+
+# labels: etiquetas posibles; positive: la que decide `riesgo>=T`; prediction: campo con la respuesta del LLM;
+# llm: función de pipeline.py que clasifica; legacy_file: historial JSON anterior al historial segmentado
+Kind = namedtuple("Kind", ["labels", "positive", "text_fields", "prediction", "llm", "legacy_file"])
+
+KINDS = {
+    "comentarios": Kind(VALID_CATEGORIES, "Queja", TEXT_FIELDS, "categoria", "categorize_comment",
+                        COMMENTS_HISTORY_FILE),
+    "titulos": Kind(TITLE_LABELS, "OFENSIVO", ("titulo_original", "titulo", "title"), "es_ofensivo",
+                    "detect_offensive_title", TITLES_HISTORY_FILE),
+}
+
+DEFAULT_VARIANTS = {
+    "comentarios": ["llm", "cache+llm", "riesgo>=0.9+llm", "riesgo>=0.5+llm", "riesgo>=0.9+palabras+cache+llm",
+                    "local"],
+    "titulos": ["llm", "cache+llm", "riesgo>=0.9+llm", "riesgo>=0.9+riesgo<0.3+llm", "riesgo>=0.5+riesgo<0.5+llm",
+                "local"],
+}
+
+# "nombre=etapas" (las etapas también llevan "=" en "riesgo>=T", pero no en un nombre)
+NAMED_VARIANT_RE = re.compile(r"^([\w-]+)=(.+)$")
+
+# z de la normal estándar para el percentil 99 (ajuste de la lognormal de latencias)
+Z_P99 = 2.3263
+
+Example = namedtuple("Example", ["position", "text", "label", "recorded", "overhead_ms"])
+
+
+def to_label(value, kind):
+    """Etiqueta comparable: categoría actual en comentarios, OFENSIVO/APROPIADO en títulos"""
+    if value is None or value == "":
+        return None
+    if kind.prediction == "es_ofensivo":
+        if isinstance(value, str):
+            value = value.strip().lower() in ("true", "1", "si", "sí", "ofensivo")
+        return "OFENSIVO" if value else "APROPIADO"
+    return normalize_category(str(value).strip())
+
+
+def read_labeled(path):
+    """Registros de un archivo JSON (lista), JSONL o CSV"""
+    with open(path, "r", encoding="utf-8", newline="") as file:
+        if path.lower().endswith(".csv"):
+            return list(csv.DictReader(file))
+        if path.lower().endswith(".json"):
+            return json.load(file)
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def load_records(args, kind):
+    if args.archivo:
+        return read_labeled(args.archivo)
+    directory = os.path.join(DEFAULT_HISTORY_DIR, args.tipo)
+    if os.path.exists(os.path.join(directory, "manifest.json")):
+        return SegmentedHistory(directory).read_range(args.desde, args.hasta)
+    return load_analysis_history(kind.legacy_file)
+
+
+def prepare_examples(records, kind, label_field, limit=None):
+    """Ejemplos evaluables en orden de llegada; los que el pipeline no enviaría al LLM se descartan"""
+    records = sorted(records, key=lambda record: str(pick_field(record, TIMESTAMP_FIELDS) or ""))
+    examples = []
+    skipped = {"sin_texto": 0, "sin_etiqueta": 0, "sin_respuesta_llm": 0, "incoherentes": 0}
+    for record in records:
+        text = (pick_field(record, kind.text_fields) or "").strip()
+        if not text:
+            skipped["sin_texto"] += 1
+            continue
+        label = to_label(record.get(label_field), kind)
+        if label not in kind.labels:
+            skipped["sin_etiqueta"] += 1
+            continue
+        # Los títulos incoherentes no llegaron al LLM
+        if record.get("es_coherente") is False:
+            skipped["incoherentes"] += 1
+            continue
+        # Un resultado local (degradado o pendiente) no es una respuesta del LLM
+        usable = not record.get("degraded") and not record.get("pendiente_llm")
+        recorded = to_label(record.get(kind.prediction), kind) if usable else None
+        if label_field == kind.prediction and recorded is None:
+            skipped["sin_respuesta_llm"] += 1
+            continue
+        start = time.perf_counter()
+        coherent = validator.validate(text)
+        overhead_ms = (time.perf_counter() - start) * 1000
+        if not coherent:
+            skipped["incoherentes"] += 1
+            continue
+        examples.append(Example(len(examples), text, label, recorded, overhead_ms))
+        if limit and len(examples) >= limit:
+            break
+    return examples, skipped
+
+
+class RecordedLLM:
+    """Respuesta guardada del LLM con latencia lognormal reproducible por ejemplo"""
+
+    def __init__(self, p50_ms, p99_ms, seed=0):
+        self.mu = math.log(p50_ms)
+        self.sigma = max(0.0, math.log(p99_ms / p50_ms)) / Z_P99
+        self.seed = seed
+
+    def __call__(self, example):
+        if example.recorded is None:
+            raise ValueError(f"El ejemplo {example.position} no tiene respuesta grabada del LLM")
+        rng = random.Random(self.seed * 1_000_003 + example.position)
+        return example.recorded, rng.lognormvariate(self.mu, self.sigma)
+
+
+class LiveLLM:
+    """Llamar al modelo de la API una vez por texto; todas las variantes comparten la respuesta y su latencia"""
+
+    def __init__(self, kind):
+        # Importación diferida: el modelo y los prompts son los mismos de la API
+        import pipeline
+        pipeline.get_prompt_registry()  # Sin GROQ_API_KEY falla aquí, antes de evaluar
+        self.classify = getattr(pipeline, kind.llm)
+        self.kind = kind
+        self.answers = {}
+
+    def __call__(self, example):
+        if example.position not in self.answers:
+            current_endpoint.set("evaluacion")
+            start = time.perf_counter()
+            answer = self.classify(example.text)
+            latency_ms = (time.perf_counter() - start) * 1000
+            self.answers[example.position] = (to_label(answer, self.kind), latency_ms)
+        return self.answers[example.position]
+
+
+def cache_key(text):
+    return " ".join(text.lower().split())
+
+
+class Variant:
+    """Etapas de una variante del pipeline; cada `run` empieza con la caché vacía"""
+
+    def __init__(self, name, spec, kind):
+        self.name = name
+        self.kind = kind
+        self.stages = []
+        for stage in spec.split("+"):
+            self.stages.append(self._parse_stage(stage.strip()))
+        if self.stages[-1][0] not in ("llm", "local"):
+            raise ValueError(f"La variante '{spec}' debe terminar en 'llm' o 'local'")
+        if any(name in ("llm", "local") for name, _ in self.stages[:-1]):
+            raise ValueError(f"En la variante '{spec}', 'llm' y 'local' solo pueden ser la última etapa")
+
+    def _parse_stage(self, stage):
+        if stage.startswith("riesgo>="):
+            return "riesgo>=", float(stage[len("riesgo>="):])
+        if stage.startswith("riesgo<"):
+            if self.kind.positive != "OFENSIVO":
+                raise ValueError("La etapa 'riesgo<T' solo aplica a títulos")
+            return "riesgo<", float(stage[len("riesgo<"):])
+        if stage == "palabras":
+            if self.kind.positive != "Queja":
+                raise ValueError("La etapa 'palabras' solo aplica a comentarios")
+            return "palabras", None
+        if stage == "cache" or stage.startswith("cache:"):
+            return "cache", int(stage[len("cache:"):]) if ":" in stage else None
+        if stage in ("llm", "local"):
+            return stage, None
+        raise ValueError(f"Etapa desconocida: {stage}")
+
+    def _local(self, text):
+        risk = offensive_risk_score(text)
+        if risk >= OFFENSIVE_THRESHOLD:
+            return self.kind.positive
+        if self.kind.positive == "OFENSIVO":
+            return "APROPIADO"
+        return keyword_category(text) or "Opinion"
+
+    def run(self, examples, llm):
+        """Clasificar cada ejemplo: produce (etiqueta, latencia_ms, etapa que decidió)"""
+        caches = [OrderedDict() for _ in self.stages]
+        results = []
+        for example in examples:
+            latency_ms = example.overhead_ms
+            for index, (stage, param) in enumerate(self.stages):
+                label = None
+                start = time.perf_counter()
+                if stage == "riesgo>=":
+                    label = self.kind.positive if offensive_risk_score(example.text) >= param else None
+                elif stage == "riesgo<":
+                    label = "APROPIADO" if offensive_risk_score(example.text) < param else None
+                elif stage == "palabras":
+                    label = keyword_category(example.text)
+                elif stage == "cache":
+                    label = caches[index].get(cache_key(example.text))
+                    if label is not None:
+                        caches[index].move_to_end(cache_key(example.text))
+                elif stage == "local":
+                    label = self._local(example.text)
+                latency_ms += (time.perf_counter() - start) * 1000
+                if stage == "llm":
+                    label, llm_ms = llm(example)
+                    latency_ms += llm_ms
+                    self._remember(caches, example.text, label)
+                if label is not None:
+                    results.append((label, latency_ms, stage))
+                    break
+        return results
+
+    def _remember(self, caches, text, label):
+        for (stage, size), cache in zip(self.stages, caches):
+            if stage != "cache":
+                continue
+            cache[cache_key(text)] = label
+            if size and len(cache) > size:
+                cache.popitem(last=False)
+
+
+def percentile(values, fraction):
+    """Percentil por rango más cercano"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def summarize(variant, examples, results):
+    per_label = {}
+    for label in variant.kind.labels:
+        predicted = sum(1 for result in results if result[0] == label)
+        actual = sum(1 for example in examples if example.label == label)
+        hits = sum(1 for example, result in zip(examples, results) if example.label == label == result[0])
+        precision = hits / predicted if predicted else None
+        recall = hits / actual if actual else None
+        f1 = (2 * precision * recall / (precision + recall)
+              if precision and recall else 0.0 if actual else None)
+        per_label[label] = {"precision": precision, "recall": recall, "f1": f1, "soporte": actual}
+    latencies = [result[1] for result in results]
+    f1_scores = [values["f1"] for values in per_label.values() if values["f1"] is not None]
+    return {
+        "variante": variant.name,
+        "ejemplos": len(examples),
+        "exactitud": sum(1 for example, result in zip(examples, results) if example.label == result[0]) / len(examples),
+        "f1_macro": sum(f1_scores) / len(f1_scores) if f1_scores else None,
+        "tasa_llm": sum(1 for result in results if result[2] == "llm") / len(examples),
+        "decididos_por": {stage: sum(1 for result in results if result[2] == stage)
+                          for stage in dict.fromkeys(stage for stage, _ in variant.stages)},
+        "latencia_p50_ms": round(percentile(latencies, 0.5), 3),
+        "latencia_p99_ms": round(percentile(latencies, 0.99), 3),
+        "latencia_media_ms": round(sum(latencies) / len(latencies), 3),
+        "por_etiqueta": per_label,
+    }
+
+
+def format_ratio(value):
+    return "-" if value is None else f"{value:.2f}"
+
+
+def print_report(summaries, labels):
+    width = max(len("variante"), *(len(summary["variante"]) for summary in summaries))
+    print(f"{'variante':<{width}} {'exactitud':>9} {'F1 macro':>9} {'LLM':>7} {'p50 ms':>9} {'p99 ms':>9}")
+    for summary in summaries:
+        print(f"{summary['variante']:<{width}} {summary['exactitud']:9.1%} {format_ratio(summary['f1_macro']):>9} "
+              f"{summary['tasa_llm']:7.1%} {summary['latencia_p50_ms']:9.1f} {summary['latencia_p99_ms']:9.1f}")
+    print()
+    print("Precisión/recall por etiqueta (soporte)")
+    header = " ".join(f"{label[:18]:>18}" for label in labels)
+    print(f"{'variante':<{width}} {header}")
+    supports = summaries[0]["por_etiqueta"]
+    print(f"{'':<{width}} " + " ".join(f"{'(' + str(supports[label]['soporte']) + ')':>18}" for label in labels))
+    for summary in summaries:
+        cells = (f"{format_ratio(values['precision'])}/{format_ratio(values['recall'])}"
+                 for values in (summary["por_etiqueta"][label] for label in labels))
+        print(f"{summary['variante']:<{width}} " + " ".join(f"{cell:>18}" for cell in cells))
+
+
+def build_variants(args, kind):
+    specs = list(args.variante or DEFAULT_VARIANTS[args.tipo])
+    if args.barrido:
+        specs += [f"riesgo>={threshold.strip()}+llm" for threshold in args.barrido.split(",") if threshold.strip()]
+    variants = []
+    for spec in dict.fromkeys(specs):
+        named = NAMED_VARIANT_RE.match(spec)
+        name, stages = named.groups() if named else (spec, spec)
+        variants.append(Variant(name, stages, kind))
+    return variants
+
+
+def run(args):
+    kind = KINDS[args.tipo]
+    try:
+        variants = build_variants(args, kind)
+    except ValueError as e:
+        print(f"Error: {str(e)}")
+        return 1
+
+    label_field = args.etiqueta or kind.prediction
+    examples, skipped = prepare_examples(load_records(args, kind), kind, label_field, args.limite)
+    if not examples:
+        print(f"Error: no hay ejemplos con la etiqueta '{label_field}' para evaluar")
+        return 1
+    omitted = ", ".join(f"{reason.replace('_', ' ')}: {count}" for reason, count in skipped.items() if count)
+    reference = "respuesta grabada del LLM" if label_field == kind.prediction else f"columna '{label_field}'"
+    print(f"{len(examples)} ejemplos de {args.tipo}; referencia: {reference}" + (f" (omitidos - {omitted})" if omitted else ""))
+
+    if args.llm == "vivo":
+        try:
+            llm = LiveLLM(kind)
+        except RuntimeError as e:
+            print(f"Error: {str(e)}")
+            return 1
+    else:
+        missing = sum(1 for example in examples if example.recorded is None)
+        if missing:
+            print(f"Error: {missing} ejemplos no tienen respuesta grabada del LLM; usa --llm vivo")
+            return 1
+        llm = RecordedLLM(args.llm_p50, args.llm_p99, args.semilla)
+        print(f"Latencia simulada del LLM: p50 {args.llm_p50:.0f} ms, p99 {args.llm_p99:.0f} ms")
+    print()
+
+    summaries = [summarize(variant, examples, variant.run(examples, llm)) for variant in variants]
+    print_report(summaries, kind.labels)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump({"tipo": args.tipo, "referencia": label_field, "llm": args.llm, "omitidos": skipped,
+                       "variantes": summaries}, file, ensure_ascii=False, indent=2)
+        print(f"\nResultados guardados en {args.json}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Comparar variantes del pipeline sobre un historial etiquetado")
+    parser.add_argument("archivo", nargs="?", help="Archivo JSON/JSONL/CSV etiquetado (por defecto, el historial)")
+    parser.add_argument("--tipo", choices=sorted(KINDS), default="comentarios", help="Comentarios o títulos")
+    parser.add_argument("--etiqueta", help="Columna de referencia (por defecto, la respuesta grabada del LLM)")
+    parser.add_argument("--variante", action="append",
+                        help="Etapas separadas por '+', opcionalmente 'nombre=etapas' (se puede repetir)")
+    parser.add_argument("--barrido", help="Umbrales de riesgo a comparar como 'riesgo>=T+llm', p. ej. 0.3,0.5,0.9")
+    parser.add_argument("--llm", choices=("grabado", "vivo"), default="grabado",
+                        help="Respuesta guardada con latencia simulada o llamada real al modelo")
+    parser.add_argument("--llm-p50", type=float, default=600.0, help="Mediana simulada de la llamada al LLM (ms)")
+    parser.add_argument("--llm-p99", type=float, default=2500.0, help="Percentil 99 simulado de la llamada al LLM (ms)")
+    parser.add_argument("--semilla", type=int, default=0, help="Semilla de la latencia simulada")
+    parser.add_argument("--desde", help="Solo análisis desde esta fecha (ISO, historial segmentado)")
+    parser.add_argument("--hasta", help="Solo análisis hasta esta fecha (ISO, historial segmentado)")
+    parser.add_argument("--limite", type=int, help="Máximo de ejemplos a evaluar")
+    parser.add_argument("--json", help="Guardar los resultados en este archivo")
+    return run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,205 @@
+import os
+import math
+import zlib
+from collections import Counter
+from functools import lru_cache
+
+try:
+    import numpy as np
+except ImportError:  # El nivel difuso es opcional: sin NumPy solo se usan coincidencias exactas
+    np = None
+
+from heuristics import strip_accents
+
+FUZZY_ENABLED = os.getenv("FUZZY_TAGS", "1") == "1"
+FUZZY_THRESHOLD = float(os.getenv("FUZZY_TAGS_THRESHOLD", "0.75"))
+
+# Vectores de n-gramas de caracteres (2 y 3) con hashing a una dimensión fija
+HASH_DIM = 4096
+NGRAM_SIZES = (2, 3)
+MIN_TOKEN_CHARS = 4
+MAX_PHRASE_WORDS = 3
+# Comentarios por multiplicación en `match_many`
+BATCH_TEXTS = 64
+# Términos (palabras y frases) cuyas coincidencias se recuerdan por índice; se vacía al llenarse
+TERM_CACHE_SIZE = 65536
+
+# Palabras frecuentes que no deben compararse solas contra los tags
+STOPWORDS = frozenset({
+    'para', 'pero', 'como', 'esta', 'este', 'esto', 'estas', 'estos', 'todo', 'todos', 'toda', 'todas',
+    'muy', 'mas', 'menos', 'porque', 'cuando', 'donde', 'tiene', 'tienen', 'hace', 'hacen', 'hay', 'son',
+    'sobre', 'entre', 'desde', 'hasta', 'tambien', 'siempre', 'nunca', 'nada', 'algo', 'mucho', 'mucha',
+    'muchos', 'muchas', 'poco', 'pocos', 'otro', 'otra', 'otros', 'otras', 'ellos', 'ellas', 'nosotros',
+    'ustedes', 'deberian', 'deberia', 'puede', 'pueden', 'bien', 'solo', 'cada', 'mismo', 'misma',
+})
+
+
+def available():
+    return np is not None and FUZZY_ENABLED
+
+
+@lru_cache(maxsize=65536)
+def normalize(text):
+    return strip_accents(text.lower())
+
+
+@lru_cache(maxsize=65536)
+def ngram_buckets(term):
+    """Índices de los n-gramas del término (las palabras se separan con '#')"""
+    padded = "#" + term.replace(" ", "#") + "#"
+    return tuple(
+        zlib.crc32(padded[i:i + size].encode("utf-8")) % HASH_DIM
+        for size in NGRAM_SIZES
+        for i in range(len(padded) - size + 1)
+    )
+
+
+@lru_cache(maxsize=65536)
+def term_vector(term):
+    """Vector disperso normalizado del término: (índices, pesos)"""
+    counts = Counter(ngram_buckets(term))
+    norm = math.sqrt(sum(count * count for count in counts.values()))
+    return tuple(counts), tuple(count / norm for count in counts.values())
+
+
+def sparse_rows(terms):
+    """Matriz dispersa (términos x HASH_DIM) en coordenadas: (fila, columna, peso) de cada n-grama"""
+    rows, columns, weights = [], [], []
+    for row, term in enumerate(terms):
+        indices, values = term_vector(term)
+        rows.extend([row] * len(indices))
+        columns.extend(indices)
+        weights.extend(values)
+    return (np.asarray(rows, dtype=np.intp), np.asarray(columns, dtype=np.intp),
+            np.asarray(weights, dtype=np.float64))
+
+
+class SparseColumns:
+    """Matriz (HASH_DIM x tags) comprimida por filas: para cada n-grama, los tags que lo contienen y su peso"""
+
+    def __init__(self, dense):
+        buckets, tags = np.nonzero(dense)
+        self.shape = dense.shape
+        self.indptr = np.zeros(dense.shape[0] + 1, dtype=np.intp)
+        np.cumsum(np.bincount(buckets, minlength=dense.shape[0]), out=self.indptr[1:])
+        self.tags = tags.astype(np.intp)
+        self.weights = dense[buckets, tags].astype(np.float64)
+
+    def left_multiply(self, rows, columns, weights, n_rows):
+        """(n_rows x HASH_DIM, en coordenadas) @ esta matriz, como matriz densa (n_rows x tags).
+
+        Producto disperso por disperso: cada n-grama de un término solo se cruza con los tags que
+        lo contienen (casi todos los n-gramas de un comentario no están en ningún tag)."""
+        starts = self.indptr[columns]
+        counts = self.indptr[columns + 1] - starts
+        total = int(counts.sum())
+        n_tags = self.shape[1]
+        if not total:
+            return np.zeros((n_rows, n_tags))
+        # Posición de cada par (n-grama del término, tag) dentro de self.tags/self.weights
+        offsets = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(total)
+        pair_rows = np.repeat(rows, counts)
+        values = np.repeat(weights, counts) * self.weights[offsets]
+        keys = pair_rows * n_tags + self.tags[offsets]
+        return np.bincount(keys, weights=values, minlength=n_rows * n_tags).reshape(n_rows, n_tags)
+
+
+def embed(terms):
+    """Matriz (términos x HASH_DIM) de conteos de n-gramas con filas normalizadas (L2)"""
+    rows, columns = [], []
+    for row, term in enumerate(terms):
+        buckets = ngram_buckets(term)
+        rows.extend([row] * len(buckets))
+        columns.extend(buckets)
+    matrix = np.zeros((len(terms), HASH_DIM), dtype=np.float32)
+    np.add.at(matrix, (np.asarray(rows, dtype=np.intp), np.asarray(columns, dtype=np.intp)), 1.0)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def candidate_terms(words):
+    """Palabras y frases de hasta MAX_PHRASE_WORDS palabras: [(término normalizado, posición)]"""
+    normalized = [normalize(word) for word in words]
+    candidates = [(word, position) for position, word in enumerate(normalized)
+                  if len(word) >= MIN_TOKEN_CHARS and word not in STOPWORDS]
+    for size in range(2, MAX_PHRASE_WORDS + 1):
+        for position in range(len(normalized) - size + 1):
+            candidates.append((" ".join(normalized[position:position + size]), position))
+    return candidates
+
+
+class FuzzyTagMatcher:
+    """Coincidencias aproximadas de tags por similitud coseno de n-gramas de caracteres.
+
+    La matriz de los tags se calcula una sola vez; los candidatos de un bloque de comentarios
+    que no se han visto antes se comparan contra todos los tags con una sola multiplicación
+    de matrices dispersas, y sus coincidencias se recuerdan por término (las palabras se
+    repiten mucho entre comentarios). Tolera acentos, errores de escritura y variaciones como
+    profesor/profesores."""
+
+    def __init__(self, tags, threshold=FUZZY_THRESHOLD):
+        self.tags = tuple(tags)
+        self.threshold = threshold
+        normalized = [normalize(tag) for tag in self.tags]
+        # Transpuesta precalculada (HASH_DIM x tags), comprimida por n-grama
+        self.matrix = SparseColumns(embed(normalized).T)
+        # Los errores de escritura casi nunca cambian la primera letra; exigirla evita
+        # coincidencias por subcadena como "paciencia" -> "ciencia"
+        self.first_letters = np.array([ord(tag[0]) for tag in normalized], dtype=np.int32)
+        # término -> ((posición del tag, similitud), ...) con similitud >= threshold
+        self._term_matches = {}
+
+    def match(self, words):
+        """{tag: (similitud, primera posición)} para las palabras de un comentario"""
+        return self.match_many([words])[0]
+
+    def match_many(self, texts_words):
+        """Una multiplicación por bloque de comentarios (acota la memoria de la matriz de candidatos)"""
+        results = []
+        for start in range(0, len(texts_words), BATCH_TEXTS):
+            results.extend(self._match_block(texts_words[start:start + BATCH_TEXTS]))
+        return results
+
+    def _score_terms(self, terms):
+        """Coincidencias sobre el umbral de cada término: una multiplicación para todos"""
+        scores = self.matrix.left_multiply(*sparse_rows(terms), len(terms))  # (términos x tags)
+        first_letters = np.array([ord(term[0]) for term in terms], dtype=np.int32)
+        scores[first_letters[:, None] != self.first_letters[None, :]] = 0.0
+
+        found = {term: [] for term in terms}
+        for row, tag_position in zip(*np.nonzero(scores >= self.threshold)):
+            found[terms[row]].append((int(tag_position), float(scores[row, tag_position])))
+        return {term: tuple(matches) for term, matches in found.items()}
+
+    def _match_block(self, texts_words):
+        candidates = [candidate_terms(words) for words in texts_words]
+
+        # Solo los términos nuevos del bloque pasan por la multiplicación
+        known = {}
+        missing = []
+        for text_candidates in candidates:
+            for term, _ in text_candidates:
+                if term not in known:
+                    matches = self._term_matches.get(term)
+                    known[term] = matches
+                    if matches is None:
+                        missing.append(term)
+        if missing:
+            scored = self._score_terms(missing)
+            known.update(scored)
+            if len(self._term_matches) + len(scored) > TERM_CACHE_SIZE:
+                self._term_matches = {}
+            self._term_matches.update(scored)
+
+        results = []
+        for text_candidates in candidates:
+            matches = {}
+            # En orden de candidato: con la misma similitud gana el primero
+            for term, position in text_candidates:
+                for tag_position, similarity in known[term]:
+                    tag = self.tags[tag_position]
+                    if tag not in matches or similarity > matches[tag][0]:
+                        matches[tag] = (similarity, position)
+            results.append(matches)
+        return results
@@ -0,0 +1,77 @@
+import re
+import unicodedata
+
+WORD_RE = re.compile(r'\b\w+\b')
+
+# Léxico local (sin acentos) para estimar riesgo de contenido ofensivo antes de llamar al LLM
+STRONG_OFFENSIVE_WORDS = frozenset({
+    'mierda', 'idiota', 'idiotas', 'estupido', 'estupida', 'estupidos', 'imbecil', 'imbeciles',
+    'pendejo', 'pendeja', 'pendejos', 'basura', 'puto', 'puta', 'putos', 'cabron', 'cabrones',
+    'culero', 'culeros', 'verga', 'chingada', 'maldito', 'maldita', 'malditos', 'joder',
+    'porqueria', 'asqueroso', 'asquerosa', 'mamada', 'mamadas', 'marica', 'subnormal', 'retrasado',
+})
+WEAK_OFFENSIVE_WORDS = frozenset({
+    'odio', 'odiamos', 'asco', 'inutil', 'inutiles', 'tonto', 'tonta', 'tontos', 'burro', 'burros',
+    'terrible', 'pesimo', 'pesima', 'horrible', 'despedir', 'incompetente', 'incompetentes',
+    'malo', 'mala', 'peor', 'ridiculo', 'ridicula', 'vago', 'vaga', 'mediocre', 'mediocres',
+})
+
+STRONG_WEIGHT = 0.9
+WEAK_WEIGHT = 0.35
+
+
+def strip_accents(text):
+    """Quitar acentos para comparar contra el léxico"""
+    normalized = unicodedata.normalize("NFD", text)
+    return "".join(char for char in normalized if unicodedata.category(char) != "Mn")
+
+
+def offensive_risk_score(text):
+    """Puntaje local de riesgo ofensivo entre 0 y 1 (combinación probabilística de señales)"""
+    words = WORD_RE.findall(strip_accents(text.lower()))
+    safe_probability = 1.0
+    for word in words:
+        if word in STRONG_OFFENSIVE_WORDS:
+            safe_probability *= 1 - STRONG_WEIGHT
+        elif word in WEAK_OFFENSIVE_WORDS:
+            safe_probability *= 1 - WEAK_WEIGHT
+    return round(1 - safe_probability, 4)
+
+
+# Señales locales de categoría para responder sin el LLM cuando se agota el plazo
+OFFENSIVE_THRESHOLD = 0.5
+SUGGESTION_WORDS = frozenset({
+    'deberian', 'deberia', 'sugiero', 'sugerencia', 'propongo', 'propuesta', 'podrian', 'podria',
+    'seria', 'ojala', 'mejorar', 'agregar', 'implementar', 'necesita', 'necesitan', 'falta', 'faltan',
+})
+CAMPUS_LIFE_WORDS = frozenset({
+    'campus', 'cafeteria', 'biblioteca', 'evento', 'eventos', 'club', 'clubes', 'deporte', 'deportes',
+    'fiesta', 'festival', 'intercambio', 'residencia', 'companeros', 'amigos', 'semestre', 'graduacion',
+})
+
+
+def keyword_category(text):
+    """Categoría por palabras clave (Sugerencia o Vida universitaria), o None si ninguna coincide"""
+    words = set(WORD_RE.findall(strip_accents(text.lower())))
+    if words & SUGGESTION_WORDS:
+        return "Sugerencia"
+    if words & CAMPUS_LIFE_WORDS:
+        return "Vida universitaria"
+    return None
+
+
+def local_category(text):
+    """Categoría aproximada sin LLM: Queja si el riesgo ofensivo es alto, luego palabras clave"""
+    if offensive_risk_score(text) >= OFFENSIVE_THRESHOLD:
+        return "Queja"
+    return keyword_category(text) or "Opinion"
+
+
+def mask_offensive(text):
+    """Ocultar las palabras del léxico fuerte conservando la primera letra"""
+    def mask(match):
+        word = match.group(0)
+        if strip_accents(word.lower()) in STRONG_OFFENSIVE_WORDS:
+            return word[0] + "*" * (len(word) - 1)
+        return word
+    return WORD_RE.sub(mask, text)
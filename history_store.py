@@ -0,0 +1,694 @@
+import os
+import json
+import time
+import queue
+import atexit
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+try:
+    import fcntl
+except ImportError:  # Windows: solo se serializa dentro del proceso
+    fcntl = None
+
+COMMENTS_HISTORY_FILE = "comentarios_analizados.json"
+TITLES_HISTORY_FILE = "titulos_analizados.json"
+
+# Categorías de registros antiguos y su equivalente actual
+CATEGORY_ALIASES = {"HateSpeech": "Queja"}
+
+# Un lock de hilos por archivo: dentro del proceso solo se serializan los escritores del mismo
+# archivo (cada tenant y cada historial avanzan por separado)
+_path_locks = {}
+_path_locks_guard = threading.Lock()
+
+# Ids que cada HistoryWriter reserva de una vez en el manifiesto (los no usados quedan como huecos)
+ID_BLOCK_SIZE = int(os.getenv("HISTORY_ID_BLOCK", "64"))
+
+
+def load_analysis_history(filename=COMMENTS_HISTORY_FILE):
+    """Cargar historial de análisis desde JSON"""
+    try:
+        if os.path.exists(filename):
+            with open(filename, "r", encoding="utf-8") as file:
+                return json.load(file)
+        return []
+    except Exception as e:
+        print(f"Error cargando historial: {str(e)}")
+        return []
+
+
+def normalize_category(categoria):
+    """Traducir categorías heredadas (p. ej. HateSpeech) a las actuales"""
+    return CATEGORY_ALIASES.get(categoria, categoria)
+
+
+def drop_superseded(records):
+    """Quitar los análisis reemplazados por una versión nueva del mismo conjunto (`reemplaza`).
+    La versión nueva conserva la fecha del original, así que ambos caen en el mismo rango."""
+    replaced = {record["reemplaza"] for record in records if record.get("reemplaza") is not None}
+    if not replaced:
+        return records
+    return [record for record in records if record.get("id") not in replaced]
+
+
+def _until(timestamp, end):
+    """timestamp <= end comparando con la precisión de `end`: "2025-08-31" incluye todo ese día"""
+    return timestamp[:len(end)] <= end
+
+
+def _write_atomic(filename, records):
+    """Escribir el archivo completo en un temporal y reemplazarlo con un rename atómico"""
+    tmp_filename = f"{filename}.tmp"
+    with open(tmp_filename, "w", encoding="utf-8") as file:
+        json.dump(records, file, ensure_ascii=False, indent=2)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_filename, filename)
+
+
+def _path_lock(filename):
+    key = os.path.abspath(filename)
+    with _path_locks_guard:
+        lock = _path_locks.get(key)
+        if lock is None:
+            lock = _path_locks[key] = threading.Lock()
+        return lock
+
+
+@contextmanager
+def _file_lock(filename):
+    """Bloqueo exclusivo entre procesos (API, Streamlit, backfill) sobre un archivo .lock"""
+    with _path_lock(filename):
+        if fcntl is None:
+            yield
+            return
+        with open(f"{filename}.lock", "a") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def save_many_to_json(records, filename=COMMENTS_HISTORY_FILE):
+    """Guardar un lote de análisis en el archivo JSON con una sola escritura"""
+    try:
+        with _file_lock(filename):
+            if os.path.exists(filename):
+                with open(filename, "r", encoding="utf-8") as file:
+                    existing_data = json.load(file)
+            else:
+                existing_data = []
+
+            existing_data.extend(records)
+            _write_atomic(filename, existing_data)
+
+        return True
+    except Exception as e:
+        print(f"Error guardando en JSON: {str(e)}")
+        return False
+
+
+def save_to_json(data, filename=COMMENTS_HISTORY_FILE):
+    """Guardar datos en archivo JSON"""
+    return save_many_to_json([data], filename)
+
+
+_PendingUpdate = namedtuple("_PendingUpdate", ["id", "fields"])
+
+
+class HistoryWriter:
+    """Escritor en segundo plano: una cola acotada alimenta un hilo que hace group commit.
+
+    `submit` no espera al disco; el registro queda visible para `get` desde ese momento
+    (lectura de lo propio escrito) hasta que se confirma en el historial. Los ids salen de
+    bloques reservados en el manifiesto bajo su bloqueo, así que no chocan con los de otros
+    escritores (otros workers, el panel o `append_many(assign_ids=True)` de los scripts)."""
+
+    def __init__(self, store, max_queue=1000, batch_size=200, batch_wait=0.05, put_timeout=2.0,
+                 id_block=ID_BLOCK_SIZE):
+        self.store = store
+        self.id_block = max(1, id_block)
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.put_timeout = put_timeout
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._pending = {}  # id -> registro aceptado pero aún no confirmado en disco
+        self._pending_lock = threading.Lock()
+        self._id_lock = threading.Lock()
+        self._next_id = 1
+        self._block_end = 0  # último id del bloque reservado; se reserva uno nuevo al agotarlo
+        self._stats = {"lotes": 0, "registros": 0, "errores": 0, "rechazados": 0,
+                       "ultimo_lote": 0, "ultimo_commit_s": 0.0}
+        self._closed = False
+        self._listeners = []
+
+        self._thread = threading.Thread(target=self._run, name=f"history-writer[{store.directory}]", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def allocate_id(self):
+        with self._id_lock:
+            if self._next_id > self._block_end:
+                self._next_id = self.store.reserve_ids(self.id_block)
+                self._block_end = self._next_id + self.id_block - 1
+            record_id = self._next_id
+            self._next_id += 1
+            return record_id
+
+    def add_listener(self, listener, updates=False):
+        """Registrar `listener(records)`, llamado con cada lote después de confirmarlo en disco.
+        Con `updates` también recibe los registros actualizados (versión completa)."""
+        self._listeners.append((listener, updates))
+
+    def update(self, record_id, fields):
+        """Encolar una actualización de campos; se aplica después de confirmar el registro original"""
+        if self._closed:
+            return False
+        with self._pending_lock:
+            record = self._pending.get(record_id) or self.store.get(record_id) or {"id": record_id}
+            # Copia nueva: el registro ya encolado no se modifica mientras se serializa
+            self._pending[record_id] = {**record, **fields}
+        self._queue.put(_PendingUpdate(record_id, fields))
+        return True
+
+    def submit(self, record):
+        """Encolar un análisis; devuelve False si la cola sigue llena después de `put_timeout`"""
+        if self._closed:
+            return False
+        with self._pending_lock:
+            self._pending[record.get("id")] = record
+        try:
+            self._queue.put(record, timeout=self.put_timeout)
+            return True
+        except queue.Full:
+            with self._pending_lock:
+                self._pending.pop(record.get("id"), None)
+            self._stats["rechazados"] += 1
+            return False
+
+    def get(self, record_id):
+        """Buscar un análisis por id: primero en lo pendiente, luego en el historial"""
+        with self._pending_lock:
+            record = self._pending.get(record_id)
+        if record is not None:
+            return record
+        return self.store.get(record_id)
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        with self._pending_lock:
+            pending = len(self._pending)
+        return {"directorio": self.store.directory, "en_cola": self.queue_depth(), "capacidad": self._queue.maxsize,
+                "pendientes": pending, **self._stats}
+
+    def _collect_batch(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+        return batch
+
+    def _commit(self, batch):
+        records = [item for item in batch if isinstance(item, dict)]
+        updates = {}
+        for item in batch:
+            if isinstance(item, _PendingUpdate):
+                updates.setdefault(item.id, {}).update(item.fields)
+        if not records and not updates:
+            return
+        start = time.perf_counter()
+        retry_delay = 0.1
+        to_append = records
+        retrying = False
+        # Reintentar hasta confirmar: un registro aceptado no se descarta en silencio
+        while True:
+            try:
+                if to_append:
+                    self.store.append_many(to_append, dedupe=retrying)
+                    to_append = []
+                updated = self.store.update_many(updates) if updates else []
+                break
+            except Exception as e:
+                print(f"Error guardando lote del historial: {str(e)}")
+                self._stats["errores"] += 1
+                retrying = True
+                time.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, 5.0)
+                # Los registros ya confirmados no se vuelven a agregar, pero siguen en `records`:
+                # al terminar salen de lo pendiente y cuentan en las estadísticas y los listeners.
+                # Los escritos sin llegar al manifiesto los descarta append_many(dedupe=True).
+                to_append = [record for record in to_append if self.store.get(record.get("id")) is None]
+        with self._pending_lock:
+            for record in records:
+                # Si hay una actualización encolada, el registro combinado sigue pendiente
+                if self._pending.get(record.get("id")) is record:
+                    self._pending.pop(record.get("id"))
+            for record in updated:
+                self._pending.pop(record.get("id"), None)
+        self._stats["lotes"] += 1
+        self._stats["registros"] += len(records)
+        self._stats["ultimo_lote"] = len(records)
+        self._stats["ultimo_commit_s"] = round(time.perf_counter() - start, 4)
+        for listener, with_updates in self._listeners:
+            try:
+                listener(records + updated if with_updates else records)
+            except Exception as e:
+                print(f"Error en listener del historial: {str(e)}")
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch(self._queue.get())
+            try:
+                self._commit(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if None in batch:
+                return
+
+    def flush(self):
+        """Esperar a que todo lo encolado quede confirmado en disco"""
+        self._queue.join()
+
+    def close(self):
+        """Vaciar la cola y detener el hilo (se registra con atexit)"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        # Los escritores de tenants liberados no deben quedar retenidos hasta la salida
+        atexit.unregister(self.close)
+
+
+DEFAULT_HISTORY_DIR = os.getenv("HISTORY_DIR", "historial")
+SEGMENT_MAX_BYTES = int(os.getenv("HISTORY_SEGMENT_MAX_BYTES", str(8 * 1024 * 1024)))
+COMPACT_AFTER_DAYS = int(os.getenv("HISTORY_COMPACT_AFTER_DAYS", "30"))
+RETENTION_DAYS = int(os.getenv("HISTORY_RETENTION_DAYS", "0"))  # 0 = conservar todo
+MAINTENANCE_INTERVAL = float(os.getenv("HISTORY_MAINTENANCE_INTERVAL", "3600"))
+
+
+def _record_day(record):
+    timestamp = record.get("timestamp") or datetime.now().isoformat()
+    return timestamp[:10]
+
+
+class SegmentedHistory:
+    """Historial en segmentos JSONL diarios (o por tamaño) con un manifiesto de rangos de tiempo.
+
+    Las lecturas por rango solo abren los segmentos cuyo rango se cruza con el pedido.
+    Cada escritura incrementa la secuencia (`seq`) del manifiesto y la guarda en los segmentos
+    que toca, para que otro proceso lea solo lo que cambió (`changes_since`).
+    Los segmentos de meses viejos se compactan en uno mensual y los que superan la
+    retención se eliminan, ambos en un hilo de mantenimiento."""
+
+    def __init__(self, directory, legacy_file=None, max_segment_bytes=SEGMENT_MAX_BYTES,
+                 compact_after_days=COMPACT_AFTER_DAYS, retention_days=RETENTION_DAYS):
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self.compact_after_days = compact_after_days
+        self.retention_days = retention_days
+        self.manifest_path = os.path.join(directory, "manifest.json")
+        self._maintenance_thread = None
+        self._stop = threading.Event()
+
+        os.makedirs(directory, exist_ok=True)
+        if not os.path.exists(self.manifest_path):
+            self._write_manifest({"version": 1, "max_id": 0, "seq": 0, "segments": []})
+            if legacy_file and os.path.exists(legacy_file):
+                self._import_legacy(legacy_file)
+
+    # Manifiesto
+
+    def _read_manifest(self):
+        with open(self.manifest_path, "r", encoding="utf-8") as file:
+            return json.load(file)
+
+    def _write_manifest(self, manifest):
+        manifest["segments"].sort(key=lambda segment: (segment["start"], segment["file"]))
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(manifest, file, ensure_ascii=False, indent=2)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.manifest_path)
+
+    def _path(self, segment):
+        return os.path.join(self.directory, segment["file"])
+
+    @staticmethod
+    def _touch(manifest, segment):
+        manifest["seq"] = manifest.get("seq", 0) + 1
+        segment["seq"] = manifest["seq"]
+
+    def _import_legacy(self, legacy_file):
+        """Migración única del archivo JSON histórico; los registros sin id reciben su posición"""
+        history = load_analysis_history(legacy_file)
+        for position, item in enumerate(history):
+            item.setdefault("id", position + 1)
+        if history:
+            self.append_many(history)
+            print(f"Historial migrado desde {legacy_file}: {len(history)} registros")
+
+    # Escritura
+
+    def next_id(self):
+        return self._read_manifest()["max_id"] + 1
+
+    def reserve_ids(self, count):
+        """Reservar `count` ids consecutivos bajo el bloqueo del manifiesto; devuelve el primero"""
+        with _file_lock(self.manifest_path):
+            manifest = self._read_manifest()
+            first_id = manifest["max_id"] + 1
+            manifest["max_id"] += count
+            self._write_manifest(manifest)
+        return first_id
+
+    def append_many(self, records, assign_ids=False, dedupe=False):
+        """Agregar registros a los segmentos de su día; rota al superar el tamaño máximo.
+        Con `assign_ids` los ids se asignan bajo el bloqueo del manifiesto (seguro entre procesos).
+        Con `dedupe` (reintentos) no se vuelven a escribir los ids que ya están en los segmentos del
+        día aunque el manifiesto no los cuente: un intento anterior pudo escribir la línea y fallar
+        antes de actualizar el manifiesto."""
+        with _file_lock(self.manifest_path):
+            manifest = self._read_manifest()
+            if assign_ids:
+                for record in records:
+                    manifest["max_id"] += 1
+                    record["id"] = manifest["max_id"]
+
+            by_day = {}
+            for record in records:
+                by_day.setdefault(_record_day(record), []).append(record)
+
+            for day, day_records in sorted(by_day.items()):
+                segment = self._active_segment(manifest, day)
+                if dedupe:
+                    day_records = self._recover_written(manifest, day, segment, day_records)
+                lines = [json.dumps(record, ensure_ascii=False) + "\n" for record in day_records]
+                with open(self._path(segment), "a", encoding="utf-8") as file:
+                    file.writelines(lines)
+                    file.flush()
+                    os.fsync(file.fileno())
+                self._extend_segment(segment, day_records, sum(len(line.encode("utf-8")) for line in lines))
+                self._touch(manifest, segment)
+                ids = [record["id"] for record in day_records if isinstance(record.get("id"), int)]
+                manifest["max_id"] = max([manifest["max_id"]] + ids)
+            self._write_manifest(manifest)
+        return True
+
+    def _recover_written(self, manifest, day, active, records):
+        """Registros que faltan escribir. Si alguno ya está en un segmento del día, los datos de ese
+        segmento en el manifiesto se recalculan desde el archivo (el intento anterior no los actualizó)."""
+        segments = [segment for segment in manifest["segments"] if segment.get("dia") == day]
+        if active not in segments:
+            segments.append(active)
+        pending = {record.get("id"): record for record in records}
+        for segment in segments:
+            path = self._path(segment)
+            if not os.path.exists(path):
+                continue
+            # Una línea a medio escribir no debe pegarse con la siguiente
+            with open(path, "rb+") as file:
+                if file.seek(0, os.SEEK_END):
+                    file.seek(-1, os.SEEK_END)
+                    if file.read(1) != b"\n":
+                        file.write(b"\n")
+            written = self._read_segment(segment)
+            if any(record.get("id") in pending for record in written):
+                for record in written:
+                    pending.pop(record.get("id"), None)
+                segment.update({"start": None, "end": None, "count": 0, "bytes": 0, "min_id": None, "max_id": None})
+                self._extend_segment(segment, written, os.path.getsize(path))
+                self._touch(manifest, segment)
+        return list(pending.values())
+
+    def update_many(self, updates):
+        """Actualizar en su lugar los campos de registros existentes: {id: campos}.
+        Reescribe de forma atómica solo los segmentos que contienen esos ids; devuelve los registros actualizados."""
+        updated = []
+        with _file_lock(self.manifest_path):
+            manifest = self._read_manifest()
+            remaining = dict(updates)
+            for segment in manifest["segments"]:
+                if not remaining:
+                    break
+                if segment["min_id"] is None or not any(
+                        segment["min_id"] <= record_id <= segment["max_id"] for record_id in remaining):
+                    continue
+                records = self._read_segment(segment)
+                changed = False
+                for record in records:
+                    fields = remaining.pop(record.get("id"), None)
+                    if fields is not None:
+                        record.update(fields)
+                        updated.append(record)
+                        changed = True
+                if not changed:
+                    continue
+
+                lines = [json.dumps(record, ensure_ascii=False) + "\n" for record in records]
+                tmp_path = f"{self._path(segment)}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as file:
+                    file.writelines(lines)
+                    file.flush()
+                    os.fsync(file.fileno())
+                os.replace(tmp_path, self._path(segment))
+                segment["bytes"] = sum(len(line.encode("utf-8")) for line in lines)
+                self._touch(manifest, segment)
+            if updated:
+                self._write_manifest(manifest)
+        return updated
+
+    def update(self, record_id, fields):
+        """Actualizar un registro; devuelve el registro actualizado o None si no existe"""
+        updated = self.update_many({record_id: fields})
+        return updated[0] if updated else None
+
+    def _active_segment(self, manifest, day):
+        day_segments = [segment for segment in manifest["segments"]
+                        if segment.get("dia") == day and not segment.get("cerrado")]
+        if day_segments and day_segments[-1]["bytes"] < self.max_segment_bytes:
+            return day_segments[-1]
+        for segment in day_segments:
+            segment["cerrado"] = True
+
+        sequence = sum(1 for segment in manifest["segments"] if segment.get("dia") == day)
+        segment = {"file": f"{day}.{sequence:03d}.jsonl", "dia": day, "start": None, "end": None,
+                   "count": 0, "bytes": 0, "min_id": None, "max_id": None, "cerrado": False}
+        manifest["segments"].append(segment)
+        return segment
+
+    @staticmethod
+    def _extend_segment(segment, records, size):
+        timestamps = [record["timestamp"] for record in records if record.get("timestamp")]
+        ids = [record["id"] for record in records if isinstance(record.get("id"), int)]
+        if timestamps:
+            segment["start"] = min([segment["start"]] + timestamps if segment["start"] else timestamps)
+            segment["end"] = max([segment["end"]] + timestamps if segment["end"] else timestamps)
+        if ids:
+            segment["min_id"] = min([segment["min_id"]] + ids if segment["min_id"] is not None else ids)
+            segment["max_id"] = max([segment["max_id"]] + ids if segment["max_id"] is not None else ids)
+        segment["count"] += len(records)
+        segment["bytes"] += size
+
+    # Lectura
+
+    def _read_segment(self, segment):
+        records = []
+        with open(self._path(segment), "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # Última línea a medio escribir por otro proceso
+                    continue
+        return records
+
+    def _segments_for(self, manifest, start=None, end=None):
+        selected = []
+        for segment in manifest["segments"]:
+            if start and segment["end"] and segment["end"] < start:
+                continue
+            if end and segment["start"] and not _until(segment["start"], end):
+                continue
+            selected.append(segment)
+        return selected
+
+    def read_range(self, start=None, end=None, superseded=False):
+        """Registros con start <= timestamp <= end (cadenas ISO); solo abre los segmentos relevantes.
+        Un `end` sin hora (o con menos precisión) incluye todo ese día (o minuto, segundo...).
+        Las versiones reemplazadas se omiten salvo con `superseded=True`."""
+        for attempt in range(3):
+            manifest = self._read_manifest()
+            try:
+                records = []
+                for segment in self._segments_for(manifest, start, end):
+                    records.extend(self._read_segment(segment))
+                break
+            except FileNotFoundError:
+                # La compactación reemplazó un segmento entre la lectura del manifiesto y del archivo
+                if attempt == 2:
+                    raise
+        records = [record for record in records
+                   if (not start or (record.get("timestamp") or "") >= start)
+                   and (not end or _until(record.get("timestamp") or "", end))]
+        records.sort(key=lambda record: record.get("timestamp") or "")
+        return records if superseded else drop_superseded(records)
+
+    def tail(self, count):
+        """Últimos `count` registros leyendo los segmentos más recientes hacia atrás"""
+        manifest = self._read_manifest()
+        records = []
+        for segment in reversed(manifest["segments"]):
+            records = self._read_segment(segment) + records
+            if len(records) >= count:
+                break
+        records.sort(key=lambda record: record.get("timestamp") or "")
+        return drop_superseded(records)[-count:]
+
+    def get(self, record_id):
+        manifest = self._read_manifest()
+        for segment in manifest["segments"]:
+            if segment["min_id"] is not None and segment["min_id"] <= record_id <= segment["max_id"]:
+                for record in self._read_segment(segment):
+                    if record.get("id") == record_id:
+                        return record
+        return None
+
+    def current_seq(self):
+        """Secuencia actual del manifiesto (para leer después solo lo que cambie con `changes_since`)"""
+        return self._read_manifest().get("seq", 0)
+
+    def changes_since(self, seq):
+        """(registros, seq): los registros de los segmentos escritos después de `seq` y la secuencia actual.
+        Incluye registros ya vistos de esos segmentos; quien lee debe ignorar los repetidos."""
+        for attempt in range(3):
+            manifest = self._read_manifest()
+            try:
+                records = [record
+                           for segment in manifest["segments"] if segment.get("seq", 0) > seq
+                           for record in self._read_segment(segment)]
+                return records, manifest.get("seq", 0)
+            except FileNotFoundError:
+                # La compactación reemplazó un segmento entre la lectura del manifiesto y del archivo
+                if attempt == 2:
+                    raise
+
+    def count(self):
+        return sum(segment["count"] for segment in self._read_manifest()["segments"])
+
+    def clear(self):
+        """Eliminar todos los segmentos (conserva el contador de ids)"""
+        with _file_lock(self.manifest_path):
+            manifest = self._read_manifest()
+            for segment in manifest["segments"]:
+                if os.path.exists(self._path(segment)):
+                    os.remove(self._path(segment))
+            manifest["segments"] = []
+            self._write_manifest(manifest)
+
+    # Mantenimiento
+
+    def compact(self, now=None):
+        """Unir los segmentos de meses terminados hace más de `compact_after_days` en uno por mes"""
+        now = now or datetime.now()
+        cutoff = (now - timedelta(days=self.compact_after_days)).isoformat()[:10]
+        with _file_lock(self.manifest_path):
+            manifest = self._read_manifest()
+            by_month = {}
+            for segment in manifest["segments"]:
+                day = segment.get("dia") or (segment["start"] or "")[:10]
+                month = day[:7]
+                # Solo meses completos y anteriores al corte
+                if month and month < cutoff[:7] and (segment["end"] or "") < cutoff:
+                    by_month.setdefault(month, []).append(segment)
+
+            compacted = 0
+            for month, segments in by_month.items():
+                if len(segments) == 1 and segments[0].get("compactado"):
+                    continue
+                records = []
+                for segment in segments:
+                    records.extend(self._read_segment(segment))
+                records.sort(key=lambda record: record.get("timestamp") or "")
+
+                # Conserva la secuencia de sus segmentos: compactar no cambia ningún registro
+                merged = {"file": f"{month}.{int(time.time())}.compactado.jsonl", "dia": None, "start": None,
+                          "end": None, "count": 0, "bytes": 0, "min_id": None, "max_id": None,
+                          "cerrado": True, "compactado": True,
+                          "seq": max(segment.get("seq", 0) for segment in segments)}
+                lines = [json.dumps(record, ensure_ascii=False) + "\n" for record in records]
+                tmp_path = f"{self._path(merged)}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as file:
+                    file.writelines(lines)
+                    file.flush()
+                    os.fsync(file.fileno())
+                os.replace(tmp_path, self._path(merged))
+                self._extend_segment(merged, records, sum(len(line.encode("utf-8")) for line in lines))
+
+                manifest["segments"] = [segment for segment in manifest["segments"] if segment not in segments]
+                manifest["segments"].append(merged)
+                self._write_manifest(manifest)
+                for segment in segments:
+                    os.remove(self._path(segment))
+                compacted += len(segments)
+            return compacted
+
+    def apply_retention(self, now=None):
+        """Eliminar segmentos cuyo último registro es más viejo que la retención"""
+        if not self.retention_days:
+            return 0
+        now = now or datetime.now()
+        cutoff = (now - timedelta(days=self.retention_days)).isoformat()
+        with _file_lock(self.manifest_path):
+            manifest = self._read_manifest()
+            expired = [segment for segment in manifest["segments"] if segment["end"] and segment["end"] < cutoff]
+            if not expired:
+                return 0
+            manifest["segments"] = [segment for segment in manifest["segments"] if segment not in expired]
+            self._write_manifest(manifest)
+            for segment in expired:
+                if os.path.exists(self._path(segment)):
+                    os.remove(self._path(segment))
+            return len(expired)
+
+    def _maintain(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.compact()
+                self.apply_retention()
+            except Exception as e:
+                print(f"Error en mantenimiento del historial: {str(e)}")
+
+    def start_maintenance(self, interval=MAINTENANCE_INTERVAL):
+        """Iniciar la compactación y retención en segundo plano (idempotente)"""
+        if self._maintenance_thread is None or not self._maintenance_thread.is_alive():
+            self._stop.clear()
+            self._maintenance_thread = threading.Thread(target=self._maintain, args=(interval,),
+                                                        name=f"history-maintenance[{self.directory}]",
+                                                        daemon=True)
+            self._maintenance_thread.start()
+        return self
+
+    def stop_maintenance(self):
+        self._stop.set()
+
+    def stats(self):
+        manifest = self._read_manifest()
+        return {"directorio": self.directory, "segmentos": len(manifest["segments"]),
+                "registros": sum(segment["count"] for segment in manifest["segments"]),
+                "bytes": sum(segment["bytes"] for segment in manifest["segments"]),
+                "max_id": manifest["max_id"]}
@@ -0,0 +1,331 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import threading
+from itertools import islice
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: solo se serializa dentro del proceso
+    fcntl = None
+
+from history_store import DEFAULT_HISTORY_DIR
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+IDEMPOTENCY_REPLAYED_HEADER = "Idempotent-Replayed"
+# Tiempo que se conserva una respuesta y máximo de claves en memoria (se descartan las más antiguas)
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "10000"))
+# Espera máxima por una solicitud con la misma clave que todavía está en proceso
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "30"))
+MAX_KEY_LENGTH = 255
+# Claves compartidas por todos los workers (gunicorn) y entre reinicios, junto al historial
+IDEMPOTENCY_DIR = os.getenv("IDEMPOTENCY_DIR", os.path.join(DEFAULT_HISTORY_DIR, "idempotencia"))
+# Una clave en proceso más vieja que esto se considera abandonada (el worker que la tomó terminó)
+IDEMPOTENCY_CLAIM_SECONDS = float(os.getenv("IDEMPOTENCY_CLAIM_SECONDS", "300"))
+POLL_INTERVAL = 0.05
+# Cada cuántos segundos un hilo en segundo plano purga las claves vencidas y las que exceden el máximo
+IDEMPOTENCY_PURGE_SECONDS = float(os.getenv("IDEMPOTENCY_PURGE_SECONDS", "60"))
+# Archivos que se borran por cada toma del bloqueo (para no frenar las solicitudes que reclaman claves)
+PURGE_SLICE = 100
+
+# Estados que no se guardan: el cliente debe poder reintentar y que se procese de nuevo
+RETRYABLE_STATUSES = frozenset({409, 429})
+
+
+class IdempotencyConflict(ValueError):
+    """La clave ya se usó con otro contenido"""
+
+
+class IdempotencyInProgress(RuntimeError):
+    """Otra solicitud con la misma clave sigue en proceso después de la espera"""
+
+
+def fingerprint(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def valid_key(key):
+    return bool(key) and len(key) <= MAX_KEY_LENGTH and key.isprintable()
+
+
+class _Entry:
+    __slots__ = ("fingerprint", "done", "response", "expires")
+
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.done = threading.Event()
+        self.response = None  # (cuerpo, estado) cuando termina
+        self.expires = None
+
+
+class IdempotencyStore:
+    """Respuestas por clave de idempotencia, para que un reintento no repita el análisis.
+
+    La primera solicitud con una clave la procesa y guarda su respuesta; las siguientes
+    reciben la misma respuesta (y el mismo id de análisis). Si llegan mientras la primera
+    sigue en proceso, esperan a que termine. Las respuestas con error del servidor (5xx,
+    409, 429) no se guardan, así el reintento se procesa de nuevo. La clave se asocia a la
+    huella del contenido: reutilizarla con otro texto es un conflicto."""
+
+    def __init__(self, ttl=IDEMPOTENCY_TTL_SECONDS, max_keys=IDEMPOTENCY_MAX_KEYS, wait=IDEMPOTENCY_WAIT_SECONDS):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.wait = wait
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"procesadas": 0, "reutilizadas": 0, "conflictos": 0, "esperas": 0, "descartadas": 0}
+
+    def _claim(self, key, content_fingerprint):
+        """Devuelve (entrada, es_propia); la entrada propia la debe completar o liberar quien la reclama"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires is not None and entry.expires < time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                entry = self._entries[key] = _Entry(content_fingerprint)
+                return entry, True
+            if entry.fingerprint != content_fingerprint:
+                self._stats["conflictos"] += 1
+                raise IdempotencyConflict("La clave de idempotencia ya se usó con otro contenido")
+            return entry, False
+
+    def _complete(self, key, entry, response):
+        with self._lock:
+            entry.response = response
+            entry.expires = time.monotonic() + self.ttl
+            self._entries.move_to_end(key)
+            # Descartar las respuestas más antiguas; las que siguen en proceso se conservan
+            excess = len(self._entries) - self.max_keys
+            if excess > 0:
+                oldest = (old_key for old_key, old in self._entries.items() if old.response is not None)
+                for old_key in list(islice(oldest, excess)):
+                    del self._entries[old_key]
+                    self._stats["descartadas"] += 1
+        entry.done.set()
+
+    def _abandon(self, key, entry):
+        with self._lock:
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+        entry.done.set()
+
+    def _wait(self, key, entry, deadline):
+        """Esperar a la solicitud que tiene la clave: su respuesta, o None si la liberó sin guardarla"""
+        if not entry.done.is_set():
+            with self._lock:
+                self._stats["esperas"] += 1
+        if not entry.done.wait(max(0.0, deadline - time.monotonic())):
+            raise IdempotencyInProgress("Hay una solicitud con la misma clave de idempotencia en proceso")
+        return entry.response
+
+    def run(self, key, content_fingerprint, compute):
+        """Devolver (cuerpo, estado, reutilizada) para la clave; `compute` produce (cuerpo, estado)"""
+        deadline = time.monotonic() + self.wait
+        while True:
+            entry, owned = self._claim(key, content_fingerprint)
+            if owned:
+                break
+            response = self._wait(key, entry, deadline)
+            if response is not None:
+                with self._lock:
+                    self._stats["reutilizadas"] += 1
+                body, status = response
+                return body, status, True
+            # La solicitud anterior falló y liberó la clave: intentar procesarla aquí
+
+        try:
+            body, status = compute()
+        except BaseException:
+            self._abandon(key, entry)
+            raise
+        if status >= 500 or status in RETRYABLE_STATUSES:
+            self._abandon(key, entry)
+        else:
+            self._complete(key, entry, (body, status))
+        with self._lock:
+            self._stats["procesadas"] += 1
+        return body, status, False
+
+    def stats(self):
+        with self._lock:
+            in_progress = sum(1 for entry in self._entries.values() if entry.response is None)
+            return {
+                "claves": len(self._entries),
+                "en_proceso": in_progress,
+                "ttl_s": self.ttl,
+                "max_claves": self.max_keys,
+                **self._stats,
+            }
+
+
+class FileIdempotencyStore(IdempotencyStore):
+    """IdempotencyStore con un archivo por clave en `directory`.
+
+    Todos los workers de la API (gunicorn) y los reinicios ven las mismas claves: un reintento
+    que llega a otro worker recibe la respuesta original. Las claves se reclaman bajo un
+    bloqueo de archivo; quien espera una clave en proceso en otro worker consulta su archivo
+    cada POLL_INTERVAL segundos. Una clave en proceso más vieja que `claim_ttl` se considera
+    abandonada por un worker que terminó y se puede reclamar de nuevo. Las claves vencidas y
+    las que exceden el máximo se purgan en segundo plano (`start`), fuera de las solicitudes."""
+
+    def __init__(self, directory=IDEMPOTENCY_DIR, claim_ttl=IDEMPOTENCY_CLAIM_SECONDS,
+                 purge_interval=IDEMPOTENCY_PURGE_SECONDS, **options):
+        super().__init__(**options)
+        self.directory = directory
+        self.claim_ttl = claim_ttl
+        self.purge_interval = purge_interval
+        self._lock_path = os.path.join(directory, "claves.lock")
+        self._stop = threading.Event()
+        self._thread = None
+        os.makedirs(directory, exist_ok=True)
+
+    @contextmanager
+    def _file_lock(self):
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self._lock_path, "a") as lock_file:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _path(self, key):
+        digest = hashlib.sha256(json.dumps(key, ensure_ascii=False).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{digest}.json")
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _write(path, entry):
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(entry, file, ensure_ascii=False, default=str)
+        os.replace(tmp_path, path)
+
+    def _expired(self, entry, now):
+        if entry.get("respuesta") is not None:
+            return entry["expira"] < now
+        return entry["reclamada"] + self.claim_ttl < now
+
+    def _claim(self, key, content_fingerprint):
+        path = self._path(key)
+        with self._file_lock():
+            entry = self._read(path)
+            if entry is None or self._expired(entry, time.time()):
+                entry = {"huella": content_fingerprint, "token": uuid.uuid4().hex, "reclamada": time.time(),
+                         "respuesta": None}
+                self._write(path, entry)
+                return entry, True
+        if entry["huella"] != content_fingerprint:
+            with self._lock:
+                self._stats["conflictos"] += 1
+            raise IdempotencyConflict("La clave de idempotencia ya se usó con otro contenido")
+        return entry, False
+
+    def _complete(self, key, entry, response):
+        self._write(self._path(key), {**entry, "respuesta": list(response), "expira": time.time() + self.ttl})
+
+    def _abandon(self, key, entry):
+        path = self._path(key)
+        with self._file_lock():
+            current = self._read(path)
+            # Solo se libera la clave propia (si se venció, otro worker pudo reclamarla)
+            if current is not None and current.get("token") == entry["token"]:
+                os.remove(path)
+
+    def _wait(self, key, entry, deadline):
+        with self._lock:
+            self._stats["esperas"] += 1
+        path = self._path(key)
+        while time.monotonic() < deadline:
+            time.sleep(POLL_INTERVAL)
+            current = self._read(path)
+            if current is None or current.get("token") != entry["token"]:
+                return None  # liberada (o vencida y reclamada por otra solicitud): volver a reclamarla
+            if current.get("respuesta") is not None:
+                return tuple(current["respuesta"])
+        raise IdempotencyInProgress("Hay una solicitud con la misma clave de idempotencia en proceso")
+
+    def _entries_on_disk(self):
+        entries = []
+        for filename in os.listdir(self.directory):
+            if filename.endswith(".json"):
+                path = os.path.join(self.directory, filename)
+                entry = self._read(path)
+                if entry is not None:
+                    entries.append((path, entry))
+        return entries
+
+    def purge(self):
+        """Eliminar las claves vencidas y, si sobran, las respuestas más antiguas.
+        Los archivos se leen sin el bloqueo; cada uno se vuelve a comprobar bajo el bloqueo antes
+        de borrarlo, de a PURGE_SLICE por vez."""
+        now = time.time()
+        entries = self._entries_on_disk()
+        expired = [(path, entry) for path, entry in entries if self._expired(entry, now)]
+        completed = sorted(((entry["expira"], path, entry) for path, entry in entries
+                            if entry.get("respuesta") is not None and not self._expired(entry, now)),
+                           key=lambda item: item[:2])
+        excess = max(0, len(entries) - len(expired) - self.max_keys)
+        candidates = expired + [(path, entry) for _, path, entry in completed[:excess]]
+
+        removed = 0
+        for start in range(0, len(candidates), PURGE_SLICE):
+            with self._file_lock():
+                for path, entry in candidates[start:start + PURGE_SLICE]:
+                    current = self._read(path)
+                    # Otra solicitud pudo reclamar la clave de nuevo mientras tanto
+                    if current is None or current.get("token") != entry.get("token"):
+                        continue
+                    if current.get("respuesta") is None and not self._expired(current, time.time()):
+                        continue
+                    os.remove(path)
+                    removed += 1
+        with self._lock:
+            self._stats["descartadas"] += removed
+        return removed
+
+    def _purge_periodically(self):
+        while not self._stop.wait(self.purge_interval):
+            try:
+                self.purge()
+            except Exception as e:
+                print(f"Error purgando claves de idempotencia: {str(e)}")
+
+    def start(self):
+        """Iniciar la purga periódica en segundo plano (idempotente)"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._purge_periodically, name="idempotency-purge", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        entries = [entry for _, entry in self._entries_on_disk()]
+        with self._lock:
+            return {
+                "directorio": self.directory,
+                "claves": len(entries),
+                "en_proceso": sum(1 for entry in entries if entry.get("respuesta") is None),
+                "ttl_s": self.ttl,
+                "max_claves": self.max_keys,
+                **self._stats,
+            }
@@ -0,0 +1,79 @@
+import os
+import re
+
+# Fin de oración: puntuación final seguida de espacios, o saltos de línea
+SENTENCE_END_RE = re.compile(r'(?<=[.!?…])\s+|\n\s*')
+
+# Comentarios más largos que el umbral se categorizan por grupos de oraciones en paralelo
+LONG_TEXT_THRESHOLD = int(os.getenv("LONG_TEXT_THRESHOLD", "800"))
+LONG_TEXT_CHUNK_CHARS = int(os.getenv("LONG_TEXT_CHUNK_CHARS", "400"))
+
+# Regla de prioridad de categorías: Queja > Vida universitaria > Sugerencia > Opinion
+CATEGORY_PRIORITY = ["Queja", "Vida universitaria", "Sugerencia", "Opinion"]
+
+
+def split_sentences(text):
+    """Dividir en oraciones conservando el espacio que sigue a cada una ("".join(...) == text)"""
+    sentences = []
+    start = 0
+    for match in SENTENCE_END_RE.finditer(text):
+        sentences.append(text[start:match.end()])
+        start = match.end()
+    if start < len(text):
+        sentences.append(text[start:])
+    return sentences
+
+
+def split_into_chunks(text, max_chars):
+    """Agrupar oraciones consecutivas en fragmentos de hasta `max_chars` caracteres"""
+    chunks = []
+    current = ""
+    for sentence in split_sentences(text):
+        if current and len(current) + len(sentence) > max_chars:
+            chunks.append(current)
+            current = ""
+        current += sentence
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def merge_categories(categories):
+    """Combinar las categorías de los fragmentos con la regla de prioridad"""
+    for category in CATEGORY_PRIORITY:
+        if category in categories:
+            return category
+    return categories[0] if categories else CATEGORY_PRIORITY[-1]
+
+
+def _replace_content(chunk, replacement):
+    # Conservar el espacio original entre fragmentos
+    trailing = chunk[len(chunk.rstrip()):]
+    return replacement.strip() + trailing
+
+
+def classify_long_comment(text, categorize, formalize, submit, max_chars):
+    """Categorizar un comentario largo por fragmentos en paralelo y formalizar solo los ofensivos.
+
+    `submit(func, *args)` debe devolver un Future (p. ej. el pool del LLM de la API).
+    Devuelve (categoria, comentario_formalizado o None)."""
+    chunks = split_into_chunks(text, max_chars)
+    if len(chunks) == 1:
+        categoria = categorize(text)
+        return categoria, formalize(text) if categoria == "Queja" else None
+
+    category_futures = [submit(categorize, chunk.strip()) for chunk in chunks]
+    categories = [future.result() for future in category_futures]
+    categoria = merge_categories(categories)
+
+    offending = [index for index, category in enumerate(categories) if category == "Queja"]
+    if not offending:
+        return categoria, None
+
+    # El costo de reescritura es proporcional al contenido ofensivo, no al largo total
+    formalize_futures = {index: submit(formalize, chunks[index].strip()) for index in offending}
+    rewritten = list(chunks)
+    for index, future in formalize_futures.items():
+        rewritten[index] = _replace_content(chunks[index], future.result())
+
+    return categoria, "".join(rewritten).strip()
@@ -0,0 +1,282 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from datetime import datetime
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: solo se serializa dentro del proceso
+    fcntl = None
+
+# Prefijos de dominio para que una hoja nunca pueda hacerse pasar por un nodo interno
+LEAF_PREFIX = b"\x00"
+NODE_PREFIX = b"\x01"
+
+BATCH_MAX_SIZE = int(os.getenv("MERKLE_BATCH_MAX_SIZE", "256"))
+BATCH_MAX_WAIT = float(os.getenv("MERKLE_BATCH_MAX_WAIT", "60"))
+
+# Contenido anclado de un análisis: el texto (también con los nombres de campo antiguos), su
+# resultado y su versión. La procedencia y los campos operativos (pendiente_llm, completado,
+# degraded...) pueden cambiar después de sellar sin invalidar la prueba; un resultado nuevo
+# se guarda como otra versión (`reemplaza`) con su propia hoja.
+ANCHORED_FIELDS = ("id", "timestamp", "comentario", "comentario_original", "comentario_final",
+                   "comentario_formalizado", "categoria", "tags", "version", "reemplaza")
+
+
+def canonical_record(record):
+    """Serialización canónica: claves ordenadas, sin espacios, UTF-8"""
+    return json.dumps(record, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def anchored_content(record):
+    """Proyección del análisis que cubre la hoja (solo los campos de ANCHORED_FIELDS presentes)"""
+    return {field: record[field] for field in ANCHORED_FIELDS if field in record}
+
+
+def leaf_hash(record):
+    return hashlib.sha256(LEAF_PREFIX + canonical_record(anchored_content(record))).hexdigest()
+
+
+def _node_hash(left, right):
+    return hashlib.sha256(NODE_PREFIX + bytes.fromhex(left) + bytes.fromhex(right)).hexdigest()
+
+
+def build_levels(leaves):
+    """Niveles del árbol desde las hojas hasta la raíz; un nodo impar sube sin duplicarse"""
+    levels = [list(leaves)]
+    while len(levels[-1]) > 1:
+        current = levels[-1]
+        parents = [_node_hash(current[i], current[i + 1]) for i in range(0, len(current) - 1, 2)]
+        if len(current) % 2:
+            parents.append(current[-1])
+        levels.append(parents)
+    return levels
+
+
+def merkle_root(leaves):
+    return build_levels(leaves)[-1][0] if leaves else None
+
+
+def inclusion_proof(leaves, index):
+    """Hermanos desde la hoja hasta la raíz: [{"lado": "izquierda"|"derecha", "hash": ...}]"""
+    proof = []
+    for level in build_levels(leaves)[:-1]:
+        sibling = index ^ 1
+        if sibling < len(level):
+            proof.append({"lado": "izquierda" if sibling < index else "derecha", "hash": level[sibling]})
+        index //= 2
+    return proof
+
+
+def verify_proof(leaf, proof, root):
+    """Verificar localmente que `leaf` pertenece al árbol con raíz `root`"""
+    current = leaf
+    for step in proof:
+        if step["lado"] == "izquierda":
+            current = _node_hash(step["hash"], current)
+        else:
+            current = _node_hash(current, step["hash"])
+    return current == root
+
+
+class MerkleBatcher:
+    """Agrupa análisis validados por tamaño o tiempo y sella cada lote con una raíz de Merkle.
+
+    Cada lote sellado se guarda como JSON en `directory` con sus hojas (id y hash) y los campos
+    que cubren, de modo que las pruebas de inclusión se pueden recalcular después de reiniciar.
+    Con `store`, cada `max_wait` segundos se leen los segmentos del historial que cambiaron
+    (`changes_since`), así también se anclan los análisis que escriben otros procesos (panel,
+    backfill, versiones nuevas de relabel.py). Cada lote guarda la secuencia ya leída
+    (`seq`) y al reiniciar se sigue desde la del último lote.
+
+    Varios procesos (workers de la API) pueden compartir `directory`: el sellado toma un bloqueo
+    de archivo, relee los lotes que sellaron los demás, descarta los análisis que ya anclaron y
+    numera el lote después del último en disco. Las pruebas y los lotes se consultan también
+    sobre lo que está en disco."""
+
+    def __init__(self, directory, max_size=BATCH_MAX_SIZE, max_wait=BATCH_MAX_WAIT, store=None):
+        self.directory = directory
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self.store = store
+        # Todo lo escrito hasta esta secuencia ya está en un lote (abierto o sellado);
+        # -1 mientras no se ha leído el historial completo (segmentos sin `seq`)
+        self._synced_seq = -1
+        self._synced_at = None
+        self._sync_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._pending = []  # (id, hash) del lote abierto
+        self._pending_ids = set()
+        self._opened_at = None
+        self._batches = {}  # id de lote -> lote sellado
+        self._locations = {}  # id de análisis -> (id de lote, posición)
+        self._loaded = set()  # archivos de lote ya indexados
+        self._seal_lock_path = os.path.join(directory, "sellado.lock")
+        self._stop = threading.Event()
+        self._thread = None
+
+        os.makedirs(directory, exist_ok=True)
+        self._refresh()
+
+    @contextmanager
+    def _file_lock(self):
+        """Bloqueo entre procesos del sellado (dentro del proceso ya se tiene `self._lock`)"""
+        if fcntl is None:
+            yield
+            return
+        with open(self._seal_lock_path, "a") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _refresh(self):
+        """Indexar los lotes sellados en disco que todavía no se conocen (también de otros procesos)"""
+        for filename in sorted(os.listdir(self.directory)):
+            if filename in self._loaded or not (filename.startswith("lote-") and filename.endswith(".json")):
+                continue
+            with open(os.path.join(self.directory, filename), "r", encoding="utf-8") as file:
+                batch = json.load(file)
+            self._loaded.add(filename)
+            self._index_batch(batch)
+        if self._pending_ids & self._locations.keys():
+            # Otro proceso ya selló estos análisis
+            self._pending = [(record_id, leaf) for record_id, leaf in self._pending
+                             if record_id not in self._locations]
+            self._pending_ids = {record_id for record_id, _ in self._pending}
+            if not self._pending:
+                self._opened_at = None
+
+    def _index_batch(self, batch):
+        self._batches[batch["id"]] = batch
+        # Lo que vio quien selló el lote ya está en este lote o en uno anterior
+        self._synced_seq = max(self._synced_seq, batch.get("seq", -1))
+        for position, leaf in enumerate(batch["hojas"]):
+            self._locations[leaf["id"]] = (batch["id"], position)
+
+    def add(self, records):
+        """Agregar análisis ya persistidos al lote abierto; sella si se alcanza el tamaño máximo.
+        Los análisis degradados que esperan al LLM se agregan cuando llega su versión final."""
+        with self._lock:
+            for record in records:
+                # Un id se ancla una sola vez: repetido en el lote, ya en el lote abierto o ya sellado
+                if (record.get("id") in self._locations or record.get("id") in self._pending_ids
+                        or record.get("pendiente_llm")):
+                    continue
+                if not self._pending:
+                    self._opened_at = time.monotonic()
+                self._pending.append((record["id"], leaf_hash(record)))
+                self._pending_ids.add(record["id"])
+                if len(self._pending) >= self.max_size:
+                    self._seal()
+
+    def _seal(self):
+        if not self._pending:
+            return None
+        with self._file_lock():
+            self._refresh()
+            if not self._pending:
+                return None
+            leaves = [leaf for _, leaf in self._pending]
+            batch = {
+                "id": max(self._batches, default=0) + 1,
+                "raiz": merkle_root(leaves),
+                "sellado": datetime.now().isoformat(),
+                "cantidad": len(leaves),
+                "campos": list(ANCHORED_FIELDS),
+                "seq": self._synced_seq,
+                "hojas": [{"id": record_id, "hash": leaf} for record_id, leaf in self._pending],
+            }
+            filename = f"lote-{batch['id']:06d}.json"
+            path = os.path.join(self.directory, filename)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                json.dump(batch, file, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, path)
+            self._loaded.add(filename)
+
+        self._index_batch(batch)
+        self._pending = []
+        self._pending_ids = set()
+        self._opened_at = None
+        return batch
+
+    def sync(self):
+        """Agregar lo que cambió en el historial desde la última lectura (también de otros procesos)"""
+        if self.store is None:
+            return
+        with self._sync_lock:
+            records, seq = self.store.changes_since(self._synced_seq)
+            self.add(records)
+            with self._lock:
+                self._synced_seq = max(self._synced_seq, seq)
+                self._synced_at = time.monotonic()
+
+    def seal(self):
+        """Sellar el lote abierto aunque no se haya llenado"""
+        with self._lock:
+            return self._seal()
+
+    def get_batch(self, batch_id):
+        with self._lock:
+            self._refresh()
+            return self._batches.get(batch_id)
+
+    def recent_batches(self, count=20):
+        with self._lock:
+            self._refresh()
+        batches = sorted(self._batches.values(), key=lambda batch: batch["id"], reverse=True)[:count]
+        return [{key: batch[key] for key in ("id", "raiz", "sellado", "cantidad")} for batch in batches]
+
+    def proof(self, record_id):
+        """Prueba de inclusión de un análisis; None si todavía está en el lote abierto o no existe"""
+        with self._lock:
+            location = self._locations.get(record_id)
+            if location is None:
+                # Puede haberlo sellado otro proceso
+                self._refresh()
+                location = self._locations.get(record_id)
+            if location is None:
+                return None
+            batch_id, position = location
+            batch = self._batches[batch_id]
+        leaves = [leaf["hash"] for leaf in batch["hojas"]]
+        return {
+            "lote": batch_id,
+            "raiz": batch["raiz"],
+            "hoja": leaves[position],
+            "posicion": position,
+            "prueba": inclusion_proof(leaves, position),
+        }
+
+    def is_pending(self, record_id):
+        with self._lock:
+            return record_id in self._pending_ids
+
+    def _watch(self):
+        while not self._stop.wait(min(1.0, self.max_wait)):
+            if self.store is not None and time.monotonic() - self._synced_at >= self.max_wait:
+                try:
+                    self.sync()
+                except Exception as e:
+                    print(f"Error leyendo el historial para los lotes de Merkle: {str(e)}")
+            with self._lock:
+                if self._pending and time.monotonic() - self._opened_at >= self.max_wait:
+                    self._seal()
+
+    def start(self):
+        """Iniciar el sellado por tiempo en segundo plano (idempotente)"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self.sync()
+            self._thread = threading.Thread(target=self._watch, name="merkle-batcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self.seal()
@@ -0,0 +1,326 @@
+"""Modelo de lenguaje de n-gramas de caracteres para detectar texto sin forma de español.
+
+El texto se normaliza a un alfabeto de 30 símbolos (letras sin acentos, espacio, dígito,
+otro símbolo y borde) y se puntúa con una tabla densa de log-probabilidades de trigramas
+(interpolación de Witten-Bell con bigramas y unigramas) guardada en un `array` de float32:
+puntuar un comentario es una consulta por carácter, del orden de microsegundos.
+
+Uso:
+    python ngram_lm.py entrenar                  # corpus incluido + historial -> modelo_ngram.bin
+    python ngram_lm.py calibrar --rechazo 0.01   # tasas de falso rechazo y de detección por umbral
+    python ngram_lm.py puntuar "asdkj de qwpeoir"
+"""
+import os
+import re
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import threading
+from array import array
+
+from heuristics import strip_accents
+
+NGRAM_ORDER = 3
+# "^" marca el borde del texto, "0" cualquier dígito y "#" cualquier otro símbolo
+ALPHABET = "^ abcdefghijklmnopqrstuvwxyz0#"
+CODE_TABLE = str.maketrans({char: chr(code) for code, char in enumerate(ALPHABET)})
+
+CORPUS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus_es.txt")
+NGRAM_MODEL_FILE = os.getenv("NGRAM_MODEL_FILE", "modelo_ngram.bin")
+# Umbral de perplejidad por carácter (calibrado con `python ngram_lm.py calibrar`)
+NGRAM_MAX_PERPLEXITY = float(os.getenv("NGRAM_MAX_PERPLEXITY", "24"))
+# Con menos letras la perplejidad no es confiable y no se usa para rechazar
+NGRAM_MIN_LETTERS = 10
+# Peso de la distribución uniforme en la mezcla final: con un corpus chico, una transición no vista
+# en español real (p. ej. "az" en "azul") no debe costar tanto como el tecleo al azar
+UNIFORM_WEIGHT = 0.05
+
+MAGIC = b"NGRAMES1"
+
+WHITESPACE_RE = re.compile(r"\s+")
+DIGIT_RE = re.compile(r"[0-9]")
+OTHER_RE = re.compile(r"[^a-z0 ]")
+
+
+def normalize(text):
+    """Texto en el alfabeto del modelo: minúsculas sin acentos, espacios simples, dígitos y símbolos agrupados"""
+    text = WHITESPACE_RE.sub(" ", strip_accents(text.lower())).strip()
+    return OTHER_RE.sub("#", DIGIT_RE.sub("0", text))
+
+
+def encode(text, order=NGRAM_ORDER):
+    """Códigos (bytes) del texto normalizado precedido de order-1 bordes"""
+    return ("^" * (order - 1) + normalize(text)).translate(CODE_TABLE).encode("latin-1")
+
+
+def letter_count(text):
+    return sum(char.isalpha() for char in text)
+
+
+class CharNgramModel:
+    """Tabla densa de log P(c | contexto) para todos los n-gramas del alfabeto (len(ALPHABET) ** order)"""
+
+    def __init__(self, table, order=NGRAM_ORDER, trained_chars=0):
+        self.order = order
+        self.size = len(ALPHABET)
+        if len(table) != self.size ** order:
+            raise ValueError(f"La tabla debe tener {self.size ** order} entradas")
+        self.table = table
+        self.trained_chars = trained_chars
+
+    @classmethod
+    def train(cls, texts, order=NGRAM_ORDER):
+        """Contar n-gramas de orden 1..order, interpolar con Witten-Bell desde unigramas con suavizado
+        de Laplace y mezclar con la distribución uniforme (UNIFORM_WEIGHT)"""
+        size = len(ALPHABET)
+        counts = [array("I", bytes(4 * size ** k)) for k in range(1, order + 1)]
+        trained_chars = 0
+        for text in texts:
+            codes = encode(text, order)
+            for position in range(order - 1, len(codes)):
+                trained_chars += 1
+                index = 0
+                for k in range(1, order + 1):
+                    # n-grama de longitud k que termina en `position`
+                    index += codes[position - k + 1] * size ** (k - 1)
+                    counts[k - 1][index] += 1
+
+        total = sum(counts[0])
+        probabilities = [(count + 1) / (total + size) for count in counts[0]]
+        for k in range(2, order + 1):
+            level = counts[k - 1]
+            next_probabilities = []
+            for context in range(size ** (k - 1)):
+                # Índice = contexto (más antiguo primero) en base `size`, luego el carácter
+                row = level[context * size:(context + 1) * size]
+                seen = sum(row)
+                types = sum(1 for count in row if count)
+                # Distribución de orden menor: el mismo contexto sin su carácter más antiguo
+                start = (context % size ** (k - 2)) * size
+                lower = probabilities[start:start + size]
+                if not seen:
+                    next_probabilities.extend(lower)
+                    continue
+                next_probabilities.extend((count + types * p) / (seen + types) for count, p in zip(row, lower))
+            probabilities = next_probabilities
+        uniform = UNIFORM_WEIGHT / size
+        return cls(array("f", (math.log((1 - UNIFORM_WEIGHT) * p + uniform) for p in probabilities)),
+                   order, trained_chars)
+
+    def log_prob(self, text):
+        """Log-probabilidad promedio por carácter"""
+        codes = encode(text, self.order)
+        table = self.table
+        size = self.size
+        modulus = size ** (self.order - 1)
+        index = 0
+        total = 0.0
+        for position, code in enumerate(codes):
+            index = (index % modulus) * size + code
+            if position >= self.order - 1:
+                total += table[index]
+        return total / max(1, len(codes) - self.order + 1)
+
+    def perplexity(self, text):
+        return math.exp(-self.log_prob(text))
+
+    def is_gibberish(self, text, max_perplexity=NGRAM_MAX_PERPLEXITY):
+        """True si el texto tiene suficientes letras y su perplejidad supera el umbral"""
+        return letter_count(text) >= NGRAM_MIN_LETTERS and self.perplexity(text) > max_perplexity
+
+    def save(self, path):
+        header = json.dumps({"orden": self.order, "alfabeto": ALPHABET, "caracteres": self.trained_chars,
+                             "byteorder": sys.byteorder}).encode("utf-8")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(MAGIC + len(header).to_bytes(4, "little") + header)
+            self.table.tofile(file)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} no es un modelo de n-gramas")
+            header = json.loads(file.read(int.from_bytes(file.read(4), "little")))
+            if header["alfabeto"] != ALPHABET:
+                raise ValueError(f"{path} usa otro alfabeto; vuelve a entrenarlo")
+            table = array("f")
+            table.frombytes(file.read())
+        if header["byteorder"] != sys.byteorder:
+            table.byteswap()
+        return cls(table, header["orden"], header["caracteres"])
+
+
+def read_corpus(path=CORPUS_FILE):
+    with open(path, "r", encoding="utf-8") as file:
+        return [line.strip() for line in file if line.strip() and not line.startswith("#")]
+
+
+_default_model = None
+_default_lock = threading.Lock()
+
+
+def default_model():
+    """Modelo entrenado (NGRAM_MODEL_FILE) o, si no existe, uno entrenado al vuelo con el corpus incluido"""
+    global _default_model
+    with _default_lock:
+        if _default_model is None:
+            if os.path.exists(NGRAM_MODEL_FILE):
+                _default_model = CharNgramModel.load(NGRAM_MODEL_FILE)
+            else:
+                _default_model = CharNgramModel.train(read_corpus())
+        return _default_model
+
+
+# Entrenamiento y calibración
+
+def history_texts(history_dir, legacy_file):
+    """Comentarios guardados (coherentes) del historial segmentado y del archivo JSON anterior"""
+    from backfill import TEXT_FIELDS, pick_field
+    from history_store import SegmentedHistory, load_analysis_history
+
+    records = load_analysis_history(legacy_file) if legacy_file and os.path.exists(legacy_file) else []
+    if os.path.exists(os.path.join(history_dir, "manifest.json")):
+        records += SegmentedHistory(history_dir).read_range()
+    texts = {(pick_field(record, TEXT_FIELDS) or "").strip() for record in records
+             if record.get("is_coherent", True) and not record.get("degraded")}
+    return sorted(text for text in texts if text)
+
+
+KEYBOARD_ROWS = ("qwertyuiop", "asdfghjkl", "zxcvbnm")
+FUNCTION_WORDS = ("de", "la", "el", "que", "en", "y", "los", "es")
+
+
+def gibberish_samples(count, seed=7):
+    """Tecleo al azar (trozos de filas del teclado y letras sueltas) con palabras funcionales intercaladas,
+    como el que hoy pasa la regla de estructura mínima"""
+    rng = random.Random(seed)
+    samples = []
+    for _ in range(count):
+        words = []
+        for _ in range(rng.randint(2, 6)):
+            if rng.random() < 0.5:
+                row = rng.choice(KEYBOARD_ROWS)
+                start = rng.randrange(len(row) - 2)
+                word = "".join(rng.choice(row[start:start + 4]) for _ in range(rng.randint(3, 9)))
+            else:
+                word = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 9)))
+            words.append(word)
+            if rng.random() < 0.5:
+                words.append(rng.choice(FUNCTION_WORDS))
+        samples.append(" ".join(words))
+    return samples
+
+
+def cross_validated_perplexities(texts, folds):
+    """Perplejidad de cada texto con un modelo entrenado sin él (validación cruzada por bloques)"""
+    rng = random.Random(3)
+    shuffled = texts[:]
+    rng.shuffle(shuffled)
+    scored = []
+    for fold in range(folds):
+        held_out = shuffled[fold::folds]
+        training = [text for position, text in enumerate(shuffled) if position % folds != fold]
+        model = CharNgramModel.train(training)
+        scored.extend((text, model.perplexity(text)) for text in held_out)
+    return scored
+
+
+def calibrate(args):
+    from coherence import CoherenceValidator
+
+    texts = read_corpus() + history_texts(args.historial, args.legacy)
+    rules_only = CoherenceValidator(language_model=None)
+    # Un falso rechazo es un texto real que pasa las reglas y el modelo rechaza
+    scored = [(text, perplexity) for text, perplexity in cross_validated_perplexities(texts, args.folds)
+              if letter_count(text) >= NGRAM_MIN_LETTERS and rules_only.validate(text)]
+    model = CharNgramModel.train(texts)
+    gibberish = [text for text in gibberish_samples(args.muestras) if rules_only.validate(text)]
+    gibberish_scores = [model.perplexity(text) for text in gibberish]
+
+    real = sorted(perplexity for _, perplexity in scored)
+    print(f"Textos reales (validación cruzada, {args.folds} bloques): {len(real)}; "
+          f"tecleo al azar que pasa las reglas actuales: {len(gibberish)}")
+    print(f"  {'umbral':>7} {'falso rechazo':>14} {'detección':>10}")
+    candidates = sorted({round(value) for value in (12, 16, 20, 24, 28, 32, 40)} | {round(args.umbral)})
+    for threshold in candidates:
+        false_reject = sum(value > threshold for value in real) / len(real)
+        detected = sum(value > threshold for value in gibberish_scores) / max(1, len(gibberish_scores))
+        marker = "  <- actual" if threshold == round(args.umbral) else ""
+        print(f"  {threshold:>7} {false_reject:>14.2%} {detected:>10.2%}{marker}")
+
+    # Menor umbral cuyo falso rechazo no supera el objetivo
+    allowed = int(len(real) * args.rechazo)
+    recommended = real[len(real) - 1 - allowed] if allowed < len(real) else real[0]
+    detected = sum(value > recommended for value in gibberish_scores) / max(1, len(gibberish_scores))
+    print(f"Umbral mínimo para un falso rechazo <= {args.rechazo:.1%}: {math.ceil(recommended)} "
+          f"(detección {detected:.1%}); con pocos textos reales conviene dejar margen por encima")
+    worst = sorted(scored, key=lambda item: item[1], reverse=True)[:5]
+    print("Textos reales con mayor perplejidad:")
+    for text, perplexity in worst:
+        print(f"  {perplexity:6.1f}  {text[:80]}")
+
+    start = time.perf_counter()
+    for text in texts:
+        model.perplexity(text)
+    elapsed = time.perf_counter() - start
+    print(f"Puntuación: {elapsed / len(texts) * 1e6:.1f} µs por texto "
+          f"({sum(len(text) for text in texts) / len(texts):.0f} caracteres en promedio)")
+    return 0
+
+
+def train(args):
+    corpus = read_corpus()
+    stored = history_texts(args.historial, args.legacy)
+    model = CharNgramModel.train(corpus + stored)
+    model.save(args.salida)
+    print(f"Modelo guardado en {args.salida}: {len(corpus)} oraciones del corpus + {len(stored)} comentarios "
+          f"guardados ({model.trained_chars} caracteres, {len(model.table) * 4 // 1024} KiB)")
+    return 0
+
+
+def score(args):
+    model = default_model()
+    for text in args.textos:
+        start = time.perf_counter()
+        perplexity = model.perplexity(text)
+        elapsed = time.perf_counter() - start
+        verdict = "rechazado" if model.is_gibberish(text, args.umbral) else "aceptado"
+        print(f"{perplexity:7.1f}  {verdict:<10} {elapsed * 1e6:6.1f} µs  {text}")
+    return 0
+
+
+def main():
+    from history_store import COMMENTS_HISTORY_FILE, DEFAULT_HISTORY_DIR
+
+    parser = argparse.ArgumentParser(description="Modelo de n-gramas de caracteres para la validación de coherencia")
+    parser.add_argument("--historial", default=os.path.join(DEFAULT_HISTORY_DIR, "comentarios"),
+                        help="Historial segmentado con comentarios guardados")
+    parser.add_argument("--legacy", default=COMMENTS_HISTORY_FILE, help="Archivo JSON de historial anterior")
+    parser.add_argument("--umbral", type=float, default=NGRAM_MAX_PERPLEXITY, help="Umbral de perplejidad")
+    commands = parser.add_subparsers(dest="comando", required=True)
+
+    train_parser = commands.add_parser("entrenar", help="Entrenar con el corpus incluido y los comentarios guardados")
+    train_parser.add_argument("--salida", default=NGRAM_MODEL_FILE, help="Archivo del modelo")
+    train_parser.set_defaults(func=train)
+
+    calibrate_parser = commands.add_parser("calibrar", help="Reportar falso rechazo y detección por umbral")
+    calibrate_parser.add_argument("--folds", type=int, default=5, help="Bloques de validación cruzada")
+    calibrate_parser.add_argument("--muestras", type=int, default=2000, help="Textos de tecleo al azar")
+    calibrate_parser.add_argument("--rechazo", type=float, default=0.01, help="Falso rechazo objetivo")
+    calibrate_parser.set_defaults(func=calibrate)
+
+    score_parser = commands.add_parser("puntuar", help="Perplejidad de uno o más textos")
+    score_parser.add_argument("textos", nargs="+")
+    score_parser.set_defaults(func=score)
+
+    args = parser.parse_args()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
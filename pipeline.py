@@ -0,0 +1,248 @@
+"""Pipeline de análisis con el LLM: modelo, prompts y funciones de clasificación de comentarios y títulos.
+
+Lo comparten api.py y los scripts (backfill.py, relabel.py, evaluate.py). Importarlo no tiene
+efectos: el modelo y el registro de prompts se crean en el primer uso, así un script no levanta
+la aplicación Flask, sus pools ni los escritores de los tenants sobre el mismo historial.
+"""
+import os
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+from coherence import is_coherent_text
+from deadlines import DeadlineExceeded
+from heuristics import OFFENSIVE_THRESHOLD, offensive_risk_score, local_category, mask_offensive
+from long_text import LONG_TEXT_THRESHOLD, LONG_TEXT_CHUNK_CHARS, classify_long_comment
+from prompts import PromptRegistry, DEFAULT_CATEGORY, parse_category, clean_formalized, strip_quotes
+
+GROQ_MODEL = os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile")
+# Timeout HTTP de las llamadas sin plazo (scripts o REQUEST_DEADLINE_MS=0) y reintentos del cliente de Groq;
+# con plazo, cada intento usa como timeout lo que le queda (ver PromptRegistry.stream), así que una llamada
+# sin respuesta termina a más tardar en (LLM_MAX_RETRIES + 1) veces el plazo
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "1"))
+
+# Política de corrección especulativa de títulos: "siempre", "riesgo" (según el puntaje local) o "nunca"
+TITLE_SPECULATION = os.getenv("TITLE_SPECULATION", "riesgo").lower()
+TITLE_SPECULATION_THRESHOLD = float(os.getenv("TITLE_SPECULATION_THRESHOLD", "0.3"))
+
+# Pool compartido para llamadas al LLM que corren en paralelo dentro de un análisis (los hilos se crean al usarlo)
+llm_executor = ThreadPoolExecutor(max_workers=int(os.getenv("LLM_WORKERS", "16")), thread_name_prefix="llm")
+
+# En el reetiquetado los errores del LLM se propagan: un valor por defecto no debe quedar como resultado vigente
+propagate_llm_errors = contextvars.ContextVar("propagate_llm_errors", default=False)
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+class MissingAPIKey(RuntimeError):
+    """No está configurada GROQ_API_KEY"""
+
+
+def create_model():
+    """Cliente de Groq con la clave de GROQ_API_KEY (también desde .env)"""
+    from langchain_groq import ChatGroq
+
+    load_dotenv()
+    groq_api_key = os.getenv("GROQ_API_KEY")
+    if not groq_api_key:
+        raise MissingAPIKey("No se encontró la clave API de Groq. Asegúrate de configurar GROQ_API_KEY en tu archivo .env")
+    return ChatGroq(groq_api_key=groq_api_key, model=GROQ_MODEL, timeout=LLM_TIMEOUT_SECONDS,
+                    max_retries=LLM_MAX_RETRIES)
+
+
+def get_prompt_registry():
+    """Registro de prompts del pipeline; el modelo se crea en la primera llamada"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = PromptRegistry(create_model())
+    return _registry
+
+
+def set_prompt_registry(registry):
+    """Usar otro registro (p. ej. con un modelo simulado en los benchmarks)"""
+    global _registry
+    with _registry_lock:
+        _registry = registry
+    return registry
+
+
+def submit_llm_task(func, *args):
+    """Ejecutar una tarea del LLM en el pool conservando el contexto (endpoint y plazo) de quien la lanza"""
+    context = contextvars.copy_context()
+    return llm_executor.submit(context.run, func, *args)
+
+
+def categorize_comment(comment):
+    """Categorizar el comentario usando LLM"""
+    try:
+        response = get_prompt_registry().run("categorizar_comentario", {"comment": comment})
+        return parse_category(response)
+
+    except (DeadlineExceeded, MissingAPIKey):
+        raise
+    except Exception as e:
+        if propagate_llm_errors.get():
+            raise
+        print(f"Error categorizando comentario: {str(e)}")
+        return DEFAULT_CATEGORY
+
+
+def formalize_hate_speech(comment):
+    """Convertir comentario ofensivo a lenguaje formal y apropiado"""
+    try:
+        response = get_prompt_registry().run("formalizar_comentario", {"comment": comment})
+        return clean_formalized(response)
+
+    except (DeadlineExceeded, MissingAPIKey):
+        raise
+    except Exception as e:
+        if propagate_llm_errors.get():
+            raise
+        print(f"Error formalizando comentario: {str(e)}")
+        return "Comentario modificado por contener contenido inapropiado."
+
+
+def classify_comment(comment):
+    """Categorizar el comentario y formalizarlo si es Queja; los comentarios largos se procesan por fragmentos"""
+    if len(comment) > LONG_TEXT_THRESHOLD:
+        return classify_long_comment(comment, categorize_comment, formalize_hate_speech,
+                                     submit_llm_task, LONG_TEXT_CHUNK_CHARS)
+
+    categoria = categorize_comment(comment)
+    comentario_formalizado = formalize_hate_speech(comment) if categoria == "Queja" else None
+    return categoria, comentario_formalizado
+
+
+def detect_offensive_title(title):
+    """Clasificar el título como OFENSIVO o APROPIADO usando LLM"""
+    try:
+        response = get_prompt_registry().run("detectar_titulo_ofensivo", {"title": title})
+
+        return "OFENSIVO" in response.strip().upper()
+
+    except (DeadlineExceeded, MissingAPIKey):
+        raise
+    except Exception as e:
+        if propagate_llm_errors.get():
+            raise
+        print(f"Error detectando contenido ofensivo: {str(e)}")
+        return False
+
+
+def generate_title_fix(title, cancel_event=None):
+    """Generar una versión apropiada de un título ofensivo usando LLM"""
+    try:
+        response = get_prompt_registry().run("corregir_titulo", {"title": title}, cancel_event=cancel_event)
+
+        # Limpiar comillas si las tiene
+        return strip_quotes(response)
+
+    except (DeadlineExceeded, MissingAPIKey):
+        raise
+    except Exception as e:
+        if propagate_llm_errors.get():
+            raise
+        print(f"Error generando título corregido: {str(e)}")
+        return "Título modificado por contener contenido inapropiado"
+
+
+def local_comment_analysis(comment):
+    """Categoría y formalización locales (sin LLM) para cuando se agota el plazo"""
+    categoria = local_category(comment)
+    return categoria, mask_offensive(comment) if categoria == "Queja" else None
+
+
+def local_title_analysis(title):
+    """Análisis local del título (sin LLM) para cuando se agota el plazo"""
+    is_offensive = offensive_risk_score(title) >= OFFENSIVE_THRESHOLD
+    return {
+        "is_coherent": True,
+        "is_offensive": is_offensive,
+        "recommendation": "Análisis local: el servicio de IA no respondió a tiempo",
+        "titulo_sugerido": mask_offensive(title) if is_offensive else None,
+        "status": "apropiado" if not is_offensive else "requiere_revision"
+    }
+
+
+def comment_fields(result):
+    """Campos del registro que produce el análisis de un comentario con el LLM"""
+    categoria, comentario_formalizado = result
+    return {"categoria": categoria, "comentario_formalizado": comentario_formalizado}
+
+
+def title_fields(result):
+    """Campos del registro que produce el análisis de un título con el LLM"""
+    return {
+        "es_coherente": result["is_coherent"],
+        "es_ofensivo": result["is_offensive"],
+        "recomendacion": result["recommendation"],
+        "titulo_sugerido": result["titulo_sugerido"],
+        "estado": result["status"]
+    }
+
+
+def should_speculate_title_fix(title):
+    """Decidir si la corrección del título se lanza en paralelo con la detección"""
+    if TITLE_SPECULATION == "siempre":
+        return True
+    if TITLE_SPECULATION == "riesgo":
+        return offensive_risk_score(title) >= TITLE_SPECULATION_THRESHOLD
+    return False
+
+
+def analyze_title(title):
+    """Analizar título: verificar coherencia, detectar contenido ofensivo y dar recomendación"""
+
+    # 1. Verificar coherencia básica del título; si no es coherente no se consulta al LLM
+    is_coherent = is_coherent_text(title)
+
+    if not is_coherent:
+        return {
+            "is_coherent": False,
+            "is_offensive": False,
+            "recommendation": "El título necesita ser más claro y comprensible.",
+            "titulo_sugerido": None,
+            "status": "requiere_revision"
+        }
+
+    # 2. Corrección especulativa: se genera junto con la detección para ahorrar un viaje al LLM
+    cancel_rewrite = threading.Event()
+    speculative_fix = None
+    if should_speculate_title_fix(title):
+        speculative_fix = submit_llm_task(generate_title_fix, title, cancel_rewrite)
+
+    # 3. Detectar si es ofensivo usando IA
+    is_offensive = False
+    try:
+        is_offensive = detect_offensive_title(title)
+    finally:
+        # Descartar la corrección especulativa si no se usa: título apropiado o la detección falló
+        # (p. ej. DeadlineExceeded o MissingAPIKey)
+        if speculative_fix and not is_offensive:
+            cancel_rewrite.set()
+            speculative_fix.cancel()
+
+    # 4. Generar recomendación automática basada en el análisis
+    if is_offensive:
+        # Si es ofensivo, usar la versión especulativa o generarla ahora
+        titulo_sugerido = speculative_fix.result() if speculative_fix else generate_title_fix(title)
+        recommendation = "Título corregido automáticamente"
+
+    else:
+        # Si es coherente y apropiado, dar validación positiva
+        recommendation = "Título apropiado y coherente"
+        titulo_sugerido = None
+
+    return {
+        "is_coherent": is_coherent,
+        "is_offensive": is_offensive,
+        "recommendation": recommendation,
+        "titulo_sugerido": titulo_sugerido,  # Nueva propiedad
+        "status": "apropiado" if not is_offensive else "requiere_revision"
+    }
@@ -0,0 +1,163 @@
+import os
+import io
+import time
+import hmac
+import uuid
+import pstats
+import random
+import cProfile
+import threading
+from collections import deque
+from datetime import datetime
+
+from flask import g, request
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "perfiles")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_RING_SIZE = int(os.getenv("PROFILE_RING_SIZE", "50"))
+PROFILE_HEADER = "X-Profile"
+PROFILE_TOKEN_HEADER = "X-Profile-Token"
+# El encabezado X-Profile solo se respeta con PROFILE_ALLOW_HEADER=1 o con el token de PROFILE_ADMIN_TOKEN:
+# perfilar cuesta CPU y disco, no debe poder pedirlo cualquier cliente
+PROFILE_ALLOW_HEADER = os.getenv("PROFILE_ALLOW_HEADER", "0") == "1"
+PROFILE_ADMIN_TOKEN = os.getenv("PROFILE_ADMIN_TOKEN", "")
+# El X-Request-Id del cliente solo se guarda como dato del perfil, recortado
+MAX_REQUEST_ID_CHARS = 128
+# Órdenes aceptados por pstats (cumulative, tottime, calls, ...)
+SORT_KEYS = frozenset(pstats.Stats.sort_arg_dict_default)
+
+# Rutas que entran en el muestreo aleatorio; con el encabezado se puede perfilar cualquier ruta
+SAMPLED_PATHS = ("/procesar", "/procesartitulos")
+TOP_FUNCTIONS = 15
+
+
+class RequestProfiler:
+    """Perfilado opcional por solicitud con cProfile.
+
+    Se activa por muestreo (`PROFILE_SAMPLE_RATE`) o con el encabezado `X-Profile: 1`, que
+    solo se respeta con `allow_header` o con el token de administración en `X-Profile-Token`.
+    Solo se perfila el hilo de la solicitud: el tiempo esperando al pool del LLM aparece
+    como espera en `Future.result`. Se perfila una solicitud a la vez (cProfile no admite
+    perfiladores simultáneos en versiones recientes de Python); las demás siguen sin perfilar.
+    Los archivos .prof se nombran con un id generado por el servidor (nunca con datos del
+    cliente) y solo se conservan los de los últimos `ring_size` perfiles."""
+
+    def __init__(self, directory=PROFILE_DIR, sample_rate=PROFILE_SAMPLE_RATE, ring_size=PROFILE_RING_SIZE,
+                 allow_header=PROFILE_ALLOW_HEADER, admin_token=PROFILE_ADMIN_TOKEN):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.allow_header = allow_header
+        self.admin_token = admin_token
+        self._ring = deque(maxlen=ring_size)
+        self._ring_lock = threading.Lock()
+        self._active = threading.Lock()
+
+    def init_app(self, app):
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        # El turno se libera al final de la solicitud aunque una excepción se salte after_request
+        app.teardown_request(self._release)
+        return self
+
+    def _header_allowed(self):
+        if self.allow_header:
+            return True
+        token = request.headers.get(PROFILE_TOKEN_HEADER, "")
+        return bool(self.admin_token) and hmac.compare_digest(token.encode("utf-8"), self.admin_token.encode("utf-8"))
+
+    def _wanted(self):
+        if request.headers.get(PROFILE_HEADER, "").lower() in ("1", "true", "si") and self._header_allowed():
+            return True
+        return self.sample_rate > 0 and request.path in SAMPLED_PATHS and random.random() < self.sample_rate
+
+    def _start(self):
+        if not self._wanted() or not self._active.acquire(blocking=False):
+            return
+        g.profile_id = uuid.uuid4().hex[:16]
+        g.profile_started = time.perf_counter()
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+    def _finish(self, response):
+        profiler = g.get("profiler")
+        if profiler is None:
+            return response
+        profiler.disable()
+
+        duration = time.perf_counter() - g.profile_started
+        try:
+            self._save(profiler, g.profile_id, duration, response.status_code)
+            response.headers["X-Profile-Id"] = g.profile_id
+        except Exception as e:
+            print(f"Error guardando perfil: {str(e)}")
+        return response
+
+    def _release(self, exception=None):
+        profiler = g.pop("profiler", None)
+        if profiler is None:
+            return
+        try:
+            profiler.disable()
+        finally:
+            self._active.release()
+
+    def _save(self, profiler, profile_id, duration, status_code):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{profile_id}.prof")
+        profiler.dump_stats(path)
+
+        entry = {
+            "id": profile_id,
+            "request_id": request.headers.get("X-Request-Id", "")[:MAX_REQUEST_ID_CHARS] or None,
+            "metodo": request.method,
+            "ruta": request.path,
+            "estado": status_code,
+            "duracion_s": round(duration, 4),
+            "timestamp": datetime.now().isoformat(),
+            "archivo": path,
+            "funciones": top_functions(pstats.Stats(profiler)),
+        }
+        with self._ring_lock:
+            # El anillo está lleno: el perfil más viejo sale y se borra su archivo
+            if len(self._ring) == self._ring.maxlen:
+                evicted = self._ring[0]
+                try:
+                    os.remove(evicted["archivo"])
+                except OSError:
+                    pass
+            self._ring.append(entry)
+
+    def recent(self):
+        with self._ring_lock:
+            return [{key: value for key, value in entry.items() if key != "funciones"}
+                    for entry in reversed(self._ring)]
+
+    def get(self, profile_id):
+        with self._ring_lock:
+            for entry in self._ring:
+                if entry["id"] == profile_id:
+                    return entry
+        return None
+
+    def report(self, profile_id, sort="cumulative", limit=40):
+        """Reporte de texto de pstats para un perfil del anillo"""
+        entry = self.get(profile_id)
+        if entry is None:
+            return None
+        output = io.StringIO()
+        pstats.Stats(entry["archivo"], stream=output).sort_stats(sort).print_stats(limit)
+        return output.getvalue()
+
+
+def top_functions(stats, limit=TOP_FUNCTIONS):
+    """Funciones con mayor tiempo acumulado: [{"funcion", "llamadas", "propio_s", "acumulado_s"}]"""
+    rows = []
+    for (filename, line, name), (_, calls, own, cumulative, _) in stats.stats.items():
+        rows.append({
+            "funcion": f"{os.path.basename(filename)}:{line}({name})",
+            "llamadas": calls,
+            "propio_s": round(own, 6),
+            "acumulado_s": round(cumulative, 6),
+        })
+    rows.sort(key=lambda row: row["acumulado_s"], reverse=True)
+    return rows[:limit]
@@ -0,0 +1,318 @@
+import time
+import hashlib
+import threading
+import contextvars
+from collections import namedtuple
+
+from langchain_core.language_models import BaseLanguageModel
+from langchain_core.prompts import ChatPromptTemplate
+
+from deadlines import DeadlineExceeded, check_deadline, remaining
+from heuristics import strip_accents
+
+VALID_CATEGORIES = ["Sugerencia", "Opinion", "Queja", "Vida universitaria"]
+DEFAULT_CATEGORY = "Opinion"
+TITLE_LABELS = ["OFENSIVO", "APROPIADO"]
+
+# Endpoint (o pantalla) al que se atribuyen los tokens de las llamadas del hilo actual
+current_endpoint = contextvars.ContextVar("current_endpoint", default=None)
+
+# max_tokens: tope de la respuesta; labels: etiquetas válidas de los prompts de clasificación,
+# cuyo stream se corta en cuanto la respuesta ya determina una de ellas
+PromptSpec = namedtuple("PromptSpec", ["name", "version", "template", "max_tokens", "labels"], defaults=(None, ()))
+
+CATEGORIZE_TEMPLATE = """
+Analiza el siguiente comentario y categorízalo EXACTAMENTE en una de estas cuatro categorías:
+- "Sugerencia": Si el comentario propone mejoras, ideas, cambios o recomendaciones constructivas
+- "Opinion": Si el comentario expresa una opinión personal neutral o positiva, experiencias sin ser ofensivo
+- "Queja": Si el comentario contiene lenguaje ofensivo, discriminatorio, amenazas, insultos, críticas muy negativas, o sentimientos muy negativos hacia personas (ej: "el maestro es malo", "odio a...", "es terrible", etc.)
+- "Vida universitaria": Si el comentario se refiere específicamente a experiencias, situaciones, actividades o aspectos de la vida universitaria, académica o estudiantil que no encajan en las otras categorías
+
+Reglas importantes:
+1. Responde SOLO con una de estas cuatro palabras: "Sugerencia", "Opinion", "Queja", o "Vida universitaria"
+2. No agregues explicaciones adicionales
+3. Comentarios negativos sobre personas (maestros, compañeros, etc.) van en "Queja"
+4. Comentarios sobre clases, universidad, estudios, campus, etc. van en "Vida universitaria"
+5. Si hay duda, prioriza en este orden: Queja > Vida universitaria > Sugerencia > Opinion
+
+Ejemplos:
+- "El maestro es malo" → Queja
+- "La clase de matemáticas es difícil" → Vida universitaria
+- "Deberían mejorar la cafetería" → Sugerencia
+- "Me gusta estudiar" → Opinion
+
+Comentario: "{comment}"
+
+Categoría:
+"""
+
+FORMALIZE_TEMPLATE = """
+El siguiente comentario contiene lenguaje ofensivo. Conviértelo a un comentario formal, respetuoso y constructivo que exprese la misma idea pero de manera apropiada para un entorno académico o profesional.
+
+Reglas:
+1. Eliminar todas las palabras ofensivas, vulgaridades o insultos
+2. Mantener la esencia del mensaje pero en tono constructivo
+3. Usar lenguaje formal y respetuoso
+4. Si es una queja, convertirla en feedback constructivo
+5. Máximo 300 caracteres
+6. Responder SOLO con el texto formalizado, sin explicaciones adicionales
+
+Comentario original: "{comment}"
+
+Comentario formalizado:
+"""
+
+TITLE_OFFENSIVE_TEMPLATE = """
+Analiza el siguiente título y determina si contiene contenido ofensivo, discriminatorio, vulgar o inapropiado.
+
+Responde EXACTAMENTE con una de estas dos palabras:
+- "OFENSIVO": Si contiene insultos, discriminación, vulgaridades, lenguaje de odio o contenido inapropiado
+- "APROPIADO": Si es un título normal y apropiado
+
+Título: "{title}"
+
+Clasificación:
+"""
+
+TITLE_FIX_TEMPLATE = """
+El siguiente título contiene contenido ofensivo. Genera una versión alternativa que sea:
+1. Respetuosa y apropiada
+2. Mantenga la esencia del mensaje original
+3. Sea clara y profesional
+4. Máximo 50 caracteres
+
+Título ofensivo: "{title}"
+
+Responde SOLO con el título corregido, sin explicaciones adicionales.
+
+Título corregido:
+"""
+
+# Registro central de prompts: subir la versión cada vez que cambia el texto de un prompt
+PROMPTS = {spec.name: spec for spec in (
+    PromptSpec("categorizar_comentario", 1, CATEGORIZE_TEMPLATE, max_tokens=10, labels=VALID_CATEGORIES),
+    # Los topes de las reescrituras dejan margen sobre sus límites de 300 y 50 caracteres (~4 por token)
+    PromptSpec("formalizar_comentario", 1, FORMALIZE_TEMPLATE, max_tokens=120),
+    PromptSpec("detectar_titulo_ofensivo", 1, TITLE_OFFENSIVE_TEMPLATE, max_tokens=6, labels=TITLE_LABELS),
+    PromptSpec("corregir_titulo", 1, TITLE_FIX_TEMPLATE, max_tokens=32),
+)}
+
+# Prompts que producen cada tipo de análisis guardado (su versión se guarda con el registro)
+COMMENT_PROMPTS = ("categorizar_comentario", "formalizar_comentario")
+TITLE_PROMPTS = ("detectar_titulo_ofensivo", "corregir_titulo")
+
+
+def prompt_fingerprint(spec):
+    """Hash corto del texto del prompt, para detectar cambios sin subir la versión"""
+    return hashlib.sha1(spec.template.encode("utf-8")).hexdigest()[:8]
+
+
+def match_label(response, labels):
+    """Etiqueta con la que ya empieza la respuesta parcial, o None si todavía no está determinada.
+
+    Se ignoran espacios, comillas, asteriscos, mayúsculas y acentos al inicio; la etiqueta debe
+    estar completa y seguida de un carácter que no sea letra ni número (así "Opinion" no se
+    decide antes de saber que no es "Opiniones")."""
+    text = strip_accents(response).lstrip(" \t\n\"'*`-").lower()
+    for label in labels:
+        normalized = label.lower()
+        if text.startswith(normalized) and len(text) > len(normalized) and not text[len(normalized)].isalnum():
+            return label
+    return None
+
+
+def bind_max_tokens(model, max_tokens):
+    """Limitar la longitud de la respuesta; solo los modelos de lenguaje aceptan max_tokens"""
+    if max_tokens and isinstance(model, BaseLanguageModel):
+        return model.bind(max_tokens=max_tokens)
+    return model
+
+
+def call_options(model):
+    """Argumentos de cada llamada: el plazo restante como timeout HTTP, para que una llamada atascada termine"""
+    budget = remaining()
+    if budget is None or not isinstance(model, BaseLanguageModel):
+        return {}
+    return {"timeout": max(budget, 0.001)}
+
+
+def parse_category(response):
+    """Limpiar la respuesta del LLM y validarla contra las categorías"""
+    category = response.strip()
+
+    if category in VALID_CATEGORIES:
+        return category
+
+    # Si la respuesta no es válida, intentar extraer una categoría válida
+    for valid_cat in VALID_CATEGORIES:
+        if valid_cat.lower() in category.lower():
+            return valid_cat
+
+    # Si no se encuentra ninguna, retornar Opinion por defecto
+    return DEFAULT_CATEGORY
+
+
+def strip_quotes(text):
+    """Quitar comillas envolventes de una respuesta del LLM"""
+    text = text.strip()
+    if text.startswith('"') and text.endswith('"'):
+        text = text[1:-1]
+    elif text.startswith("'") and text.endswith("'"):
+        text = text[1:-1]
+    return text
+
+
+def clean_formalized(response):
+    """Limpiar la respuesta de formalización; usa un texto genérico si quedó vacía o muy corta"""
+    formalized = strip_quotes(response)
+
+    # Quitar cualquier comilla doble o simple sobrante
+    formalized = formalized.replace('""', '').replace("''", '')
+
+    if len(formalized) < 10:
+        formalized = "Comentario convertido a lenguaje apropiado por contener contenido ofensivo."
+
+    return formalized
+
+
+def estimate_tokens(text):
+    """Estimación aproximada (4 caracteres por token) cuando el proveedor no reporta uso"""
+    return max(1, len(text) // 4) if text else 0
+
+
+class TokenAccounting:
+    """Acumulado de tokens y latencia por prompt y por endpoint"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_prompt = {}
+        self._by_endpoint = {}
+        self._listeners = []
+
+    def add_listener(self, listener):
+        """Registrar `listener(prompt_key, endpoint, latency)`, llamado después de cada llamada al LLM"""
+        self._listeners.append(listener)
+
+    @staticmethod
+    def _add(bucket, prompt_tokens, completion_tokens, latency, estimated, early_exit):
+        bucket["llamadas"] += 1
+        bucket["prompt_tokens"] += prompt_tokens
+        bucket["completion_tokens"] += completion_tokens
+        bucket["latencia_total"] += latency
+        bucket["latencia_max"] = max(bucket["latencia_max"], latency)
+        bucket["estimadas"] += int(estimated)
+        bucket["cortes_tempranos"] += int(early_exit)
+
+    @staticmethod
+    def _new_bucket():
+        return {"llamadas": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                "latencia_total": 0.0, "latencia_max": 0.0, "estimadas": 0, "cortes_tempranos": 0}
+
+    def record(self, prompt_key, endpoint, prompt_tokens, completion_tokens, latency, estimated=False,
+               early_exit=False):
+        endpoint = endpoint or "sin_endpoint"
+        with self._lock:
+            for buckets, key in ((self._by_prompt, prompt_key), (self._by_endpoint, endpoint)):
+                bucket = buckets.setdefault(key, self._new_bucket())
+                self._add(bucket, prompt_tokens, completion_tokens, latency, estimated, early_exit)
+        for listener in self._listeners:
+            listener(prompt_key, endpoint, latency)
+
+    @staticmethod
+    def _summary(bucket):
+        calls = bucket["llamadas"] or 1
+        return {
+            **bucket,
+            "total_tokens": bucket["prompt_tokens"] + bucket["completion_tokens"],
+            "tokens_promedio": round((bucket["prompt_tokens"] + bucket["completion_tokens"]) / calls, 1),
+            "latencia_promedio": round(bucket["latencia_total"] / calls, 4),
+            "latencia_total": round(bucket["latencia_total"], 4),
+            "latencia_max": round(bucket["latencia_max"], 4),
+        }
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "por_prompt": {key: self._summary(bucket) for key, bucket in self._by_prompt.items()},
+                "por_endpoint": {key: self._summary(bucket) for key, bucket in self._by_endpoint.items()},
+            }
+
+
+class PromptRegistry:
+    """Plantilla y modelo (con su tope de tokens) construidos una sola vez por prompt, con contabilidad de tokens"""
+
+    def __init__(self, model, prompts=PROMPTS, accounting=None):
+        self.model = model
+        self.prompts = prompts
+        self.accounting = accounting or TokenAccounting()
+        # La plantilla y el modelo se invocan por separado para pasar el timeout de cada llamada al modelo
+        self._chains = {
+            name: (ChatPromptTemplate.from_template(spec.template), bind_max_tokens(model, spec.max_tokens))
+            for name, spec in prompts.items()
+        }
+
+    def version(self, name):
+        """Identificador de versión del prompt (p. ej. categorizar_comentario@v1)"""
+        return f"{name}@v{self.prompts[name].version}"
+
+    def versions(self):
+        return {name: {"version": self.version(name), "fingerprint": prompt_fingerprint(spec)}
+                for name, spec in self.prompts.items()}
+
+    @property
+    def model_name(self):
+        """Nombre del modelo que responde los prompts"""
+        return getattr(self.model, "model_name", None) or type(self.model).__name__
+
+    def provenance(self, names):
+        """Campos de procedencia de un análisis: versiones de sus prompts y modelo que los respondió"""
+        return {"prompt_version": {name: self.version(name) for name in names}, "modelo": self.model_name}
+
+    def stream(self, name, variables, endpoint=None, cancel_event=None):
+        """Transmitir la respuesta del prompt; el uso se registra al terminar o al cortar el stream.
+        Si `cancel_event` se activa, el stream se corta en el siguiente fragmento; si se agota
+        el plazo de la solicitud, se lanza DeadlineExceeded. El plazo restante es también el
+        timeout HTTP de la llamada, así que un proveedor que deja de responder no retiene el
+        hilo. En los prompts de clasificación el stream se corta en cuanto la respuesta
+        determina una etiqueta (`match_label`)."""
+        endpoint = endpoint or current_endpoint.get()
+        template, model = self._chains[name]
+        labels = self.prompts[name].labels
+        check_deadline()
+        start = time.perf_counter()
+        response = ""
+        usage = None
+        early_exit = False
+        try:
+            for chunk in model.stream(template.invoke(variables), **call_options(self.model)):
+                if cancel_event is not None and cancel_event.is_set():
+                    break
+                check_deadline()
+                usage_metadata = getattr(chunk, "usage_metadata", None)
+                if usage_metadata:
+                    usage = usage_metadata
+                response += chunk.content
+                yield chunk.content
+                if labels and match_label(response, labels):
+                    # Cerrar el stream deja de generar (y cobrar) el resto de la respuesta
+                    early_exit = True
+                    break
+        except Exception as e:
+            # El timeout de la llamada es el plazo: reportarlo como plazo agotado, no como error del LLM
+            if not isinstance(e, DeadlineExceeded) and remaining() == 0:
+                raise DeadlineExceeded("Se agotó el plazo de la solicitud esperando al LLM") from e
+            raise
+        finally:
+            latency = time.perf_counter() - start
+            if usage:
+                prompt_tokens = usage.get("input_tokens", 0)
+                completion_tokens = usage.get("output_tokens", 0)
+            else:
+                prompt_tokens = estimate_tokens(self.prompts[name].template.format(**variables))
+                completion_tokens = estimate_tokens(response)
+            self.accounting.record(self.version(name), endpoint, prompt_tokens, completion_tokens,
+                                   latency, estimated=usage is None, early_exit=early_exit)
+
+    def run(self, name, variables, endpoint=None, cancel_event=None):
+        """Ejecutar el prompt y devolver la respuesta completa (parcial si fue cancelado)"""
+        return "".join(self.stream(name, variables, endpoint, cancel_event))
@@ -0,0 +1,222 @@
+"""Reetiquetar de forma incremental los análisis hechos con otras versiones de los prompts o del modelo.
+
+Solo se reprocesan los registros cuya procedencia (`prompt_version` y `modelo`) no coincide
+con la actual: los de prompts anteriores, los guardados antes de que existiera ese campo
+(p. ej. con la categoría "HateSpeech") y los resultados locales degradados. Se procesan por
+lotes con concurrencia y ritmo acotados. Un texto que ya tiene un análisis vigente en el
+historial, o que se repite, reutiliza ese resultado sin llamar al LLM. Cada lote se guarda
+con una sola escritura; si el proceso se interrumpe, al volver a ejecutarlo solo quedan los
+registros que faltan.
+
+Los comentarios se anclan en lotes de Merkle, así que no se reescriben: cada resultado nuevo
+se agrega como otra versión (id nuevo, `version` y `reemplaza` con el id anterior) que la API
+ancla con su propia hoja; las lecturas del historial omiten la versión reemplazada. Los
+títulos no se anclan y se actualizan en su lugar (`update_many`).
+
+Uso:
+    python relabel.py --dry-run
+    python relabel.py --tipo comentarios --concurrencia 8 --rps 5
+    python relabel.py --tenant ingenieria --desde 2025-01-01
+"""
+import os
+import sys
+import time
+import hashlib
+import argparse
+import threading
+from collections import Counter, namedtuple
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import pipeline
+from backfill import TEXT_FIELDS, batched, pick_field
+from history_store import DEFAULT_HISTORY_DIR, SegmentedHistory
+from prompts import COMMENT_PROMPTS, TITLE_PROMPTS, current_endpoint
+from tenants import DEFAULT_TENANT, TENANT_HISTORY_DIR
+
+# prompts: los que producen el análisis; analyze/to_fields: nombres de las funciones de pipeline.py;
+# result_fields: campos que se copian de un análisis vigente con el mismo texto;
+# versioned: los análisis están anclados (lotes de Merkle) y el resultado nuevo se guarda como otra versión
+Kind = namedtuple("Kind", ["prompts", "text_fields", "analyze", "to_fields", "result_fields", "versioned"])
+
+KINDS = {
+    "comentarios": Kind(COMMENT_PROMPTS, TEXT_FIELDS, "classify_comment", "comment_fields",
+                        ("categoria", "comentario_formalizado"), True),
+    "titulos": Kind(TITLE_PROMPTS, ("titulo_original", "titulo", "title"), "analyze_title", "title_fields",
+                    ("es_coherente", "es_ofensivo", "recomendacion", "titulo_sugerido", "estado"), False),
+}
+
+
+class RateLimiter:
+    """Espaciar las llamadas para no superar `rate` por segundo (0 = sin límite)"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def text_key(text):
+    return hashlib.sha1(text.strip().encode("utf-8")).hexdigest()
+
+
+def is_current(record, provenance, ignore_model=False):
+    if record.get("prompt_version") != provenance["prompt_version"]:
+        return False
+    return ignore_model or record.get("modelo") == provenance["modelo"]
+
+
+def find_stale(records, kind, provenance, ignore_model=False):
+    """Separar los registros con procedencia anterior; los vigentes alimentan la caché por texto"""
+    cache = {}
+    stale = []
+    for record in records:
+        text = (pick_field(record, kind.text_fields) or "").strip()
+        # Sin texto no hay qué reprocesar; los pendientes los completa la API en segundo plano
+        if not text or not isinstance(record.get("id"), int) or record.get("pendiente_llm"):
+            continue
+        if is_current(record, provenance, ignore_model):
+            cache.setdefault(text_key(text), {field: record.get(field) for field in kind.result_fields})
+        else:
+            stale.append((record, text))
+    return stale, cache
+
+
+def new_version(record, update):
+    """Otra versión del análisis con el resultado nuevo; el id se asigna al guardarla"""
+    version = {**record, **update, "version": (record.get("version") or 1) + 1, "reemplaza": record["id"]}
+    del version["id"]
+    return version
+
+
+def save_batch(store, kind, updates, records):
+    """Guardar los resultados de un lote con una sola escritura; devuelve cuántos análisis se guardaron"""
+    if kind.versioned:
+        versions = [new_version(records[record_id], update) for record_id, update in updates.items()]
+        store.append_many(versions, assign_ids=True)
+        return len(versions)
+    return len(store.update_many(updates))
+
+
+def describe_version(record):
+    versions = record.get("prompt_version")
+    if not versions:
+        return "sin versión (anterior o degradado)"
+    return f"{', '.join(sorted(versions.values()))} / {record.get('modelo')}"
+
+
+def run(args):
+    kind = KINDS[args.tipo]
+    if args.historial:
+        directory = args.historial
+    elif args.tenant and args.tenant != DEFAULT_TENANT:
+        directory = os.path.join(TENANT_HISTORY_DIR, args.tenant, args.tipo)
+    else:
+        directory = os.path.join(DEFAULT_HISTORY_DIR, args.tipo)
+    if not os.path.exists(os.path.join(directory, "manifest.json")):
+        print(f"Error: no hay un historial en {directory}")
+        return 1
+
+    # El mismo pipeline de la API, sin levantarla (sus escritores usan este mismo historial)
+    analyze = getattr(pipeline, kind.analyze)
+    to_fields = getattr(pipeline, kind.to_fields)
+    try:
+        provenance = pipeline.get_prompt_registry().provenance(kind.prompts)
+    except pipeline.MissingAPIKey as e:
+        print(f"Error: {str(e)}")
+        return 1
+
+    store = SegmentedHistory(directory)
+    records = store.read_range(args.desde, args.hasta)
+    stale, cache = find_stale(records, kind, provenance, args.ignorar_modelo)
+    print(f"{len(stale)} de {len(records)} análisis con otra procedencia "
+          f"(vigente: {', '.join(sorted(provenance['prompt_version'].values()))} / {provenance['modelo']})")
+    for version, count in Counter(describe_version(record) for record, _ in stale).most_common():
+        print(f"  {count:6d}  {version}")
+    if args.dry_run or not stale:
+        return 0
+
+    limiter = RateLimiter(args.rps)
+
+    def analyze_one(text):
+        current_endpoint.set("reetiquetado")
+        pipeline.propagate_llm_errors.set(True)
+        limiter.wait()
+        return to_fields(analyze(text))
+
+    totals = {"actualizados": 0, "reutilizados": 0, "llamadas": 0, "errores": 0, "cambios_categoria": 0}
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrencia, thread_name_prefix="reetiquetado") as executor:
+        for batch in batched(stale, args.lote):
+            # Una llamada por texto distinto que no tenga ya un resultado vigente
+            futures = {}
+            for _, text in batch:
+                key = text_key(text)
+                if key not in cache and key not in futures:
+                    futures[key] = executor.submit(analyze_one, text)
+            totals["llamadas"] += len(futures)
+
+            updates = {}
+            originals = {record["id"]: record for record, _ in batch}
+            relabeled_at = datetime.now().isoformat()
+            for record, text in batch:
+                key = text_key(text)
+                if key in cache:
+                    fields = cache[key]
+                    totals["reutilizados"] += 1
+                else:
+                    try:
+                        fields = cache[key] = futures[key].result()
+                    except Exception as e:
+                        # El registro conserva su procedencia anterior y se reintenta en la próxima ejecución
+                        print(f"Error reetiquetando el análisis {record['id']}: {str(e)}")
+                        totals["errores"] += 1
+                        continue
+                update = {**fields, **provenance, "reetiquetado": relabeled_at}
+                if "categoria" in fields and fields["categoria"] != record.get("categoria"):
+                    update["categoria_anterior"] = record.get("categoria")
+                    totals["cambios_categoria"] += 1
+                if record.get("degraded") or record.get("pendiente_llm") is not None:
+                    update.update({"degraded": False, "pendiente_llm": False})
+                updates[record["id"]] = update
+
+            if updates:
+                totals["actualizados"] += save_batch(store, kind, updates, originals)
+            elapsed = time.perf_counter() - start
+            print(f"{totals['actualizados']}/{len(stale)} actualizados ({totals['actualizados'] / elapsed:.1f}/s) - "
+                  f"llamadas: {totals['llamadas']}, reutilizados: {totals['reutilizados']}, "
+                  f"errores: {totals['errores']}")
+
+    print(f"Reetiquetado completo: {totals['actualizados']} actualizados, "
+          f"{totals['cambios_categoria']} con otra categoría, {totals['errores']} con error")
+    return 1 if totals["errores"] else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reprocesar solo los análisis hechos con otras versiones de los prompts")
+    parser.add_argument("--tipo", choices=sorted(KINDS), default="comentarios", help="Historial a reetiquetar")
+    parser.add_argument("--tenant", help="Tenant cuyo historial se reetiqueta (por defecto el tenant por defecto)")
+    parser.add_argument("--historial", help="Directorio del historial segmentado (reemplaza --tipo/--tenant)")
+    parser.add_argument("--desde", help="Solo análisis desde esta fecha (ISO)")
+    parser.add_argument("--hasta", help="Solo análisis hasta esta fecha (ISO)")
+    parser.add_argument("--concurrencia", type=int, default=8, help="Llamadas simultáneas al LLM")
+    parser.add_argument("--rps", type=float, default=0, help="Máximo de análisis por segundo (0 = sin límite)")
+    parser.add_argument("--lote", type=int, default=200, help="Registros por lote y por escritura")
+    parser.add_argument("--ignorar-modelo", action="store_true",
+                        help="Considerar vigentes los análisis con los prompts actuales aunque sean de otro modelo")
+    parser.add_argument("--dry-run", action="store_true", help="Solo contar los análisis a reprocesar")
+    return run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    sys.exit(main())
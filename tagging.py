@@ -0,0 +1,257 @@
+import os
+import re
+import hashlib
+import threading
+
+import fuzzy_tags
+from fuzzy_tags import FuzzyTagMatcher
+
+WORD_RE = re.compile(r'\b\w+\b')
+
+DEFAULT_TAGS_FILE = "tags.txt"
+DEFAULT_POLL_INTERVAL = float(os.getenv("TAGS_POLL_INTERVAL", "5"))
+
+
+def read_tags(path=DEFAULT_TAGS_FILE):
+    """Leer los tags del archivo; los errores de lectura se propagan"""
+    with open(path, "r", encoding="utf-8") as file:
+        return [line.strip().lower() for line in file if line.strip()]
+
+
+def load_tags(path=DEFAULT_TAGS_FILE):
+    """Cargar tags desde el archivo tags.txt"""
+    try:
+        return read_tags(path)
+    except FileNotFoundError:
+        print(f"Warning: No se encontró el archivo {path}")
+        return []
+    except Exception as e:
+        print(f"Error cargando tags: {str(e)}")
+        return []
+
+
+def save_tags(tags, path=DEFAULT_TAGS_FILE):
+    """Escribir el vocabulario de forma atómica: quien recarga ve el archivo anterior o el nuevo, nunca uno a medias"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        file.write("".join(f"{tag}\n" for tag in tags))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+
+def vocabulary_version(tags):
+    """Versión del vocabulario: hash corto del contenido, igual en todos los workers"""
+    digest = hashlib.sha1("\n".join(tags).encode("utf-8")).hexdigest()
+    return digest[:12]
+
+
+def max_tags_for(word_count):
+    """Determinar cantidad máxima de tags según longitud del texto"""
+    if word_count <= 4:  # Texto muy corto (4 palabras o menos)
+        return 1
+    elif word_count <= 8:  # Texto mediano (5-8 palabras)
+        return 2
+    return 3  # Texto largo (9+ palabras)
+
+
+def plural_forms(word):
+    """Plurales simples (maestro -> maestros) y con 'es' (clase -> clases), en ambos sentidos"""
+    forms = [word + 's', word + 'es']
+    if word.endswith('s'):
+        forms.append(word[:-1])
+    if word.endswith('es'):
+        forms.append(word[:-2])
+    return forms
+
+
+class TagIndex:
+    """Índice inmutable de búsqueda de tags: palabra -> tag exacto, palabra -> variaciones
+    y, si NumPy está disponible, un nivel difuso por n-gramas de caracteres"""
+
+    def __init__(self, tags, version=None, fuzzy=True):
+        # Conservar el orden del archivo: decide los empates igual que antes
+        self.tags = tuple(dict.fromkeys(tags))
+        self.version = version or vocabulary_version(self.tags)
+        self.order = {tag: position for position, tag in enumerate(self.tags)}
+
+        self.exact = {tag: tag for tag in self.tags}
+        variants = {}
+        for tag in self.tags:
+            for form in plural_forms(tag):
+                bucket = variants.setdefault(form, [])
+                if tag not in bucket:
+                    bucket.append(tag)
+        self.variants = {form: tuple(bucket) for form, bucket in variants.items()}
+        self.fuzzy = FuzzyTagMatcher(self.tags) if fuzzy and self.tags and fuzzy_tags.available() else None
+
+    def __len__(self):
+        return len(self.tags)
+
+    def __bool__(self):
+        return bool(self.tags)
+
+    def __iter__(self):
+        return iter(self.tags)
+
+    def extract(self, text):
+        """Extraer tags relevantes del texto - cantidad dinámica según longitud"""
+        words_in_text = WORD_RE.findall(text.lower())
+        fuzzy_matches = self.fuzzy.match(words_in_text) if self.fuzzy else {}
+        return self._rank(words_in_text, fuzzy_matches)
+
+    def extract_many(self, texts):
+        """Extraer tags de un lote de textos; el nivel difuso usa una multiplicación por bloque de textos"""
+        words_per_text = [WORD_RE.findall(text.lower()) for text in texts]
+        if self.fuzzy:
+            fuzzy_per_text = self.fuzzy.match_many(words_per_text)
+        else:
+            fuzzy_per_text = [{} for _ in words_per_text]
+        return [self._rank(words, fuzzy) for words, fuzzy in zip(words_per_text, fuzzy_per_text)]
+
+    def _rank(self, words_in_text, fuzzy_matches):
+        max_tags = max_tags_for(len(words_in_text))
+
+        exact_matches = {}  # tag -> posiciones con coincidencia exacta
+        first_variant = {}  # tag -> primera posición con una variación simple
+        for i, word in enumerate(words_in_text):
+            tag = self.exact.get(word)
+            if tag is not None:
+                exact_matches.setdefault(tag, []).append(i)
+            for tag in self.variants.get(word, ()):
+                first_variant.setdefault(tag, i)
+
+        tag_scores = {}  # tag -> puntuación de relevancia
+        for tag, matches in exact_matches.items():
+            tag_scores[tag] = self._score(tag, 3 * len(matches), matches[0], len(matches))
+
+        # Las variaciones solo cuentan si no hubo coincidencia exacta
+        for tag, position in first_variant.items():
+            if tag not in exact_matches:
+                tag_scores[tag] = self._score(tag, 2, position, 1)
+
+        # Coincidencias difusas (acentos, errores, frases): solo para tags sin coincidencia anterior
+        for tag, (similarity, position) in fuzzy_matches.items():
+            if tag not in tag_scores:
+                base = 3 if similarity >= 0.999 else 2 * similarity
+                tag_scores[tag] = self._score(tag, base, position, 1)
+
+        # Un tag de varias palabras (solo llegan por el nivel difuso) cubre a los de una palabra que contiene
+        covered = set()
+        for tag in tag_scores:
+            if " " in tag:
+                for word in fuzzy_tags.normalize(tag).split():
+                    covered.add(word)
+                    covered.update(plural_forms(word))
+        if covered:
+            spans = [range(fuzzy_matches[tag][1], fuzzy_matches[tag][1] + tag.count(" ") + 1)
+                     for tag in tag_scores if " " in tag]
+            for tag in [tag for tag in tag_scores if " " not in tag]:
+                inside_phrase = (tag in fuzzy_matches and tag not in exact_matches and tag not in first_variant
+                                 and any(fuzzy_matches[tag][1] in span for span in spans))
+                if inside_phrase or fuzzy_tags.normalize(tag) in covered:
+                    del tag_scores[tag]
+
+        # Ordenar por relevancia; los empates conservan el orden del vocabulario
+        sorted_tags = sorted(tag_scores.items(), key=lambda x: (-x[1], self.order[x[0]]))
+        return [tag for tag, score in sorted_tags[:max_tags]]
+
+    @staticmethod
+    def _score(tag, score, first_position, match_count):
+        # Bonus por longitud del tag (tags más específicos son más relevantes)
+        score += len(tag) * 0.1
+        # Bonus por posición temprana en el texto
+        score += max(0, 5 - first_position)
+        # Bonus por frecuencia
+        score += match_count * 0.5
+        return score
+
+
+def extract_tags_from_text(text, available_tags):
+    """Extraer tags relevantes del texto - acepta un TagIndex o una lista de tags"""
+    if not isinstance(available_tags, TagIndex):
+        available_tags = TagIndex(available_tags)
+    return available_tags.extract(text)
+
+
+class TagVocabulary:
+    """Vocabulario de tags vigilado por mtime; el índice se reconstruye en segundo plano
+    y se intercambia atómicamente sin bloquear a las solicitudes en curso"""
+
+    def __init__(self, path=DEFAULT_TAGS_FILE, poll_interval=DEFAULT_POLL_INTERVAL):
+        self.path = path
+        self.poll_interval = poll_interval
+        self._signature = self._stat()
+        self._index = TagIndex(load_tags(path))
+        self._reload_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def current(self):
+        """Índice vigente; cada análisis debe tomarlo una sola vez y usar esa referencia"""
+        return self._index
+
+    @property
+    def version(self):
+        return self._index.version
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+            return (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return None
+
+    def check_for_changes(self):
+        """Recompilar el índice si el archivo cambió desde la última revisión"""
+        signature = self._stat()
+        if signature is None or signature == self._signature:
+            return False
+        return self.reload(signature)
+
+    def reload(self, signature=None):
+        """Construir un índice nuevo fuera de cualquier bloqueo de lectura y publicarlo.
+        Si la lectura falla o el archivo queda vacío (p. ej. truncado mientras se escribe) se
+        conserva el índice vigente: un vocabulario vacío dejaría de etiquetar sin avisar."""
+        with self._reload_lock:
+            signature = signature or self._stat()
+            if signature is None:
+                # Si el archivo desaparece se conserva el último vocabulario válido
+                return False
+            try:
+                tags = read_tags(self.path)
+            except (OSError, UnicodeDecodeError) as e:
+                # Sin actualizar la firma: se reintenta en la siguiente revisión
+                print(f"Error recargando tags; se conserva la versión {self._index.version}: {str(e)}")
+                return False
+            self._signature = signature
+            if not tags and self._index:
+                print(f"Warning: {self.path} está vacío; se conserva la versión {self._index.version}")
+                return False
+            new_index = TagIndex(tags)
+            if new_index.version == self._index.version:
+                return False
+            # La asignación de una referencia es atómica: los lectores ven el índice viejo o el nuevo
+            self._index = new_index
+            print(f"Vocabulario de tags recargado: versión {new_index.version} ({len(new_index)} tags)")
+            return True
+
+    def _watch(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.check_for_changes()
+            except Exception as e:
+                print(f"Error recargando tags: {str(e)}")
+
+    def start(self):
+        """Iniciar el hilo de vigilancia (idempotente)"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._watch, name="tag-vocabulary-watcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.poll_interval + 1)
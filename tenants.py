@@ -0,0 +1,298 @@
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+
+from flask import g, request, jsonify
+
+from tagging import DEFAULT_TAGS_FILE, TagVocabulary
+from history_store import (COMMENTS_HISTORY_FILE, TITLES_HISTORY_FILE, DEFAULT_HISTORY_DIR, HistoryWriter,
+                           SegmentedHistory)
+from merkle import MerkleBatcher
+from trending import TrendingTags
+
+TENANT_HEADER = "X-Tenant"
+# El tenant por defecto conserva las rutas de siempre (tags.txt, historial/comentarios, ...)
+DEFAULT_TENANT = "default"
+# Tenants permitidos separados por coma ("*" = cualquiera); también se aceptan los que tienen tags/<tenant>.txt
+ALLOWED_TENANTS = frozenset(name.strip() for name in os.getenv("TENANTS", "").split(",") if name.strip())
+TENANT_TAGS_DIR = os.getenv("TENANT_TAGS_DIR", "tags")
+TENANT_HISTORY_DIR = os.path.join(DEFAULT_HISTORY_DIR, "tenants")
+# Tenants cargados a la vez y segundos sin solicitudes antes de liberar sus recursos
+TENANTS_MAX_ACTIVE = int(os.getenv("TENANTS_MAX_ACTIVE", "8"))
+TENANT_IDLE_SECONDS = float(os.getenv("TENANT_IDLE_SECONDS", "900"))
+
+TENANT_NAME = re.compile(r"^[a-z0-9][a-z0-9_-]{0,39}$")
+# Prefijo de ruta /t/<tenant>/...
+PATH_PREFIX = re.compile(r"^/t/([^/]+)(/.*)?$")
+ENVIRON_KEY = "comentarios.tenant"
+
+
+class UnknownTenant(LookupError):
+    """El tenant no está configurado (ni en TENANTS ni con un archivo de tags propio)"""
+
+
+class TenantResources:
+    """Vocabulario, historiales, escritores, lotes de Merkle y tendencias de un tenant.
+
+    Cada tenant tiene sus propios archivos e hilos: el tamaño del historial o el ritmo de
+    escritura de uno no afecta las lecturas ni los commits de otro."""
+
+    def __init__(self, name, history_dir, vocabulary, owns_vocabulary=False,
+                 legacy_comments=None, legacy_titles=None):
+        self.name = name
+        self.history_dir = history_dir
+        self.tag_vocabulary = vocabulary
+        self.owns_vocabulary = owns_vocabulary
+        self.loaded_at = time.monotonic()
+        self.last_used = self.loaded_at
+        self.active = 0  # solicitudes (o tareas en segundo plano) que lo están usando
+        self.current_comment = None  # comentario guardado con POST /comentario
+
+        # Historiales segmentados por día (se migran una vez desde los archivos JSON anteriores)
+        self.comments_history = SegmentedHistory(os.path.join(history_dir, "comentarios"),
+                                                 legacy_file=legacy_comments).start_maintenance()
+        self.titles_history = SegmentedHistory(os.path.join(history_dir, "titulos"),
+                                               legacy_file=legacy_titles).start_maintenance()
+
+        # Un hilo por historial agrupa las escrituras fuera del camino de la solicitud
+        self.comments_writer = HistoryWriter(self.comments_history)
+        self.titles_writer = HistoryWriter(self.titles_history)
+
+        # Lotes de Merkle de los análisis ya confirmados en disco, para anclar sus raíces en la DApp.
+        # Al iniciar y periódicamente se leen los cambios del historial desde la secuencia del último
+        # lote (también los que escriben otros procesos); los workers comparten los lotes en disco.
+        self.merkle_batcher = MerkleBatcher(os.path.join(history_dir, "lotes"), store=self.comments_history)
+        self.merkle_batcher.start()
+        self.comments_writer.add_listener(self.merkle_batcher.add, updates=True)
+
+        # Tags en tendencia con memoria acotada; se inicializa con la ventana actual del historial y
+        # `/tendencias` lee lo que escriben los otros workers y procesos
+        self.trending_tags = TrendingTags().sync(self.comments_history)
+        self.comments_writer.add_listener(self.trending_tags.add, updates=True)
+
+    def close(self):
+        """Confirmar las escrituras pendientes y detener los hilos del tenant"""
+        self.comments_writer.close()
+        self.titles_writer.close()
+        self.merkle_batcher.stop()
+        self.comments_history.stop_maintenance()
+        self.titles_history.stop_maintenance()
+        if self.owns_vocabulary:
+            self.tag_vocabulary.stop()
+
+    def stats(self):
+        return {
+            "tags": self.tag_vocabulary.path,
+            "tags_version": self.tag_vocabulary.version,
+            "historial": self.history_dir,
+            "en_uso": self.active,
+            "ociosa_s": round(time.monotonic() - self.last_used, 1),
+            "cargada_hace_s": round(time.monotonic() - self.loaded_at, 1),
+            "cola_comentarios": self.comments_writer.queue_depth(),
+            "cola_titulos": self.titles_writer.queue_depth(),
+        }
+
+
+class TenantRegistry:
+    """Recursos por tenant cargados bajo demanda y liberados por LRU o inactividad.
+
+    La carga de un tenant no bloquea las solicitudes de los demás. Un tenant en uso nunca se
+    libera; si todos lo están, el límite se excede temporalmente. El tenant por defecto queda
+    fijo en memoria y comparte el vocabulario de tags.txt con los tenants sin archivo propio."""
+
+    def __init__(self, max_active=TENANTS_MAX_ACTIVE, idle_seconds=TENANT_IDLE_SECONDS,
+                 allowed=ALLOWED_TENANTS, pinned=(DEFAULT_TENANT,)):
+        self.max_active = max(1, max_active)
+        self.idle_seconds = idle_seconds
+        self.allowed = allowed
+        self.pinned = frozenset(pinned)
+        self.shared_vocabulary = None
+        self._tenants = OrderedDict()  # nombre -> TenantResources, del menos al más reciente
+        self._loading = {}  # nombre -> Lock de carga
+        self._closing = {}  # nombre -> Event que se marca al terminar de liberarlo
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {"cargas": 0, "liberados_lru": 0, "liberados_inactivos": 0}
+
+    def _tags_file(self, name):
+        return os.path.join(TENANT_TAGS_DIR, f"{name}.txt")
+
+    def is_allowed(self, name):
+        if name == DEFAULT_TENANT or "*" in self.allowed or name in self.allowed:
+            return True
+        return os.path.exists(self._tags_file(name))
+
+    def _create(self, name):
+        if self.shared_vocabulary is None:
+            self.shared_vocabulary = TagVocabulary(DEFAULT_TAGS_FILE).start()
+        if name == DEFAULT_TENANT:
+            return TenantResources(name, DEFAULT_HISTORY_DIR, self.shared_vocabulary,
+                                   legacy_comments=COMMENTS_HISTORY_FILE, legacy_titles=TITLES_HISTORY_FILE)
+        tags_file = self._tags_file(name)
+        if os.path.exists(tags_file):
+            return TenantResources(name, os.path.join(TENANT_HISTORY_DIR, name),
+                                   TagVocabulary(tags_file).start(), owns_vocabulary=True)
+        return TenantResources(name, os.path.join(TENANT_HISTORY_DIR, name), self.shared_vocabulary)
+
+    def _checkout(self, name):
+        """Marcar en uso un tenant ya cargado (con el bloqueo tomado)"""
+        resources = self._tenants.get(name)
+        if resources is not None:
+            self._tenants.move_to_end(name)
+            resources.active += 1
+            resources.last_used = time.monotonic()
+        return resources
+
+    def acquire(self, name):
+        """Recursos del tenant marcados en uso; cargarlos si hace falta. Se devuelven con `release`"""
+        if not TENANT_NAME.match(name):
+            raise ValueError(f"Nombre de tenant inválido: {name}")
+        if not self.is_allowed(name):
+            raise UnknownTenant(name)
+
+        with self._lock:
+            resources = self._checkout(name)
+            if resources is not None:
+                return resources
+            loading = self._loading.setdefault(name, threading.Lock())
+
+        with loading:
+            with self._lock:
+                resources = self._checkout(name)
+                closing = self._closing.get(name)
+            if resources is not None:
+                return resources
+            # Si se está liberando, esperar a que confirme sus escrituras antes de reabrir los archivos
+            if closing is not None:
+                closing.wait()
+            resources = self._create(name)
+            with self._lock:
+                self._tenants[name] = resources
+                self._loading.pop(name, None)
+                self._stats["cargas"] += 1
+                self._checkout(name)
+                victims = self._over_capacity()
+        self._close_all(victims)
+        return resources
+
+    def retain(self, resources):
+        """Marcar en uso un tenant que ya se tiene (p. ej. para una tarea en segundo plano)"""
+        with self._lock:
+            resources.active += 1
+
+    def release(self, resources):
+        with self._lock:
+            resources.active -= 1
+            resources.last_used = time.monotonic()
+
+    def _evict(self, name):
+        """Sacar un tenant del registro (con el bloqueo tomado); se cierra después, fuera del bloqueo"""
+        resources = self._tenants.pop(name)
+        self._closing[name] = threading.Event()
+        return resources
+
+    def _over_capacity(self):
+        victims = []
+        for name in list(self._tenants):
+            if len(self._tenants) <= self.max_active:
+                break
+            if name not in self.pinned and self._tenants[name].active == 0:
+                victims.append(self._evict(name))
+                self._stats["liberados_lru"] += 1
+        return victims
+
+    def evict_idle(self):
+        """Liberar los tenants sin solicitudes durante más de `idle_seconds`"""
+        now = time.monotonic()
+        with self._lock:
+            victims = [self._evict(name) for name, resources in list(self._tenants.items())
+                       if name not in self.pinned and resources.active == 0
+                       and now - resources.last_used >= self.idle_seconds]
+            self._stats["liberados_inactivos"] += len(victims)
+        self._close_all(victims)
+        return len(victims)
+
+    def _close_all(self, victims):
+        for resources in victims:
+            try:
+                resources.close()
+            except Exception as e:
+                print(f"Error liberando el tenant {resources.name}: {str(e)}")
+            finally:
+                with self._lock:
+                    self._closing.pop(resources.name).set()
+
+    def _watch(self):
+        while not self._stop.wait(max(1.0, min(60.0, self.idle_seconds / 2))):
+            try:
+                self.evict_idle()
+            except Exception as e:
+                print(f"Error liberando tenants inactivos: {str(e)}")
+
+    def start(self):
+        """Cargar los tenants fijos e iniciar la liberación por inactividad (idempotente)"""
+        for name in self.pinned:
+            self.release(self.acquire(name))
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._watch, name="tenant-registry", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        with self._lock:
+            victims = [self._evict(name) for name in list(self._tenants)]
+        self._close_all(victims)
+        if self.shared_vocabulary is not None:
+            self.shared_vocabulary.stop()
+
+    def stats(self):
+        with self._lock:
+            tenants = {name: resources.stats() for name, resources in self._tenants.items()}
+            return {**self._stats, "cargados": len(tenants), "max_activos": self.max_active, "tenants": tenants}
+
+    def init_app(self, app):
+        """Resolver el tenant de cada solicitud (prefijo /t/<tenant>/ o encabezado X-Tenant)"""
+        app.wsgi_app = TenantPathMiddleware(app.wsgi_app)
+
+        def assign_tenant():
+            name = request.environ.get(ENVIRON_KEY) or request.headers.get(TENANT_HEADER) or DEFAULT_TENANT
+            try:
+                g.tenant = self.acquire(name.strip().lower())
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            except UnknownTenant:
+                return jsonify({"error": f"Tenant desconocido: {name}"}), 404
+
+        def release_tenant(exception=None):
+            resources = g.pop("tenant", None)
+            if resources is not None:
+                self.release(resources)
+
+        app.before_request(assign_tenant)
+        app.teardown_request(release_tenant)
+        return self
+
+
+class TenantPathMiddleware:
+    """Quitar el prefijo /t/<tenant> de la ruta para que las rutas de la API no cambien"""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        match = PATH_PREFIX.match(environ.get("PATH_INFO", ""))
+        if match:
+            environ[ENVIRON_KEY] = match.group(1)
+            environ["SCRIPT_NAME"] = environ.get("SCRIPT_NAME", "") + f"/t/{match.group(1)}"
+            environ["PATH_INFO"] = match.group(2) or "/"
+        return self.wsgi_app(environ, start_response)
+
+
+def current():
+    """Recursos del tenant de la solicitud actual"""
+    return g.tenant
@@ -0,0 +1,40 @@
+from flask import Flask, jsonify
+
+from admission import AdmissionController
+
+
+def test_batch_occupies_one_slot_per_item():
+    controller = AdmissionController(limit=4, queue_size=0, max_wait=0)
+    assert controller.acquire(3) is not None
+    assert controller.acquire(2) is None
+    assert controller.acquire(1) is not None
+    controller.release(3)
+    controller.release(1)
+    assert controller.stats()["en_vuelo"] == 0
+
+
+def test_batch_heavier_than_the_limit_enters_only_when_idle():
+    controller = AdmissionController(limit=2, queue_size=0, max_wait=0)
+    assert controller.acquire(1) is not None
+    assert controller.acquire(5) is None
+    controller.release(1)
+    assert controller.acquire(5) is not None
+
+
+def test_init_app_releases_the_weight_it_admitted():
+    app = Flask(__name__)
+    controller = AdmissionController(limit=4, queue_size=0, max_wait=0)
+
+    @app.route("/lote", methods=["POST"])
+    def lote():
+        return jsonify({"en_vuelo": controller.stats()["en_vuelo"]})
+
+    controller.init_app(app, ("lote",), weights={"lote": lambda: 3})
+    client = app.test_client()
+    assert client.post("/lote").get_json() == {"en_vuelo": 3}
+    assert controller.stats()["en_vuelo"] == 0
+
+    controller.acquire(2)
+    response = client.post("/lote")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"]
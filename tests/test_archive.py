@@ -0,0 +1,30 @@
+import json
+
+import pytest
+
+from archive import ArchiveReader, convert, write_archive
+
+
+def _legacy_file(path, texts, **fields):
+    path.write_text(json.dumps([{"comentario": text, "timestamp": "2025-08-01T10:00:00", **fields}
+                                for text in texts]), encoding="utf-8")
+    return str(path)
+
+
+def test_records_without_id_get_unique_ids_across_sources(tmp_path):
+    first = _legacy_file(tmp_path / "uno.json", ["a", "b"])
+    second = _legacy_file(tmp_path / "dos.json", ["c"])
+    with_ids = tmp_path / "tres.json"
+    with_ids.write_text(json.dumps([{"id": 2, "comentario": "d"}]), encoding="utf-8")
+
+    assert convert([first, second, str(with_ids)], str(tmp_path / "salida.hca")) == 4
+    with ArchiveReader(str(tmp_path / "salida.hca")) as reader:
+        ids = [record["id"] for record in reader]
+    assert sorted(ids) == [2, 3, 4, 5]
+
+
+def test_too_many_categories_is_a_clear_error(tmp_path):
+    records = [{"id": number, "timestamp": None, "comentario_original": "", "comentario_formalizado": None,
+                "categoria": f"c{number}", "tags": []} for number in range(257)]
+    with pytest.raises(ValueError, match="categorías"):
+        write_archive(records, str(tmp_path / "salida.hca"))
@@ -0,0 +1,43 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from flask import Flask
+
+import deadlines
+
+
+@pytest.fixture
+def app():
+    return deadlines.init_app(Flask(__name__))
+
+
+@pytest.mark.parametrize("header, expected", [("0", 0.001), ("-5", 0.001), ("999999999", 10.0), ("2500", 2.5)])
+def test_header_deadline_is_clamped_to_the_configured_one(app, monkeypatch, header, expected):
+    monkeypatch.setattr(deadlines, "REQUEST_DEADLINE_MS", 10000)
+    with app.test_request_context(headers={deadlines.DEADLINE_HEADER: header}):
+        app.preprocess_request()
+        assert deadlines.remaining() == pytest.approx(expected, abs=0.05)
+
+
+def test_background_completions_are_capped(monkeypatch):
+    monkeypatch.setattr(deadlines, "_background_slots", threading.BoundedSemaphore(1))
+    release = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=4)
+    try:
+        deadlines.set_deadline(20)
+        _, first = deadlines.run_within_deadline(executor, release.wait, 5, complete_in_background=True)
+        _, second = deadlines.run_within_deadline(executor, release.wait, 5, complete_in_background=True)
+        assert deadlines.completes_in_background(first)
+        # Sin lugar en segundo plano: la segunda termina con el plazo de la solicitud
+        assert not deadlines.completes_in_background(second)
+        release.set()
+        # Al terminar la primera se libera su lugar (su callback corre en el hilo del pool)
+        executor.shutdown(wait=True)
+        executor = ThreadPoolExecutor(max_workers=1)
+        _, third = deadlines.run_within_deadline(executor, threading.Event().wait, 0.5, complete_in_background=True)
+        assert deadlines.completes_in_background(third)
+    finally:
+        release.set()
+        deadlines.set_deadline(0)
+        executor.shutdown(wait=True)
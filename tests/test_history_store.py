@@ -0,0 +1,135 @@
+import threading
+
+import history_store
+from history_store import HistoryWriter, SegmentedHistory
+
+
+def test_file_lock_only_serializes_the_same_file(tmp_path):
+    held = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        with history_store._file_lock(str(tmp_path / "a")):
+            held.set()
+            release.wait(5)
+
+    def take_other():
+        with history_store._file_lock(str(tmp_path / "b")):
+            acquired.set()
+
+    acquired = threading.Event()
+    thread = threading.Thread(target=hold)
+    thread.start()
+    held.wait(5)
+    try:
+        other = threading.Thread(target=take_other)
+        other.start()
+        other.join(1)
+        assert acquired.is_set()
+    finally:
+        release.set()
+        thread.join()
+
+
+def test_tenants_write_without_waiting_for_each_other(tmp_path):
+    first = SegmentedHistory(str(tmp_path / "uno"))
+    second = SegmentedHistory(str(tmp_path / "dos"))
+    with history_store._file_lock(first.manifest_path):
+        # Con el lock del primer historial tomado, el segundo escribe desde otro hilo
+        done = threading.Event()
+        thread = threading.Thread(target=lambda: (second.append_many([{"timestamp": "2025-08-01T10:00:00"}],
+                                                                        assign_ids=True), done.set()))
+        thread.start()
+        thread.join(5)
+        assert done.is_set()
+    assert second.count() == 1
+
+
+def _failing_once(monkeypatch, obj, name):
+    """Hacer que `obj.name` falle en la primera llamada y funcione después"""
+    original = getattr(obj, name)
+    calls = {"n": 0}
+
+    def wrapper(*args, **kwargs):
+        calls["n"] += 1
+        if calls["n"] == 1:
+            raise OSError("fallo simulado")
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(obj, name, wrapper)
+    return calls
+
+
+def _lines_with_id(store, record_id):
+    return [record for record in store.read_range(superseded=True) if record.get("id") == record_id]
+
+
+def test_writer_retry_does_not_duplicate_a_line_written_before_the_manifest(tmp_path, monkeypatch):
+    store = SegmentedHistory(str(tmp_path))
+    writer = HistoryWriter(store, batch_wait=0.01)
+    record = {"id": writer.allocate_id(), "timestamp": "2025-08-01T10:00:00", "comentario_original": "hola"}
+    # Falla después de escribir la línea del segmento y antes de guardar el manifiesto
+    _failing_once(monkeypatch, store, "_write_manifest")
+    monkeypatch.setattr(history_store.time, "sleep", lambda seconds: None)
+    assert writer.submit(record)
+    writer.flush()
+    writer.close()
+
+    assert len(_lines_with_id(store, record["id"])) == 1
+    assert store.get(record["id"])["comentario_original"] == "hola"
+    assert store.count() == 1
+    assert writer.stats()["registros"] == 1
+    assert writer.stats()["pendientes"] == 0
+
+
+def test_writer_partial_failure_counts_committed_records(tmp_path, monkeypatch):
+    store = SegmentedHistory(str(tmp_path))
+    writer = HistoryWriter(store, batch_wait=0.2)
+    first = {"id": writer.allocate_id(), "timestamp": "2025-08-01T10:00:00"}
+    assert writer.submit(first)
+    writer.flush()
+
+    # El append del lote siguiente funciona y la actualización falla una vez
+    _failing_once(monkeypatch, store, "update_many")
+    monkeypatch.setattr(history_store.time, "sleep", lambda seconds: None)
+    second = {"id": writer.allocate_id(), "timestamp": "2025-08-01T11:00:00"}
+    writer.submit(second)
+    writer.update(first["id"], {"categoria": "Queja"})
+    writer.flush()
+    writer.close()
+
+    stats = writer.stats()
+    assert stats["registros"] == 2
+    assert stats["pendientes"] == 0
+    assert stats["errores"] == 1
+    assert len(_lines_with_id(store, second["id"])) == 1
+    assert store.get(first["id"])["categoria"] == "Queja"
+
+
+def test_writers_and_assign_ids_never_share_an_id(tmp_path):
+    store = SegmentedHistory(str(tmp_path))
+    writers = [HistoryWriter(SegmentedHistory(str(tmp_path)), id_block=4) for _ in range(2)]
+    ids = []
+    for _ in range(6):
+        for writer in writers:
+            ids.append(writer.allocate_id())
+        records = [{"timestamp": "2025-08-01T10:00:00"}]
+        store.append_many(records, assign_ids=True)
+        ids.append(records[0]["id"])
+    for writer in writers:
+        writer.close()
+    assert len(ids) == len(set(ids))
+
+
+def test_read_range_date_only_end_includes_the_whole_day(tmp_path):
+    # Un registro por segmento: el filtro de segmentos también debe respetar el día completo
+    store = SegmentedHistory(str(tmp_path), max_segment_bytes=1)
+    store.append_many([{"timestamp": "2025-08-30T23:59:59"}, {"timestamp": "2025-08-31T00:00:00"},
+                       {"timestamp": "2025-08-31T18:30:00.123456"}, {"timestamp": "2025-09-01T00:00:00"}],
+                      assign_ids=True)
+    assert [record["timestamp"][:10] for record in store.read_range("2025-08-31", "2025-08-31")] == \
+        ["2025-08-31", "2025-08-31"]
+    assert len(store.read_range("2025-08-01", "2025-08-31")) == 3
+    assert [record["timestamp"] for record in store.read_range(end="2025-08-31T18:30")][-1] == \
+        "2025-08-31T18:30:00.123456"
+    assert len(store.read_range(end="2025-08-31T18:29:59")) == 2
@@ -0,0 +1,54 @@
+import threading
+
+import pytest
+
+from idempotency import FileIdempotencyStore, IdempotencyConflict
+
+
+def test_workers_share_responses_through_the_directory(tmp_path):
+    first = FileIdempotencyStore(str(tmp_path))
+    second = FileIdempotencyStore(str(tmp_path))
+    calls = []
+
+    def analyze():
+        calls.append(1)
+        return {"id": 7}, 200
+
+    assert first.run(("default", "comentario", "k"), "huella", analyze) == ({"id": 7}, 200, False)
+    # Otro worker (otra instancia) recibe la respuesta original sin repetir el análisis
+    assert second.run(("default", "comentario", "k"), "huella", analyze) == ({"id": 7}, 200, True)
+    assert len(calls) == 1
+    with pytest.raises(IdempotencyConflict):
+        second.run(("default", "comentario", "k"), "otra huella", analyze)
+
+
+def test_completing_a_request_does_not_purge(tmp_path, monkeypatch):
+    store = FileIdempotencyStore(str(tmp_path))
+    monkeypatch.setattr(store, "purge", lambda: pytest.fail("purga en el camino de la solicitud"))
+    for number in range(150):
+        store.run(("default", "comentario", str(number)), "huella", lambda: ({}, 200))
+
+
+def test_purge_keeps_keys_claimed_again_after_listing(tmp_path, monkeypatch):
+    store = FileIdempotencyStore(str(tmp_path), ttl=0, max_keys=10)
+    store.run(("default", "comentario", "vieja"), "huella", lambda: ({}, 200))
+    store.run(("default", "comentario", "reclamada"), "huella", lambda: ({}, 200))
+    listed = store._entries_on_disk()
+    monkeypatch.setattr(store, "_entries_on_disk", lambda: listed)
+    # Entre el listado y el borrado otra solicitud vuelve a reclamar una de las claves vencidas
+    store.ttl = 60
+    store.run(("default", "comentario", "reclamada"), "huella", lambda: ({"nuevo": True}, 200))
+
+    assert store.purge() == 1
+    assert store.run(("default", "comentario", "reclamada"), "huella", lambda: ({}, 200))[:2] == ({"nuevo": True}, 200)
+
+
+def test_purge_runs_in_the_background(tmp_path, monkeypatch):
+    store = FileIdempotencyStore(str(tmp_path), purge_interval=0.01)
+    purged = threading.Event()
+    monkeypatch.setattr(store, "purge", purged.set)
+    store.start()
+    try:
+        assert purged.wait(2)
+    finally:
+        store.stop()
@@ -0,0 +1,89 @@
+import json
+import multiprocessing
+
+from history_store import SegmentedHistory
+from merkle import MerkleBatcher, leaf_hash, verify_proof
+
+
+def _store_with(tmp_path, count):
+    store = SegmentedHistory(str(tmp_path / "historial"))
+    store.append_many([{"timestamp": f"2025-08-01T10:00:{second:02d}", "comentario": f"texto {second}",
+                        "categoria": "Opinion", "tags": []} for second in range(count)], assign_ids=True)
+    return store
+
+
+def test_workers_sharing_a_directory_seal_distinct_batches(tmp_path):
+    store = _store_with(tmp_path, 3)
+    directory = str(tmp_path / "lotes")
+    first = MerkleBatcher(directory, max_size=100, store=store)
+    second = MerkleBatcher(directory, max_size=100, store=store)
+    # Ambos workers leen los mismos cambios del historial
+    first.sync()
+    second.sync()
+
+    assert first.seal()["id"] == 1
+    # Lo que ya selló el otro worker no se vuelve a anclar
+    assert second.seal() is None
+
+    store.append_many([{"timestamp": "2025-08-01T11:00:00", "comentario": "nuevo",
+                        "categoria": "Opinion", "tags": []}], assign_ids=True)
+    second.sync()
+    batch = second.seal()
+    # El número sigue al último lote en disco aunque lo haya sellado otro worker
+    assert batch["id"] == 2
+    assert [leaf["id"] for leaf in batch["hojas"]] == [4]
+    assert [b["id"] for b in first.recent_batches()] == [2, 1]
+
+
+def test_proof_is_served_from_batches_sealed_by_another_worker(tmp_path):
+    store = _store_with(tmp_path, 3)
+    directory = str(tmp_path / "lotes")
+    sealer = MerkleBatcher(directory, store=store)
+    reader = MerkleBatcher(directory, store=store)
+    sealer.sync()
+    batch = sealer.seal()
+
+    proof = reader.proof(2)
+    assert proof["lote"] == batch["id"]
+    assert reader.get_batch(batch["id"])["raiz"] == batch["raiz"]
+    assert verify_proof(leaf_hash(store.get(2)), proof["prueba"], proof["raiz"])
+
+
+def test_restart_does_not_anchor_records_again(tmp_path):
+    store = _store_with(tmp_path, 3)
+    directory = str(tmp_path / "lotes")
+    batcher = MerkleBatcher(directory, store=store)
+    batcher.sync()
+    batcher.seal()
+
+    restarted = MerkleBatcher(directory, store=store)
+    restarted.sync()
+    assert restarted.seal() is None
+
+
+def _seal_from_another_process(history_dir, directory, start):
+    store = SegmentedHistory(history_dir)
+    batcher = MerkleBatcher(directory, max_size=5, store=store)
+    start.wait(5)
+    batcher.sync()
+    batcher.seal()
+
+
+def test_processes_sealing_at_once_never_share_a_batch_id(tmp_path):
+    store = _store_with(tmp_path, 40)
+    directory = str(tmp_path / "lotes")
+    context = multiprocessing.get_context("fork")
+    start = context.Event()
+    workers = [context.Process(target=_seal_from_another_process, args=(store.directory, directory, start))
+               for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    start.set()
+    for worker in workers:
+        worker.join(10)
+        assert worker.exitcode == 0
+
+    batches = [json.loads(path.read_text(encoding="utf-8")) for path in sorted((tmp_path / "lotes").glob("lote-*.json"))]
+    anchored = [leaf["id"] for batch in batches for leaf in batch["hojas"]]
+    assert [batch["id"] for batch in batches] == list(range(1, len(batches) + 1))
+    assert sorted(anchored) == list(range(1, 41))
@@ -0,0 +1,26 @@
+from concurrent.futures import Future
+
+import pytest
+
+import pipeline
+from deadlines import DeadlineExceeded
+
+
+def test_speculative_title_fix_is_cancelled_when_detection_fails(monkeypatch):
+    launched = []
+
+    def submit(func, title, cancel_event):
+        launched.append(cancel_event)
+        return Future()
+
+    def detect(title):
+        raise DeadlineExceeded("Se agotó el plazo de la solicitud")
+
+    monkeypatch.setattr(pipeline, "is_coherent_text", lambda text: True)
+    monkeypatch.setattr(pipeline, "should_speculate_title_fix", lambda title: True)
+    monkeypatch.setattr(pipeline, "submit_llm_task", submit)
+    monkeypatch.setattr(pipeline, "detect_offensive_title", detect)
+
+    with pytest.raises(DeadlineExceeded):
+        pipeline.analyze_title("Un título cualquiera")
+    assert launched and launched[0].is_set()
@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta
+
+from history_store import SegmentedHistory
+from trending import TrendingTags
+
+
+def _record(tags, **fields):
+    return {"timestamp": (datetime.now() - timedelta(minutes=5)).isoformat(), "categoria": "Queja",
+            "tags": tags, **fields}
+
+
+def _count(trending, tag):
+    return {row["tag"]: row["conteo"] for row in trending.top()}.get(tag, 0)
+
+
+def test_sync_counts_out_of_order_ids_once(tmp_path):
+    store = SegmentedHistory(str(tmp_path))
+    trending = TrendingTags(sync_seconds=0).sync(store)
+    # Bloques de ids de dos workers: el id mayor se confirma antes que el menor
+    store.append_many([_record(["wifi"], id=70)])
+    trending.sync(store)
+    store.append_many([_record(["wifi"], id=5)])
+    trending.sync(store)
+    trending.sync(store)
+    assert _count(trending, "wifi") == 2
+
+
+def test_listener_and_sync_do_not_double_count(tmp_path):
+    store = SegmentedHistory(str(tmp_path))
+    trending = TrendingTags(sync_seconds=0).sync(store)
+    record = _record(["biblioteca"], id=1)
+    store.append_many([record])
+    trending.add([record])
+    trending.sync(store)
+    assert _count(trending, "biblioteca") == 1
+
+
+def test_new_version_replaces_the_counted_record(tmp_path):
+    store = SegmentedHistory(str(tmp_path))
+    store.append_many([_record(["comedor"], id=1)])
+    trending = TrendingTags(sync_seconds=0).sync(store)
+    store.append_many([_record(["comedor"], id=2, version="v2", reemplaza=1)])
+    trending.sync(store)
+    assert _count(trending, "comedor") == 1
+
+
+def test_degraded_record_is_counted_with_its_final_tags(tmp_path):
+    trending = TrendingTags()
+    trending.add([_record([], id=1, pendiente_llm=True)])
+    trending.add([_record(["estacionamiento"], id=1, pendiente_llm=False)])
+    assert _count(trending, "estacionamiento") == 1
@@ -0,0 +1,223 @@
+import os
+import math
+import time
+import threading
+from datetime import datetime, timedelta
+
+from history_store import drop_superseded, normalize_category
+
+TRENDING_BUCKET_SECONDS = int(os.getenv("TRENDING_BUCKET_SECONDS", "3600"))
+TRENDING_WINDOW_HOURS = int(os.getenv("TRENDING_WINDOW_HOURS", str(7 * 24)))
+TRENDING_CAPACITY = int(os.getenv("TRENDING_CAPACITY", "64"))
+# Mínimo de segundos entre lecturas del historial (`sync`)
+TRENDING_SYNC_SECONDS = float(os.getenv("TRENDING_SYNC_SECONDS", "5"))
+
+ALL_CATEGORIES = "todas"
+
+
+class SpaceSaving:
+    """Resumen Space-Saving de elementos frecuentes con a lo sumo `capacity` contadores.
+
+    Cada contador guarda (conteo, error): el conteo real está entre conteo - error y conteo.
+    Cualquier elemento con frecuencia mayor a total / capacity está garantizado en el resumen."""
+
+    __slots__ = ("capacity", "counters", "total", "_floor")
+
+    def __init__(self, capacity=TRENDING_CAPACITY):
+        self.capacity = capacity
+        self.counters = {}  # elemento -> [conteo, error]
+        self.total = 0
+        self._floor = None  # piso fijo de un resumen combinado
+
+    def add(self, item, weight=1):
+        self.total += weight
+        counter = self.counters.get(item)
+        if counter is not None:
+            counter[0] += weight
+        elif len(self.counters) < self.capacity:
+            self.counters[item] = [weight, 0]
+        else:
+            # Reemplazar el contador mínimo: el nuevo hereda su conteo como error
+            victim = min(self.counters, key=lambda key: self.counters[key][0])
+            minimum = self.counters.pop(victim)[0]
+            self.counters[item] = [minimum + weight, minimum]
+
+    def floor(self):
+        """Cota superior del conteo de cualquier elemento que no está en el resumen"""
+        if self._floor is not None:
+            return self._floor
+        if len(self.counters) < self.capacity:
+            return 0
+        return min(counter[0] for counter in self.counters.values())
+
+    @classmethod
+    def merge_all(cls, summaries, capacity):
+        """Combinar resúmenes: un elemento ausente en uno suma el piso de ese resumen como conteo y error"""
+        merged = cls(capacity)
+        floors = [summary.floor() for summary in summaries]
+        base_floor = sum(floors)
+        combined = {}
+        for summary, floor in zip(summaries, floors):
+            merged.total += summary.total
+            for item, (count, error) in summary.counters.items():
+                current = combined.setdefault(item, [base_floor, base_floor])
+                current[0] += count - floor
+                current[1] += error - floor
+        ranked = sorted(combined.items(), key=lambda entry: entry[1][0], reverse=True)
+        merged.counters = dict(ranked[:capacity])
+        merged._floor = max(base_floor, ranked[capacity][1][0]) if len(ranked) > capacity else base_floor
+        return merged
+
+    def upper_bound(self, item):
+        counter = self.counters.get(item)
+        return counter[0] if counter else self.floor()
+
+    def top(self, n=10):
+        """[(elemento, conteo, error)] de mayor a menor"""
+        ranked = sorted(self.counters.items(), key=lambda entry: entry[1][0], reverse=True)[:n]
+        return [(item, count, error) for item, (count, error) in ranked]
+
+
+def _bucket_of(timestamp, bucket_seconds):
+    try:
+        moment = datetime.fromisoformat(timestamp) if timestamp else datetime.now()
+    except (TypeError, ValueError):
+        moment = datetime.now()
+    return int(moment.timestamp()) // bucket_seconds
+
+
+class TrendingTags:
+    """Tags en tendencia sobre una ventana deslizante de buckets de tiempo.
+
+    Cada bucket guarda un resumen Space-Saving para todas las categorías y otro por
+    categoría; los buckets fuera de la ventana se descartan. La memoria de los resúmenes queda
+    acotada por buckets × categorías × capacidad, sin importar el tráfico; además se recuerdan
+    los ids de la ventana para no contar dos veces un análisis que llega por el listener y por
+    `sync`, o una versión nueva (`reemplaza`) del que ya se contó."""
+
+    def __init__(self, bucket_seconds=TRENDING_BUCKET_SECONDS, window_hours=TRENDING_WINDOW_HOURS,
+                 capacity=TRENDING_CAPACITY, sync_seconds=TRENDING_SYNC_SECONDS):
+        self.bucket_seconds = bucket_seconds
+        self.window_buckets = max(1, window_hours * 3600 // bucket_seconds)
+        self.capacity = capacity
+        self.sync_seconds = sync_seconds
+        self._buckets = {}  # índice de bucket -> {categoría: SpaceSaving}
+        self._seen = {}  # id de análisis contado (o reemplazado) -> bucket
+        self._pruned_before = None
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._seq = None  # secuencia del historial ya leída; None antes de la primera lectura
+        self._synced_at = None
+
+    def _current_bucket(self):
+        return int(datetime.now().timestamp()) // self.bucket_seconds
+
+    def _prune(self, current):
+        oldest = current - self.window_buckets + 1
+        if oldest == self._pruned_before:
+            return
+        for bucket in [bucket for bucket in self._buckets if bucket < oldest]:
+            del self._buckets[bucket]
+        self._seen = {record_id: bucket for record_id, bucket in self._seen.items() if bucket >= oldest}
+        self._pruned_before = oldest
+
+    def add(self, records):
+        """Consumir análisis guardados (se usa como listener del escritor del historial, con actualizaciones).
+        Los ids ya contados se ignoran; de un análisis y sus versiones nuevas se cuenta uno solo."""
+        with self._lock:
+            current = self._current_bucket()
+            oldest = current - self.window_buckets + 1
+            for record in drop_superseded(records):
+                bucket = _bucket_of(record.get("timestamp"), self.bucket_seconds)
+                if bucket < oldest:
+                    continue
+                record_id, replaced = record.get("id"), record.get("reemplaza")
+                # Un análisis degradado se cuenta cuando llega su versión final del LLM
+                if record.get("pendiente_llm") or record_id in self._seen or replaced in self._seen:
+                    continue
+                for key in (record_id, replaced):
+                    if key is not None:
+                        self._seen[key] = bucket
+                tags = record.get("tags") or []
+                if not tags:
+                    continue
+                summaries = self._buckets.setdefault(bucket, {})
+                category = normalize_category(record.get("categoria") or "Opinion")
+                for key in (ALL_CATEGORIES, category):
+                    summary = summaries.get(key)
+                    if summary is None:
+                        summary = summaries[key] = SpaceSaving(self.capacity)
+                    for tag in tags:
+                        summary.add(tag)
+            self._prune(current)
+
+    def sync(self, store, force=False):
+        """Consumir lo que cambió en el historial desde la última lectura (también de otros procesos).
+        La primera lectura carga la ventana; después solo los segmentos cambiados (`changes_since`),
+        a lo sumo cada `sync_seconds` salvo con `force`."""
+        with self._sync_lock:
+            if (not force and self._synced_at is not None
+                    and time.monotonic() - self._synced_at < self.sync_seconds):
+                return self
+            if self._seq is None:
+                # La secuencia se toma antes de leer: lo escrito entremedio se vuelve a leer y se ignora
+                seq = store.current_seq()
+                window_start = datetime.now() - timedelta(seconds=self.window_buckets * self.bucket_seconds)
+                self.add(store.read_range(window_start.isoformat()))
+            else:
+                records, seq = store.changes_since(self._seq)
+                self.add(records)
+            self._seq = seq
+            self._synced_at = time.monotonic()
+        return self
+
+    def _merged(self, first_bucket, last_bucket, category):
+        summaries = [summaries[category] for bucket, summaries in self._buckets.items()
+                     if first_bucket <= bucket <= last_bucket and category in summaries]
+        return SpaceSaving.merge_all(summaries, self.capacity)
+
+    def top(self, hours=None, category=None, n=10):
+        """Tags más frecuentes de las últimas `hours` horas (toda la ventana si es None)"""
+        current = self._current_bucket()
+        buckets = self.window_buckets if hours is None else max(1, hours * 3600 // self.bucket_seconds)
+        with self._lock:
+            merged = self._merged(current - buckets + 1, current, category or ALL_CATEGORIES)
+        return [{"tag": tag, "conteo": count, "error": error} for tag, count, error in merged.top(n)]
+
+    def trending(self, recent_hours=24, category=None, n=10, min_count=3):
+        """Tags cuyo conteo reciente supera lo esperado según el resto de la ventana.
+
+        El puntaje es (reciente - esperado) / sqrt(esperado + 1), con la cota inferior del
+        conteo reciente y la cota superior de la línea base escalada a la duración del periodo
+        reciente: un tag solo aparece si su aumento está garantizado por los resúmenes."""
+        current = self._current_bucket()
+        recent_buckets = min(self.window_buckets - 1, max(1, recent_hours * 3600 // self.bucket_seconds))
+        baseline_buckets = self.window_buckets - recent_buckets
+        category = category or ALL_CATEGORIES
+        with self._lock:
+            recent = self._merged(current - recent_buckets + 1, current, category)
+            baseline = self._merged(current - self.window_buckets + 1, current - recent_buckets, category)
+
+        scale = recent_buckets / baseline_buckets if baseline_buckets else 0
+        results = []
+        for tag, count, error in recent.top(self.capacity):
+            guaranteed = count - error
+            expected = baseline.upper_bound(tag) * scale
+            if guaranteed < min_count or guaranteed <= expected:
+                continue
+            results.append({
+                "tag": tag,
+                "reciente": guaranteed,
+                "esperado": round(expected, 2),
+                "puntaje": round((guaranteed - expected) / math.sqrt(expected + 1), 3),
+                "error": error,
+            })
+        results.sort(key=lambda row: row["puntaje"], reverse=True)
+        return results[:n]
+
+    def stats(self):
+        with self._lock:
+            summaries = sum(len(bucket) for bucket in self._buckets.values())
+            counters = sum(len(summary.counters) for bucket in self._buckets.values() for summary in bucket.values())
+        return {"buckets": len(self._buckets), "resumenes": summaries, "contadores": counters,
+                "capacidad": self.capacity, "ventana_buckets": self.window_buckets}